@@ -0,0 +1,89 @@
+"""Compares the former JSON cache files with the binary codec and the SQLite store for a calendar
+of 10k events.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/cachebenchmark.py
+"""
+from adapter import codec
+from adapter.sqlitestore import SQLiteStore
+from datetime import datetime, timedelta
+from dateutil import tz
+import json
+from models.events import AllCalendarEvents, CalendarEvents, Event
+import os
+import tempfile
+import timeit
+
+
+EVENT_COUNT = 10000
+REPEAT = 15
+
+
+def create_all_events(count: int) -> AllCalendarEvents:
+    start = datetime(2025, 11, 17, 8, 0, tzinfo = tz.tzlocal())
+    events = [Event(start = start + timedelta(hours = n), end = start + timedelta(hours = n, minutes = 45), name = f'Booking {n}')
+              for n in range(0, count)]
+    all_events = AllCalendarEvents()
+    all_events.events['Hall'] = CalendarEvents(name = 'Hall', events = events)
+    return all_events
+
+
+def measure(function) -> float:
+    """Returns the best time of several runs in milliseconds.
+    """
+    return min(timeit.repeat(function, number = 1, repeat = REPEAT)) * 1000
+
+
+def measure_alternately(functions: list) -> list[float]:
+    """Returns the best time of several runs of each function in milliseconds. The functions are run in
+    turns, so that a busy machine slows all of them down alike.
+    """
+    best = [float('inf')] * len(functions)
+    for _ in range(0, REPEAT):
+        for n, function in enumerate(functions):
+            best[n] = min(best[n], timeit.timeit(function, number = 1))
+    return [b * 1000 for b in best]
+
+
+def main():
+    all_events = create_all_events(EVENT_COUNT)
+    events = all_events.events['Hall'].events
+
+    # JSON, as the cache files have been written and read before
+    json_text = json.dumps(all_events.model_dump(mode = 'json'))
+    json_dump = measure(lambda: json.dumps(all_events.model_dump(mode = 'json')))
+
+    # binary codec, one encoded event per row of the store
+    rows = [codec.encode_event(e) for e in events]
+    binary_dump = measure(lambda: [codec.encode_event(e) for e in events])
+
+    json_load, binary_load = measure_alternately([lambda: AllCalendarEvents(**json.loads(json_text)),
+                                                  lambda: [codec.decode_event(r) for r in rows]])
+
+    # SQLite store, a complete write and a cold start read of the calendar
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = SQLiteStore(temp_dir)
+        store_write = measure(lambda: (store.update_calendar_events(AllCalendarEvents(), 'ical'),
+                                       store.update_calendar_events(all_events, 'ical')))
+
+        def read_cold() -> None:
+            # a new store reads the database, the long-lived one only its memory
+            cold_store = SQLiteStore(temp_dir)
+            cold_store.read_calendar_events(source = 'ical')
+            cold_store.close()
+
+        store_read = measure(read_cold)
+        store.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        store_size = os.path.getsize(store.file_name)
+        store.close()
+
+    print(f'{EVENT_COUNT} events, best of {REPEAT} runs')
+    print(f'{"":<10} {"dump ms":>10} {"load ms":>10} {"bytes":>10}')
+    print(f'{"json":<10} {json_dump:>10.1f} {json_load:>10.1f} {len(json_text.encode("utf-8")):>10}')
+    print(f'{"binary":<10} {binary_dump:>10.1f} {binary_load:>10.1f} {sum(len(r) for r in rows):>10}')
+    print(f'{"sqlite":<10} {store_write:>10.1f} {store_read:>10.1f} {store_size:>10}')
+
+
+if __name__ == '__main__':
+    main()
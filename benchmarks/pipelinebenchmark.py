@@ -0,0 +1,279 @@
+"""Measures the stages of the scheduling pipeline with generated workloads and saves the results as
+JSON, so regressions between versions become visible.
+
+Run from the repository root, optionally comparing with the results of an earlier version:
+
+    PYTHONPATH=src python benchmarks/pipelinebenchmark.py [--workload NAME] [--compare FILE]
+
+The results are written to `benchmarks/results/<version>-<timestamp>.json`, the version is the one of
+`config.yaml`. The workloads differ in the number of calendars, events per week and zones, and
+include densely overlapping events and a week in which daylight saving time ends. The time zone is
+fixed to Europe/Berlin, so that the results do not depend on the machine.
+
+`Worker.execute` runs against a stand-in of tado° and iCal calendars in local files, with a full
+update, so that every run fetches, parses, generates and pushes all schedules. It works on the
+current week, as the worker does. The stages ending in `_grid` use the grid engine of
+`models.weekgrid` instead of inserting blocks, after checking that both engines agree.
+"""
+import os
+import time
+
+os.environ['TZ'] = 'Europe/Berlin'
+time.tzset()
+
+from adapter.event_generator import EventGenerator
+from adapter.ical_retriever import get_events_from_ics, parse_ics_events
+from adapter.sqlitestore import SQLiteStore
+import argparse
+import asyncio
+from datetime import date, datetime, timedelta
+from dateutil import tz
+from icalendar import Calendar
+import json
+from models.events import AllCalendarEvents, CalendarEvents, Event
+from models.schedules import Block, DailySchedule, get_weekly_schedules
+from models.settings import CoreSettings
+from models.weekgrid import get_weekly_schedules_for_zones
+import platform
+import random
+from services.core import Message, Worker
+import tempfile
+import timeit
+from typing import NamedTuple
+import yaml
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'results')
+REPEAT = 5
+# relative slowdown of a stage that is reported as a regression
+REGRESSION_THRESHOLD = 0.2
+MIDNIGHT = datetime.min.time()
+EARLYSTART = MIDNIGHT.replace(minute = 30)
+
+
+class Workload(NamedTuple):
+    calendars: int
+    events_per_week: int
+    zones: int
+    # the longest event in minutes, events of a calendar overlap when they are longer than their distance
+    max_minutes: int
+    from_date: date
+
+
+WORKLOADS = {
+    'small': Workload(calendars = 2, events_per_week = 20, zones = 4, max_minutes = 90, from_date = date(2025, 11, 17)),
+    'large': Workload(calendars = 16, events_per_week = 200, zones = 32, max_minutes = 45, from_date = date(2025, 11, 17)),
+    'dense': Workload(calendars = 4, events_per_week = 400, zones = 8, max_minutes = 240, from_date = date(2025, 11, 17)),
+    # daylight saving time ends on Sunday, 2025-10-26
+    'dst': Workload(calendars = 8, events_per_week = 100, zones = 16, max_minutes = 180, from_date = date(2025, 10, 23)),
+}
+
+
+class StandInTadoAdapter:
+    """Accepts the schedules like tado° would, without sending them anywhere.
+    """
+
+    def __init__(self):
+        self.writes = 0
+
+    def get_zone_id(self, zone_name: str) -> int:
+        return int(zone_name.split(' ')[-1])
+
+    async def set_timetable_for_zone(self, zone_name: str, zone_id: int) -> None:
+        pass
+
+    async def set_schedule_for_zone_and_day(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule) -> None:
+        self.writes += 1
+
+
+def create_events(workload: Workload, calendar: int, from_date: date) -> list[Event]:
+    """Returns the events of a calendar in the week from `from_date`, in random but reproducible times.
+    """
+    rng = random.Random(calendar)
+    start = datetime.combine(from_date, MIDNIGHT)
+    events = []
+    for n in range(0, workload.events_per_week):
+        # 5 minute steps between 6:00 and 23:55, as bookings are made, some end on the next day
+        event_start = start + timedelta(days = rng.randrange(0, 7), minutes = 360 + 5 * rng.randrange(0, 216))
+        event_end = event_start + timedelta(minutes = 5 * rng.randrange(3, workload.max_minutes // 5 + 1))
+        events.append(Event(start = event_start.replace(tzinfo = tz.tzlocal()), end = event_end.replace(tzinfo = tz.tzlocal()),
+                            name = f'Booking {n} of calendar {calendar}'))
+    return sorted(events, key = lambda e: e.start)
+
+
+def create_ics(events: list[Event]) -> bytes:
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for n, e in enumerate(events):
+        lines += ['BEGIN:VEVENT', f'UID:{n}',
+                  f'DTSTART:{e.start.strftime("%Y%m%dT%H%M%S")}',
+                  f'DTEND:{e.end.strftime("%Y%m%dT%H%M%S")}',
+                  f'SUMMARY:{e.name}', 'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines).encode('utf-8')
+
+
+def get_calendar_names(workload: Workload, zone: int) -> list[str]:
+    # each zone uses two calendars, so that their events overlap as well
+    return [f'Calendar {zone % workload.calendars}', f'Calendar {(zone + 1) % workload.calendars}']
+
+
+def create_settings(workload: Workload, ics_dir: str, schedule_engine: str = 'blocks') -> CoreSettings:
+    return CoreSettings(
+        schedule_engine = schedule_engine,
+        schedules = [{ 'name': f'Schedule {n}', 'start': '18:00', 'end': '21:30', 'days_of_week': 'Mon-Wed,Fri' }
+                     for n in range(0, workload.calendars)],
+        ical_calendars = [{ 'name': f'Calendar {n}', 'source': os.path.join(ics_dir, f'calendar-{n}.ics') }
+                          for n in range(0, workload.calendars)],
+        heating = { 'warm': 20.0, 'cold': 16.0, 'earlystart': '00:30' },
+        assignments = [{ 'tadozone': f'Zone {zone}', 'calendar_names': get_calendar_names(workload, zone) + [f'Schedule {zone % workload.calendars}'] }
+                       for zone in range(0, workload.zones)])
+
+
+def measure(function) -> float:
+    """Returns the best time of several runs in milliseconds.
+    """
+    return min(timeit.repeat(function, number = 1, repeat = REPEAT)) * 1000
+
+
+def run_workload(workload: Workload) -> dict[str, float]:
+    from_date = workload.from_date
+    to_date = from_date + timedelta(days = 6)
+    events = [create_events(workload, calendar, from_date) for calendar in range(0, workload.calendars)]
+    sources = [create_ics(e) for e in events]
+    all_events = AllCalendarEvents()
+    for calendar, calendar_events in enumerate(events):
+        all_events.events[f'Calendar {calendar}'] = CalendarEvents(name = f'Calendar {calendar}', events = calendar_events)
+    zone_events = [all_events.select_events(get_calendar_names(workload, zone)) for zone in range(0, workload.zones)]
+
+    # the blocks that `DailySchedule.from_events` inserts for the first day of each zone
+    day_start = datetime.combine(from_date, MIDNIGHT).replace(tzinfo = tz.tzlocal())
+    day_end = day_start + timedelta(days = 1)
+    day_blocks = [[Block(start = MIDNIGHT if e.start <= day_start else e.start.time(),
+                         end = MIDNIGHT if e.end >= day_end else e.end.time(), temperature = 20.0)
+                   for e in events if e.start < day_end and e.end > day_start]
+                  for events in zone_events]
+
+    def insert_blocks() -> None:
+        for blocks in day_blocks:
+            schedule = DailySchedule(blocks = { MIDNIGHT: Block(temperature = 16.0) })
+            for b in blocks:
+                schedule.insert_block(b.model_copy())
+
+    if get_weekly_schedules_for_zones(from_date, [(e, 20.0, 16.0, EARLYSTART) for e in zone_events]) != \
+            [get_weekly_schedules(from_date, e, 20.0, 16.0, EARLYSTART) for e in zone_events]:
+        raise AssertionError('the grid engine calculated other schedules')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ics_dir = os.path.join(temp_dir, 'ics')
+        os.makedirs(ics_dir)
+        settings = create_settings(workload, ics_dir)
+        generator = EventGenerator(settings.schedules)
+
+        results = {
+            'generate_events': measure(lambda: generator.generate_events(from_date, to_date)),
+            'parse_ics': measure(lambda: [get_events_from_ics(Calendar.from_ical(data)) for data in sources]),
+            'parse_ics_encoded': measure(lambda: [parse_ics_events(data, from_date, to_date) for data in sources]),
+            'from_events': measure(lambda: [get_weekly_schedules(from_date, e, 20.0, 16.0, EARLYSTART)
+                                            for e in zone_events]),
+            'from_events_grid': measure(lambda: get_weekly_schedules_for_zones(from_date, [(e, 20.0, 16.0, EARLYSTART)
+                                                                                           for e in zone_events])),
+            'insert_block': measure(insert_blocks),
+        }
+
+        store = SQLiteStore(temp_dir)
+        try:
+            # a complete write of changed calendars and a cold start read
+            results['cache_write'] = measure(lambda: (store.update_calendar_events(AllCalendarEvents(), 'ical'),
+                                                      store.update_calendar_events(all_events, 'ical')))
+
+            def read_cold() -> None:
+                cold_store = SQLiteStore(temp_dir)
+                cold_store.read_calendar_events(source = 'ical')
+                cold_store.close()
+
+            results['cache_read'] = measure(read_cold)
+        finally:
+            store.close()
+
+        # the worker looks at the current week
+        today = datetime.now().date()
+        for calendar in range(0, workload.calendars):
+            with open(os.path.join(ics_dir, f'calendar-{calendar}.ics'), 'wb') as stream:
+                stream.write(create_ics(create_events(workload, calendar, today)))
+
+        for stage, worker_settings in (('worker_execute', settings),
+                                       ('worker_execute_grid', create_settings(workload, ics_dir, 'grid'))):
+            with tempfile.TemporaryDirectory() as worker_dir:
+                worker_store = SQLiteStore(worker_dir)
+                try:
+                    def execute() -> None:
+                        # a new worker has no recently polled sources, so it fetches all of them
+                        worker = Worker(worker_settings, StandInTadoAdapter(), worker_store, home = 'benchmark')
+                        asyncio.run(worker.execute(Message(full_update = True)))
+
+                    results[stage] = measure(execute)
+                finally:
+                    worker_store.close()
+
+    return results
+
+
+def get_version() -> str:
+    with open(os.path.join(ROOT_DIR, 'config.yaml'), 'r', encoding='utf-8') as stream:
+        return str(yaml.safe_load(stream)['version'])
+
+
+def compare(results: dict[str, dict[str, float]], baseline_file: str) -> None:
+    with open(baseline_file, 'r', encoding='utf-8') as stream:
+        baseline = json.load(stream)
+    print(f'\nCompared with {baseline["version"]} of {baseline["timestamp"]}')
+    print(f'{"workload":<10} {"stage":<20} {"before ms":>10} {"ms":>10} {"change":>8}')
+    for name, stages in results.items():
+        for stage, duration in stages.items():
+            before = baseline['results'].get(name, {}).get(stage)
+            if not before:
+                continue
+            change = duration / before - 1
+            flag = '  regression' if change > REGRESSION_THRESHOLD else ''
+            print(f'{name:<10} {stage:<20} {before:>10.1f} {duration:>10.1f} {change:>+8.0%}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmarks the scheduling pipeline with generated workloads.')
+    parser.add_argument('--workload', action = 'append', choices = list(WORKLOADS), help = 'workloads to run, by default all')
+    parser.add_argument('--compare', help = 'results of an earlier run to compare with')
+    parser.add_argument('--output', default = RESULTS_DIR, help = 'directory of the results')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.workload or list(WORKLOADS):
+        workload = WORKLOADS[name]
+        print(f'{name}: {workload.calendars} calendars of {workload.events_per_week} events per week, {workload.zones} zones, best of {REPEAT} runs')
+        results[name] = run_workload(workload)
+        for stage, duration in results[name].items():
+            print(f'  {stage:<20} {duration:>10.1f} ms')
+
+    version = get_version()
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    os.makedirs(args.output, exist_ok = True)
+    file_name = os.path.join(args.output, f'{version}-{timestamp}.json')
+    with open(file_name, 'w', encoding='utf-8') as stream:
+        json.dump({
+            'version': version,
+            'timestamp': timestamp,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeat': REPEAT,
+            'workloads': { name: WORKLOADS[name]._asdict() for name in results },
+            'results': results,
+        }, stream, indent = 2, default = str)
+    print(f'Wrote {file_name}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Measures parsing iCal calendars and generating the schedules of many zones in the event loop
+process and in process pools of 1 to N workers.
+
+Run from the repository root, optionally with the maximum number of workers:
+
+    PYTHONPATH=src python benchmarks/poolbenchmark.py [N]
+
+The pools are started before measuring, as they are kept for the lifetime of the service. Scaling
+needs as many free cores as workers.
+"""
+from adapter.ical_retriever import get_events_from_ics, parse_ics_events
+from concurrent.futures import Executor, wait
+from datetime import date, datetime, time, timedelta
+from icalendar import Calendar
+from models.schedules import get_weekly_schedules
+import os
+from services.pool import create_executor, generate_daily_schedules
+import sys
+import timeit
+
+
+SOURCE_COUNT = 8
+EVENTS_PER_SOURCE = 2000
+ZONE_COUNT = 32
+FROM_DATE = date(2025, 11, 17)
+TO_DATE = FROM_DATE + timedelta(days = 6)
+REPEAT = 3
+
+
+def create_ics(source: int, count: int) -> bytes:
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    start = datetime(2025, 11, 17, 6, 0)
+    for n in range(0, count):
+        # bookings every 97 minutes, most of them outside the week of interest
+        event_start = start + timedelta(minutes = 97 * n + source)
+        lines += ['BEGIN:VEVENT', f'UID:{source}-{n}',
+                  f'DTSTART:{event_start.strftime("%Y%m%dT%H%M%S")}',
+                  f'DTEND:{(event_start + timedelta(minutes = 45)).strftime("%Y%m%dT%H%M%S")}',
+                  f'SUMMARY:Booking {n} of source {source}', 'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines).encode('utf-8')
+
+
+def run_in_process(sources: list[bytes]) -> None:
+    events = [[e for e in get_events_from_ics(Calendar.from_ical(data)) if e.start.date() <= TO_DATE and e.end.date() >= FROM_DATE]
+              for data in sources]
+    for zone in range(0, ZONE_COUNT):
+        get_weekly_schedules(FROM_DATE, events[zone % SOURCE_COUNT], 20.0, 16.0, time(0, 30))
+
+
+def run_in_pool(executor: Executor, sources: list[bytes]) -> None:
+    parsed = [executor.submit(parse_ics_events, data, FROM_DATE, TO_DATE) for data in sources]
+    events = [future.result() for future in parsed]
+    wait([executor.submit(generate_daily_schedules, events[zone % SOURCE_COUNT], FROM_DATE, 20.0, 16.0, time(0, 30))
+          for zone in range(0, ZONE_COUNT)])
+
+
+def measure(function) -> float:
+    """Returns the best time of several runs in milliseconds.
+    """
+    return min(timeit.repeat(function, number = 1, repeat = REPEAT)) * 1000
+
+
+def main(max_workers: int):
+    sources = [create_ics(source, EVENTS_PER_SOURCE) for source in range(0, SOURCE_COUNT)]
+    print(f'{SOURCE_COUNT} sources of {EVENTS_PER_SOURCE} events, {ZONE_COUNT} zones, best of {REPEAT} runs, {os.cpu_count()} cores')
+    print(f'{"workers":<10} {"ms":>10} {"speedup":>10}')
+    baseline = measure(lambda: run_in_process(sources))
+    print(f'{"none":<10} {baseline:>10.1f} {1.0:>10.2f}')
+
+    for workers in range(1, max_workers + 1):
+        executor = create_executor(workers)
+        try:
+            # start the workers before measuring
+            wait([executor.submit(abs, 0) for _ in range(0, workers)])
+            duration = measure(lambda: run_in_pool(executor, sources))
+        finally:
+            executor.shutdown()
+        print(f'{workers:<10} {duration:>10.1f} {baseline / duration:>10.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1)
@@ -0,0 +1,124 @@
+from datetime import date, datetime, timedelta
+from dateutil import tz
+from typing import Any, Optional
+
+
+def get_local_dates(booking: dict[str, Any]) -> tuple[date, date]:
+    """Returns the local start and end date of a booking record.
+    """
+    start = datetime.fromisoformat(booking['start']).astimezone(tz.tzlocal())
+    end = datetime.fromisoformat(booking['end']).astimezone(tz.tzlocal())
+    return (start.date(), end.date())
+
+
+class BookingsWindow:
+    """Keeps the bookings of a sliding window of days, so that a poll only needs to fetch the days newly
+    entering the window and a short "hot" range of days near now, which are most likely to change.
+    A periodic full refresh catches changes of the other days.
+
+    The bookings are compact records with the keys 'key', 'resource_id', 'start', 'end' and 'caption',
+    where 'key' identifies the occurrence of a possibly repeated booking.
+    """
+    resource_ids: list[int]
+    covered_from: Optional[date]
+    covered_to: Optional[date]
+    full_refresh_at: float
+    bytes_per_day: float
+    bookings: dict[str, dict[str, Any]]
+
+    def __init__(self):
+        self.resource_ids = []
+        self.covered_from = None
+        self.covered_to = None
+        self.full_refresh_at = 0.0
+        self.bytes_per_day = 0.0
+        self.bookings = {}
+
+    def get_ranges_to_fetch(self, resource_ids: list[int], from_date: date, to_date: date,
+                            hot_days: int, full_refresh_seconds: float, now: float) -> list[tuple[date, date]]:
+        """Determines the ranges of days to be fetched in order to cover the window from `from_date` to `to_date`.
+
+        Args:
+            resource_ids (list[int]): The ids of the resources whose bookings are needed.
+            from_date (date): The first day of the window.
+            to_date (date): The last day of the window.
+            hot_days (int): The number of days beginning with `from_date` that are always fetched.
+            full_refresh_seconds (float): The time after which the whole window is fetched again.
+            now (float): The current time as returned by time.time().
+
+        Returns:
+            list[tuple[date, date]]: The ranges of days to be fetched, each with its first and last day.
+        """
+        if resource_ids != self.resource_ids or \
+            self.covered_from is None or self.covered_from > from_date or \
+            self.covered_to < from_date - timedelta(days = 1) or \
+            now - self.full_refresh_at >= full_refresh_seconds:
+            return [(from_date, to_date)]
+
+        ranges = []
+        if hot_days > 0:
+            ranges.append((from_date, min(to_date, from_date + timedelta(days = hot_days - 1))))
+        if self.covered_to < to_date:
+            ranges.append((max(from_date, self.covered_to + timedelta(days = 1)), to_date))
+
+        # combine overlapping or adjacent ranges into a single request
+        merged = []
+        for r in ranges:
+            if merged and r[0] <= merged[-1][1] + timedelta(days = 1):
+                merged[-1] = (merged[-1][0], max(merged[-1][1], r[1]))
+            else:
+                merged.append(r)
+        return merged
+
+    def update(self, from_date: date, to_date: date, bookings: list[dict[str, Any]]) -> None:
+        """Replaces all bookings touching the range of days by the ones fetched for this range.
+        """
+        for key, booking in list(self.bookings.items()):
+            start, end = get_local_dates(booking)
+            if start <= to_date and end >= from_date:
+                del self.bookings[key]
+
+        for booking in bookings:
+            self.bookings[booking['key']] = booking
+
+        self.covered_from = min(self.covered_from, from_date) if self.covered_from else from_date
+        self.covered_to = max(self.covered_to, to_date) if self.covered_to else to_date
+
+    def slide(self, from_date: date) -> None:
+        """Drops all bookings that have ended before the first day of the window.
+        """
+        for key, booking in list(self.bookings.items()):
+            if get_local_dates(booking)[1] < from_date:
+                del self.bookings[key]
+
+        if self.covered_from and self.covered_from < from_date:
+            self.covered_from = from_date
+
+    def select(self, from_date: date, to_date: date) -> list[dict[str, Any]]:
+        selected = []
+        for booking in self.bookings.values():
+            start, end = get_local_dates(booking)
+            if start <= to_date and end >= from_date:
+                selected.append(booking)
+        return sorted(selected, key = lambda b: b['start'])
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            'resource_ids': self.resource_ids,
+            'covered_from': self.covered_from.isoformat() if self.covered_from else None,
+            'covered_to': self.covered_to.isoformat() if self.covered_to else None,
+            'full_refresh_at': self.full_refresh_at,
+            'bytes_per_day': self.bytes_per_day,
+            'bookings': list(self.bookings.values())
+        }
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]):
+        window = BookingsWindow()
+        window.resource_ids = data['resource_ids']
+        window.covered_from = date.fromisoformat(data['covered_from']) if data['covered_from'] else None
+        window.covered_to = date.fromisoformat(data['covered_to']) if data['covered_to'] else None
+        window.full_refresh_at = data['full_refresh_at']
+        window.bytes_per_day = data['bytes_per_day']
+        window.bookings = { b['key']: b for b in data['bookings'] }
+        return window
@@ -1,71 +1,301 @@
 from churchtools import ChurchTools # https://pypi.org/project/churchtools/
-from churchtools.models.resource import Booking
+from adapter.bookingswindow import BookingsWindow
+from adapter.sqlitestore import SQLiteStore
+from adapter.tado import DEFAULT_DATA_DIR
+from churchtools.models.resource import Resource
 from datetime import date, datetime
 from dateutil import tz
 import json
 import logging, logging.handlers
 from models.events import AllCalendarEvents, Event, CalendarEvents
 from models.settings import ChurchToolsSettings
+from services import metrics, recording
 import os
-from typing import Optional
+import requests
+import time
+from typing import Any, Optional
+from urllib.parse import urljoin
 
 
-class ResourceBookingsRetriever:
+class ChurchToolsSession:
+    """A long-lived session with the ChurchTools API.
+
+    Authenticates either with a login token or with username and password. The login cookie is saved in
+    the data directory and reused across polls and restarts; when ChurchTools rejects it, the session
+    logs in again and repeats the request once. The resource masterdata is cached in memory and in the
+    data directory for `masterdata_cache_hours`.
+    """
     logger: logging.Logger = logging.getLogger(__name__)
     settings: ChurchToolsSettings
-    ct: ChurchTools = None
-    cached_resources: Optional[list[any]] = None
-
-    def __init__(self, settings: ChurchToolsSettings):
+    data_dir: str
+    http: requests.Session
+    cookie: Optional[dict[str, str]] = None
+    cached_resources: Optional[list[Resource]] = None
+    resources_fetched_at: float = 0.0
+    resource_ids_by_name: dict[str, int] = {}
+    bookings_window: Optional[BookingsWindow] = None
+    last_response_size: int = 0
+
+    def __init__(self, settings: ChurchToolsSettings, data_dir: str = DEFAULT_DATA_DIR):
         self.settings = settings
+        self.data_dir = data_dir
+        self.http = requests.Session()
+
+        if settings.token:
+            self.http.headers['Authorization'] = f'Login {settings.token}'
+        else:
+            self.cookie = self._read_cookie_from_cache()
+
+
+    def request(self, endpoint: str, params: list[tuple[str, Any]] = None) -> Any:
+        """Sends a GET request to the ChurchTools API, logging in again if the session has expired.
+
+        Args:
+            endpoint (str): The endpoint of the API, e.g. 'bookings'.
+            params (list[tuple[str, Any]], optional): The query parameters. Defaults to None.
+
+        Returns:
+            Any: The parsed JSON response.
+        """
+        if not self.settings.token and not self.cookie:
+            self.login()
+
+        response = self._get(endpoint, params)
+        if response.status_code == 401 and not self.settings.token:
+            self.logger.info('ChurchTools session has expired.')
+            self.login()
+            response = self._get(endpoint, params)
+
+        response.raise_for_status()
+        self.last_response_size = len(response.content)
+        return response.json()
+
+    def _get(self, endpoint: str, params: list[tuple[str, Any]]) -> requests.Response:
+        url = urljoin(self.settings.url, 'api/') + endpoint
+        with metrics.record_api_call('churchtools'):
+            response = self.http.get(url, params = params, cookies = self.cookie, timeout = self.settings.timeout_seconds or 30)
+        if response.status_code >= 400:
+            metrics.API_ERRORS.inc(api = 'churchtools')
+        return response
+
+    def login(self) -> None:
+        ct = self._create_client()
+        with metrics.record_api_call('churchtools'):
+            logged_in = ct.login(self.settings.username, self.settings.password)
+        if not logged_in:
+            metrics.API_ERRORS.inc(api = 'churchtools')
+            raise PermissionError(f'Login to ChurchTools "{self.settings.url}" as "{self.settings.username}" failed.')
+        self.logger.debug('Logged in to ChurchTools: %s', self.settings.url)
+
+        self.cookie = ct.get_login_cookie()
+        self._write_cookie_to_cache(self.cookie)
+
+    def _create_client(self) -> ChurchTools:
+        return ChurchTools(self.settings.url)
+
+
+    def get_resources(self) -> list[Resource]:
+        """Returns the resources from the masterdata, which are cached for `masterdata_cache_hours`.
+        """
+        max_age = self.settings.masterdata_cache_hours * 3600
+        if self.cached_resources is None:
+            fetched_at, resources = self._read_resources_from_cache()
+            if resources is not None:
+                self._set_resources(fetched_at, resources)
+
+        expired = self.cached_resources is None or time.time() - self.resources_fetched_at > max_age
+        metrics.record_cache_lookup('masterdata', not expired)
+        if expired:
+            self.logger.debug('Getting resources from masterdata')
+            res = self.request('resource/masterdata')
+            self._set_resources(time.time(), [Resource(**r) for r in res.get('data', {}).get('resources', [])])
+            self.logger.debug('resources: %s', self.cached_resources)
+            self._write_resources_to_cache(self.resources_fetched_at, self.cached_resources)
+
+        return self.cached_resources
+
+    def _set_resources(self, fetched_at: float, resources: list[Resource]) -> None:
+        self.resources_fetched_at = fetched_at
+        self.cached_resources = resources
+        self.resource_ids_by_name = { r.name: r.id for r in resources }
+
+    def get_resource_ids_by_name(self) -> dict[str, int]:
+        # recorded or taken from the recording with the bookings, see `services.recording`
+        return recording.capture('churchtools_resources', self.settings.url, self._get_resource_ids_by_name)
+
+    def _get_resource_ids_by_name(self) -> dict[str, int]:
+        self.get_resources()
+        return self.resource_ids_by_name
+
+    def get_bookings(self, resource_ids: list[int], status_ids: list[int], from_: date, to: date) -> list[dict[str, Any]]:
+        """Gets the bookings of the given resources as compact records (see `BookingsWindow`).
+
+        The bookings are kept in a sliding window in memory and in the data directory. Only the days
+        newly entering the window and the `hot_days` beginning with `from_` are fetched, unless a full
+        refresh is due after `full_refresh_minutes`. While recording or replaying a run, see `services.recording`,
+        the bookings are recorded or taken from the recording.
+        """
+        return recording.capture('churchtools_bookings', self.settings.url,
+                                 lambda: self._get_bookings(resource_ids, status_ids, from_, to))
+
+    def _get_bookings(self, resource_ids: list[int], status_ids: list[int], from_: date, to: date) -> list[dict[str, Any]]:
+        window = self._get_bookings_window()
+        ranges = window.get_ranges_to_fetch(resource_ids, from_, to,
+                                            self.settings.hot_days, self.settings.full_refresh_minutes * 60, time.time())
+        full_refresh = ranges == [(from_, to)]
+        window_days = (to - from_).days + 1
+
+        started_at = time.monotonic()
+        fetched_bytes = 0
+        fetched_days = 0
+        for range_from, range_to in ranges:
+            window.update(range_from, range_to, self._fetch_bookings(resource_ids, status_ids, range_from, range_to))
+            fetched_bytes += self.last_response_size
+            fetched_days += (range_to - range_from).days + 1
+        duration = time.monotonic() - started_at
+
+        window.slide(from_)
+        if full_refresh:
+            window.resource_ids = resource_ids
+            window.full_refresh_at = time.time()
+            window.bytes_per_day = fetched_bytes / window_days
+
+        saved_bytes = max(0, int(window.bytes_per_day * window_days) - fetched_bytes)
+        self.logger.info('Fetched bookings of %d of %d days in %.0f ms (%d bytes, %d bytes saved)%s',
+                         fetched_days, window_days, duration * 1000, fetched_bytes, saved_bytes,
+                         ', full refresh' if full_refresh else '')
+
+        self._write_json(self.bookings_cache_file_name(), { 'url': self.settings.url } | window.to_json())
+        return window.select(from_, to)
+
+    def request_full_refresh(self) -> None:
+        """Fetches all days of the bookings window on the next call of `get_bookings`, e.g. after ChurchTools
+        reported a change.
+        """
+        self._get_bookings_window().full_refresh_at = 0.0
+
+    def _get_bookings_window(self) -> BookingsWindow:
+        if not self.bookings_window:
+            data = self._read_json(self.bookings_cache_file_name())
+            self.bookings_window = BookingsWindow.from_json(data) \
+                if data and data.get('url') == self.settings.url else BookingsWindow()
+        return self.bookings_window
+
+    def _fetch_bookings(self, resource_ids: list[int], status_ids: list[int], from_: date, to: date) -> list[dict[str, Any]]:
+        params = [('resource_ids[]', id) for id in resource_ids] + \
+                 [('status_ids[]', id) for id in status_ids] + \
+                 [('from', from_.isoformat()), ('to', to.isoformat())]
+        res = self.request('bookings', params)
+
+        bookings = []
+        for item in res.get('data', []):
+            if 'base' in item:
+                # the calculated dates are the ones of the actual occurrence of a repeated booking
+                dates = item.get('calculated') or item['base']
+                bookings.append({ 'key': f'{item["base"]["id"]}@{dates["startDate"]}',
+                                  'resource_id': item['base']['resource']['id'],
+                                  'start': dates['startDate'],
+                                  'end': dates['endDate'],
+                                  'caption': item['base']['caption'] })
+        return bookings
+
+
+    def cookie_cache_file_name(self) -> str:
+        return os.path.join(self.data_dir, 'churchtools_session.json')
+
+    def masterdata_cache_file_name(self) -> str:
+        return os.path.join(self.data_dir, 'churchtools_masterdata.json')
+
+    def bookings_cache_file_name(self) -> str:
+        return os.path.join(self.data_dir, 'churchtools_bookings.json')
+
+    def _read_cookie_from_cache(self) -> Optional[dict[str, str]]:
+        data = self._read_json(self.cookie_cache_file_name())
+        if data and data.get('url') == self.settings.url and data.get('username') == self.settings.username:
+            return data.get('cookie')
+        return None
+
+    def _write_cookie_to_cache(self, cookie: dict[str, str]) -> None:
+        self._write_json(self.cookie_cache_file_name(),
+                         { 'url': self.settings.url, 'username': self.settings.username, 'cookie': cookie })
+
+    def _read_resources_from_cache(self) -> tuple[float, Optional[list[Resource]]]:
+        data = self._read_json(self.masterdata_cache_file_name())
+        if data and data.get('url') == self.settings.url:
+            return (data['fetched_at'], [Resource(**r) for r in data['resources']])
+        return (0.0, None)
+
+    def _write_resources_to_cache(self, fetched_at: float, resources: list[Resource]) -> None:
+        self._write_json(self.masterdata_cache_file_name(),
+                         { 'url': self.settings.url, 'fetched_at': fetched_at,
+                           'resources': [r.model_dump(mode = 'json') for r in resources] })
+
+    def _read_json(self, file_name: str) -> Optional[dict[str, Any]]:
+        try:
+            with open(file_name, 'r', encoding='utf-8') as stream:
+                return json.load(stream)
+
+        except FileNotFoundError as exc:
+            return None
+
+        except json.JSONDecodeError as exc:
+            self.logger.error(exc)
+            return None
 
-        self.ct = ChurchTools(settings.url)
-        self.ct.login(settings.username, settings.password)
-        self.logger.debug('Connected to ChurchTools: %s', self.ct)
+    def _write_json(self, file_name: str, data: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, "w", encoding='utf8') as text_file:
+            text_file.write(json.dumps(data))
+
+
+class ResourceBookingsRetriever:
+    logger: logging.Logger = logging.getLogger(__name__)
+    session: ChurchToolsSession
+    store: SQLiteStore
+
+    def __init__(self, session: ChurchToolsSession, store: SQLiteStore):
+        self.session = session
+        self.store = store
 
 
     def retrieve_events(self, calendar_names: set[str], from_date: date, to_date: date) -> tuple[AllCalendarEvents, set[str]]:
 
-        def utc_to_local(dt: datetime) -> datetime:
-            return dt.astimezone(tz.tzlocal())
+        all_resources_events = self.get_events(calendar_names, from_date, to_date)
+        resources_having_updates = self.update_cache(all_resources_events)
 
-        def read_booking(b: Booking) -> Event:
-            return Event(
-                start = utc_to_local(b.calculated.startDate),
-                end = utc_to_local(b.calculated.endDate),
-                name = b.caption)
+        return (all_resources_events, resources_having_updates)
+
+
+    def get_events(self, calendar_names: set[str], from_date: date, to_date: date) -> AllCalendarEvents:
 
         resource_names_and_ids = self.get_resource_ids(calendar_names)
-        bookings_by_resource_name = self.get_bookings_by_resource_name(resource_names_and_ids, from_date, to_date)
+        events_by_resource_name = self.get_events_by_resource_name(resource_names_and_ids, from_date, to_date)
 
         all_resources_events = AllCalendarEvents()
-        for resource_name, bookings in sorted(bookings_by_resource_name.items()):
+        for resource_name, events in sorted(events_by_resource_name.items()):
             all_resources_events.events[resource_name] = \
-                CalendarEvents(name = resource_name,
-                               events = list([read_booking(b) for b in bookings]))
+                CalendarEvents(name = resource_name, events = events)
+        return all_resources_events
+
+
+    def update_cache(self, all_resources_events: AllCalendarEvents, fetched_at: Optional[dict[str, float]] = None) -> set[str]:
         self.logger.debug('calendar events of all used resources: %s', all_resources_events)
 
         # determine resources that have changed events
-        resources_having_updates = self.determine_resources_having_updates(all_resources_events)
+        resources_having_updates = self.store.update_calendar_events(all_resources_events, 'churchtools', fetched_at)
         self.logger.debug('Changed resource events: %s', resources_having_updates if resources_having_updates else None)
 
-        self.write_all_resources_events_to_cache(all_resources_events)
-
-        return (all_resources_events, resources_having_updates)
+        return resources_having_updates
 
 
     def get_resource_ids(self, resource_names: list[str]) -> dict[str: int]:
 
         # query ChurchTools for resources
-        if not self.cached_resources:
-            self.logger.debug('Getting resources from masterdata')
-            resource_types, self.cached_resources = self.ct.resources.masterdata()
-            self.logger.debug('resource types: %s', resource_types)
-            self.logger.debug('resources: %s', self.cached_resources)
+        resource_ids_by_name = self.session.get_resource_ids_by_name()
 
         resource_names_and_ids = {}
         for name in resource_names:
-            resource_id = next((r.id for r in self.cached_resources if r.name == name), None)
+            resource_id = resource_ids_by_name.get(name)
             if not resource_id:
                 raise ValueError(f'Resource with name "{name}" not found in ChurchTools.')
             resource_names_and_ids[name] = resource_id
@@ -74,59 +304,34 @@ class ResourceBookingsRetriever:
         return resource_names_and_ids
 
 
-    def get_bookings_by_resource_name(self, resource_names_and_ids: dict[str: int], date_from: date, date_to: date) -> dict[str: list[Booking]]:
+    def get_events_by_resource_name(self, resource_names_and_ids: dict[str: int], date_from: date, date_to: date) -> dict[str: list[Event]]:
+        """Gets the bookings of all resources and distributes them to their resources in a single pass,
+        converting them into events on the way.
+        """
 
-        self.logger.debug('Getting bookings for resources: %s', resource_names_and_ids)
-
-        resource_ids = list(sorted(resource_names_and_ids.values()))
-        bookings = self.ct.resources.bookings(resource_ids, status_ids = [1, 2], from_ = date_from, to = date_to)
-
-        bookings_by_name = {}
-        for name, id in resource_names_and_ids.items():
-            selected_bookings = list([b for b in bookings if b.resource.id == id])
-            bookings_by_name[name] = selected_bookings
-
-        return bookings_by_name
+        def utc_to_local(dt: str) -> datetime:
+            return datetime.fromisoformat(dt).astimezone(tz.tzlocal())
 
+        def read_booking(booking: dict[str, Any]) -> Event:
+            return Event(
+                start = utc_to_local(booking['start']),
+                end = utc_to_local(booking['end']),
+                name = booking['caption'])
 
-    def determine_resources_having_updates(self, all_resources_events: AllCalendarEvents) -> set[str]:
-        all_resources_events_from_cache = self.read_all_resources_events_from_cache()
+        self.logger.debug('Getting bookings for resources: %s', resource_names_and_ids)
 
-        changed_resources = set()
-        for resource_name in all_resources_events.events:
-            if (resource_name not in all_resources_events_from_cache.events or
-                all_resources_events.events[resource_name] != all_resources_events_from_cache.events[resource_name]):
-                changed_resources.add(resource_name)
+        resource_ids = list(sorted(resource_names_and_ids.values()))
+        bookings = self.session.get_bookings(resource_ids, status_ids = [1, 2], from_ = date_from, to = date_to)
 
-        return changed_resources
+        events_by_id = { id: [] for id in resource_ids }
+        with metrics.STAGE_SECONDS.time(stage = 'parse'):
+            for booking in bookings:
+                events = events_by_id.get(booking['resource_id'])
+                if events is not None:
+                    events.append(read_booking(booking))
 
+        return { name: events_by_id[id] for name, id in resource_names_and_ids.items() }
 
-    def all_resources_events_cache_file_name(self) -> str:
-        return './.cache/churchtools_resource_events.json'
 
     def read_all_resources_events_from_cache(self) -> AllCalendarEvents:
-
-        # step 1: Read the file. Since file is small, we are doing a whole read.
-        try:
-            with open(self.all_resources_events_cache_file_name(), 'r', encoding='utf-8') as stream:
-                # step 2: Parse the yaml file into a dictionary
-                json_str = json.load(stream) # -> Dict[Any, Any]
-
-            # step 3: Change dictionary into class
-            return AllCalendarEvents(**json_str)
-
-        except FileNotFoundError as exc:
-            return AllCalendarEvents()
-
-        except json.JSONDecodeError as exc:
-            self.logger.error(exc)
-            return AllCalendarEvents()
-
-    def write_all_resources_events_to_cache(self, all_resources_events: AllCalendarEvents) -> None:
-        json_data = all_resources_events.model_dump(mode = 'json')
-        json_str = json.dumps(json_data)
-        cache_filename = self.all_resources_events_cache_file_name()
-
-        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
-        with open(cache_filename, "w", encoding='utf8') as text_file:
-            text_file.write(json_str)
+        return self.store.read_calendar_events(source = 'churchtools')
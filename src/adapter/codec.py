@@ -0,0 +1,99 @@
+from datetime import datetime, time, timedelta, timezone
+from models.events import Event
+from models.schedules import Block, DailySchedule
+import struct
+from typing import Optional
+
+
+# Compact binary encoding of events and daily schedules for the cache. The models are created by
+# `model_construct` without any validation, since they have been validated before.
+#
+# An encoded daily schedule starts with a header of a magic number and the format version. Decoding
+# data of another version raises a ValueError, so that the cache entry is treated as missing. Single
+# events are encoded without header, their format version is kept by the store.
+
+FORMAT_VERSION = 3
+
+HEADER = struct.Struct('<3sB')          # magic, format version
+MAGIC = b'PHT'
+COUNT = struct.Struct('<I')
+DATETIME = 'H5BI'                       # year, month, day, hour, minute, second, microsecond
+EVENT = struct.Struct(f'<B{DATETIME}i{DATETIME}iH')  # flags, start, its utc offset in seconds, end, its utc offset, length of the name
+BLOCK = struct.Struct('<qqd')           # start and end as microseconds of the day, temperature
+
+# flags of an event, a datetime without time zone has no utc offset
+START_HAS_OFFSET = 0x01
+END_HAS_OFFSET = 0x02
+
+_timezones: dict[int, timezone] = {}
+
+
+def _get_timezone(offset: int) -> timezone:
+    tzinfo = _timezones.get(offset)
+    if tzinfo is None:
+        tzinfo = _timezones.setdefault(offset, timezone(timedelta(seconds = offset)))
+    return tzinfo
+
+def _get_offset(dt: datetime) -> Optional[int]:
+    offset = dt.utcoffset()
+    return None if offset is None else offset.days * 86400 + offset.seconds
+
+def _get_fields(dt: datetime) -> tuple[int, ...]:
+    return (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond)
+
+def _encode_time(t: time) -> int:
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1000000 + t.microsecond
+
+def _decode_time(microseconds: int) -> time:
+    seconds, microsecond = divmod(microseconds, 1000000)
+    minutes, second = divmod(seconds, 60)
+    return time(minutes // 60, minutes % 60, second, microsecond)
+
+
+def encode_event(event: Event) -> bytes:
+    """Encodes a single event without header, e.g. for a row of a table. The date and time are kept
+    as they are with their utc offset, so no time zone conversion is needed in either direction.
+    """
+    start_offset = _get_offset(event.start)
+    end_offset = _get_offset(event.end)
+    flags = (0 if start_offset is None else START_HAS_OFFSET) | (0 if end_offset is None else END_HAS_OFFSET)
+    name = event.name.encode('utf-8')
+    return EVENT.pack(flags, *_get_fields(event.start), start_offset or 0, *_get_fields(event.end), end_offset or 0, len(name)) + name
+
+def decode_event(data: bytes) -> Event:
+    """Decodes a single event encoded by `encode_event`.
+    """
+    fields = EVENT.unpack_from(data)
+    flags = fields[0]
+    start_tz = _get_timezone(fields[8]) if flags & START_HAS_OFFSET else None
+    end_tz = _get_timezone(fields[16]) if flags & END_HAS_OFFSET else None
+    return Event.model_construct(start = datetime(*fields[1:8], tzinfo = start_tz), end = datetime(*fields[9:16], tzinfo = end_tz),
+                                 name = data[EVENT.size:EVENT.size + fields[17]].decode('utf-8'))
+
+
+def encode_daily_schedule(schedule: DailySchedule) -> bytes:
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION), COUNT.pack(len(schedule.blocks))]
+    parts.extend(BLOCK.pack(_encode_time(b.start), _encode_time(b.end), b.temperature) for b in schedule.blocks.values())
+    return b''.join(parts)
+
+def decode_daily_schedule(data: bytes) -> DailySchedule:
+    offset = _check_header(data)
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+
+    blocks = {}
+    for start, end, temperature in BLOCK.iter_unpack(data[offset:offset + count * BLOCK.size]):
+        block = Block.model_construct(start = _decode_time(start), end = _decode_time(end), temperature = temperature)
+        blocks[block.start] = block
+    return DailySchedule.model_construct(blocks = blocks)
+
+
+def _check_header(data: Optional[bytes]) -> int:
+    if not data or len(data) < HEADER.size:
+        raise ValueError('missing header')
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not an encoded cache entry')
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unsupported format version {version}, expected {FORMAT_VERSION}')
+    return HEADER.size
@@ -16,11 +16,16 @@ DAY_PATTERN = re.compile(r"^[A-Za-z]{3}$")
 
 
 class EventGenerator:
+    """Generates the events of recurring schedules. The days of the week are parsed once, so that an
+    invalid `days_of_week` fails when the generator is created.
+    """
     logger: logging.Logger = logging.getLogger(__name__)
     settings: List[SchedulesSettings]
+    active_days: dict[str, set[int]]
 
     def __init__(self, settings: List[SchedulesSettings]):
         self.settings = settings
+        self.active_days = { s.name: set(_parse_days(s.days_of_week)) for s in settings }
 
     def generate_events(self, day_start: date, day_end: date) -> AllCalendarEvents:
         
@@ -30,7 +35,7 @@ class EventGenerator:
 
             all_calendars_events.events[schedule_setting.name] = CalendarEvents(
                 name = schedule_setting.name,
-                events = _generate_schedule_events(schedule_setting, day_start, day_end)
+                events = _generate_schedule_events(schedule_setting, self.active_days[schedule_setting.name], day_start, day_end)
             )
 
         self.logger.debug('Scheduled events: %s', all_calendars_events)
@@ -38,8 +43,7 @@ class EventGenerator:
         return all_calendars_events
 
 
-def _generate_schedule_events(schedule: SchedulesSettings, day_start: date, day_end: date):
-    active_days = _parse_days(schedule.days_of_week)
+def _generate_schedule_events(schedule: SchedulesSettings, active_days: set[int], day_start: date, day_end: date):
     events = []
 
     current_date = day_start
@@ -73,8 +77,8 @@ def _parse_days(days_str: str) -> List[int]:
         m = RANGE_PATTERN.match(part)
         if m:
             d1, d2 = m.groups()
-            start = DAY_INDEX[d1.capitalize()]
-            end = DAY_INDEX[d2.capitalize()]
+            start = _get_day_index(d1)
+            end = _get_day_index(d2)
 
             if end < start:  # wrap-around case (Fri-Mon)
                 days.update(range(start, 7))
@@ -86,9 +90,16 @@ def _parse_days(days_str: str) -> List[int]:
 
         # Single day: "Tue"
         if DAY_PATTERN.match(part):
-            days.add(DAY_INDEX[part.capitalize()])
+            days.add(_get_day_index(part))
             continue
 
         raise ValueError(f"Invalid day segment: '{part}'")
 
-    return sorted(days)
\ No newline at end of file
+    return sorted(days)
+
+
+def _get_day_index(day: str) -> int:
+    index = DAY_INDEX.get(day.capitalize())
+    if index is None:
+        raise ValueError(f"Invalid day: '{day}'")
+    return index
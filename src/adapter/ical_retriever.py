@@ -1,24 +1,63 @@
+from adapter import codec
+from adapter.sqlitestore import SQLiteStore
+from concurrent.futures import Executor
 from datetime import date, datetime
 from dateutil import tz
 from icalendar import Calendar
-import json
 import logging
 from models.events import AllCalendarEvents, Event, CalendarEvents
 from models.settings import ICalSettings
-import os
 from pathlib import Path
-import requests
+from services import metrics, recording
 from typing import List, Optional
 from urllib.parse import urlparse
 
 
+def get_events_from_ics(calendar: Calendar) -> list[Event]:
+    events = []
+    for component in calendar.walk():
+        if component.name == "VEVENT":
+            start = component.get('dtstart').dt
+            end = component.get('dtend').dt
+            name = str(component.get('summary'))
+
+            # They may be date or datetime; force datetime if needed
+            if isinstance(start, date) and not isinstance(start, datetime):
+                start = datetime.combine(start, datetime.min.time())
+            if isinstance(end, date) and not isinstance(end, datetime):
+                end = datetime.combine(end, datetime.min.time())
+
+            events.append(Event(
+                start = start.replace(tzinfo=tz.tzlocal()),
+                end = end.replace(tzinfo=tz.tzlocal()),
+                name = name))
+    return events
+
+
+def parse_ics_events(data: bytes, day_start: date, day_end: date) -> list[bytes]:
+    """Parses an iCalendar and returns its events within the date range, encoded by `codec.encode_event`.
+
+    Runs in a worker process, so the input and output are kept compact and picklable.
+    """
+    events = get_events_from_ics(Calendar.from_ical(data))
+    return [codec.encode_event(e) for e in events if e.start.date() <= day_end and e.end.date() >= day_start]
+
+
 class ICalRetriever:
     logger: logging.Logger = logging.getLogger(__name__)
     settings: List[ICalSettings]
+    store: SQLiteStore
+    executor: Optional[Executor]
     cached_calendars: Optional[list[any]] = None
 
-    def __init__(self, settings: List[ICalSettings]):
+    def __init__(self, settings: List[ICalSettings], store: SQLiteStore, executor: Optional[Executor] = None):
+        """
+        Args:
+            executor (Optional[Executor]): A process pool to parse the calendars in, by default they are parsed in the calling thread.
+        """
         self.settings = settings
+        self.store = store
+        self.executor = executor
 
 
     def retrieve_events(self, day_start: date, day_end: date) -> tuple[AllCalendarEvents, set[str]]:
@@ -36,113 +75,103 @@ class ICalRetriever:
 
         all_calendars_events = AllCalendarEvents()
         for setting in self.settings:
-            self.logger.debug('Retrieving calendar events from: %s', setting.source)
-
-            # Load the iCalendar from URL or local path.
-            cal = self.load_ics(setting.source)
-            
-            # Extract events from the iCalendar.
-            events = self.get_events_from_ics(cal)
-
-            # Filter events by the specified date range.
-            events = list(filter(lambda e: e.start.date() <= day_end and e.end.date() >= day_start, events))
-            
-            # Store the events in the AllCalendarEvents structure.
-            all_calendars_events.events[setting.name] = CalendarEvents(
-                name = setting.name,
-                events = events
-            )
+            all_calendars_events.events[setting.name] = self.retrieve_calendar_events(setting, day_start, day_end)
+
+        calendars_having_updates = self.update_cache(all_calendars_events)
+
+        return (all_calendars_events, calendars_having_updates)
+
+
+    def retrieve_calendar_events(self, setting: ICalSettings, day_start: date, day_end: date,
+                                 timeout: Optional[float] = None) -> CalendarEvents:
+        """
+        Retrieves the events of a single iCalendar source within the specified date range. Does not use the cache,
+        so it may be called for several sources concurrently.
+        Args:
+            setting (ICalSettings): The iCalendar source.
+            day_start (date): Start date of the range to filter events.
+            day_end (date): End date of the range to filter events.
+            timeout (Optional[float]): Seconds to wait for the server, defaults to the timeout of the source.
+        Returns:
+            CalendarEvents: The events of the calendar.
+        """
+        self.logger.debug('Retrieving calendar events from: %s', setting.source)
+
+        # Load the iCalendar from URL or local path.
+        data = self.load_ics_data(setting.source, timeout or setting.timeout_seconds)
+
+        with metrics.STAGE_SECONDS.time(stage = 'parse'):
+            if self.executor:
+                # Extract and filter the events in a worker process, this thread just waits for them.
+                events = [codec.decode_event(e) for e in self.executor.submit(parse_ics_events, data, day_start, day_end).result()]
+            else:
+                # Extract events from the iCalendar.
+                events = self.get_events_from_ics(Calendar.from_ical(data))
 
+                # Filter events by the specified date range.
+                events = list(filter(lambda e: e.start.date() <= day_end and e.end.date() >= day_start, events))
+
+        return CalendarEvents(name = setting.name, events = events)
+
+
+    def update_cache(self, all_calendars_events: AllCalendarEvents, fetched_at: Optional[dict[str, float]] = None) -> set[str]:
+        """
+        Determines the calendars whose events differ from the stored ones and updates the store.
+        Args:
+            all_calendars_events (AllCalendarEvents): The events of all calendars in use.
+            fetched_at (Optional[dict[str, float]]): The time the events of a calendar have been fetched, defaults to now.
+        Returns:
+            set[str]: The names of the calendars having updates.
+        """
         self.logger.debug('events of all calendars in use: %s', all_calendars_events)
 
-        # determine changes in calendar definition or events related to cached version
-        calendars_having_updates = self.determine_calendars_having_updates(all_calendars_events)
+        # determine changes in calendar definition or events related to stored version
+        calendars_having_updates = self.store.update_calendar_events(all_calendars_events, 'ical', fetched_at)
         self.logger.debug('Calendars having updates: %s', calendars_having_updates if calendars_having_updates else None)
 
-        self.write_to_cache(all_calendars_events)
-
-        return (all_calendars_events, calendars_having_updates)
+        return calendars_having_updates
 
 
-    def load_ics(self, source: str) -> Calendar:
+    def load_ics(self, source: str, timeout: Optional[float] = None) -> Calendar:
         """
         Loads an ICS file from a URL or a local path.
         source: HTTP/HTTPS URL or local file path
+        timeout: seconds to wait for the server, None to wait forever
+        """
+        return Calendar.from_ical(self.load_ics_data(source, timeout))
+
+
+    def load_ics_data(self, source: str, timeout: Optional[float] = None) -> bytes:
+        """
+        Loads the content of an ICS file from a URL or a local path, without parsing it.
+        While recording or replaying a run, see `services.recording`, the content is recorded or taken from the recording.
         """
+        return recording.capture('ical', source, lambda: self._load_ics_data(source, timeout))
+
+    def _load_ics_data(self, source: str, timeout: Optional[float] = None) -> bytes:
         parsed = urlparse(source)
 
         # Check if it is a URL (http or https)
         if parsed.scheme in ("http", "https"):
-            response = requests.get(source)
-            response.raise_for_status()
-            print(response.headers)
+            # imported on first use, local calendars do not need it
+            import requests
+
+            with metrics.record_api_call('ical'):
+                response = requests.get(source, timeout = timeout)
+                response.raise_for_status()
+            self.logger.debug('Response headers: %s', response.headers)
             data = response.content  # Bytes!
         else:
             # Local path
             path = Path(source)
             data = path.read_bytes()  # Read bytes
 
-        # Parse iCal
-        return Calendar.from_ical(data)
+        return data
 
 
     def get_events_from_ics(self, calendar: Calendar) -> list[Event]:
-        events = []
-        for component in calendar.walk():
-            if component.name == "VEVENT":
-                start = component.get('dtstart').dt
-                end = component.get('dtend').dt
-                name = str(component.get('summary'))
-                
-                # They may be date or datetime; force datetime if needed
-                if isinstance(start, date) and not isinstance(start, datetime):
-                    start = datetime.combine(start, datetime.min.time())
-                if isinstance(end, date) and not isinstance(end, datetime):
-                    end = datetime.combine(end, datetime.min.time())
-
-                events.append(Event(
-                    start = start.replace(tzinfo=tz.tzlocal()),
-                    end = end.replace(tzinfo=tz.tzlocal()),
-                    name = name))
-        return events
-
-
-    def determine_calendars_having_updates(self, all_calendars_events: AllCalendarEvents) -> set[str]:
-        all_calendars_events_from_cache = self.read_from_cache()
-
-        changed_calendars = set()
-        for name in all_calendars_events.events:
-            if (name not in all_calendars_events_from_cache.events or
-                all_calendars_events.events[name] != all_calendars_events_from_cache.events[name]):
-                changed_calendars.add(name)
-        return changed_calendars
-
-    def all_calendars_events_cache_file_name(self) -> str:
-        return './.cache/ical_calendar_events.json'
-
-    def read_from_cache(self) -> AllCalendarEvents:
+        return get_events_from_ics(calendar)
 
-        # step 1: Read the file. Since file is small, we are doing a whole read.
-        try:
-            with open(self.all_calendars_events_cache_file_name(), 'r', encoding='utf-8') as stream:
-                # step 2: Parse the yaml file into a dictionary
-                json_str = json.load(stream) # -> Dict[Any, Any]
 
-            # step 3: Change dictionary into class
-            return AllCalendarEvents(**json_str)
-
-        except FileNotFoundError as exc:
-            return AllCalendarEvents()
-
-        except json.JSONDecodeError as exc:
-            self.logger.error(exc)
-            return AllCalendarEvents()
-
-    def write_to_cache(self, all_calendars_events: AllCalendarEvents) -> None:
-        json_data = all_calendars_events.model_dump(mode = 'json')
-        json_str = json.dumps(json_data)
-        cache_filename = self.all_calendars_events_cache_file_name()
-
-        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
-        with open(cache_filename, "w", encoding='utf8') as text_file:
-            text_file.write(json_str)
+    def read_from_cache(self) -> AllCalendarEvents:
+        return self.store.read_calendar_events(source = 'ical')
@@ -0,0 +1,110 @@
+from datetime import date, datetime, time, timedelta
+import logging
+from models.schedules import DailySchedule
+from models.settings import TadoSettings
+from time import monotonic
+from typing import Optional
+
+
+def get_first_change(current: Optional[DailySchedule], schedule: DailySchedule, not_before: time = time.min) -> Optional[time]:
+    """Determines the first time of the day at which two daily schedules have different temperatures.
+
+    Args:
+        current (Optional[DailySchedule]): The schedule currently known by tado°, None if unknown.
+        schedule (DailySchedule): The new schedule.
+        not_before (time, optional): Differences before this time are ignored. Defaults to time.min.
+
+    Returns:
+        Optional[time]: The first time with a difference, or None if there is none.
+    """
+    if not current:
+        return not_before
+
+    def temperature_at(s: DailySchedule, t: time) -> float:
+        return max((b for b in s.blocks.values() if b.start <= t), key = lambda b: b.start).temperature
+
+    boundaries = sorted(set(current.blocks) | set(schedule.blocks) | {not_before})
+    for t in [t for t in boundaries if t >= not_before]:
+        if temperature_at(current, t) != temperature_at(schedule, t):
+            return t
+    return None
+
+
+class PendingWrite:
+    """A daily schedule of a zone that has to be sent to tado°.
+    """
+    zone_name: str
+    zone_id: int
+    weekday: int
+    schedule: DailySchedule
+    takes_effect_at: datetime
+
+    def __init__(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule, takes_effect_at: datetime):
+        self.zone_name = zone_name
+        self.zone_id = zone_id
+        self.weekday = weekday
+        self.schedule = schedule
+        self.takes_effect_at = takes_effect_at
+
+    def __repr__(self) -> str:
+        return f'PendingWrite({self.zone_name}, {self.weekday}, {self.takes_effect_at})'
+
+
+class PushScheduler:
+    """Orders the daily schedules to be sent to tado° by the time at which they take effect, so that
+    changes for today and tomorrow are sent first, across all zones.
+
+    Writes taking effect today or tomorrow are urgent and are always sent. All other writes are deferred
+    to the next run as soon as the maximum number of writes or the deadline of the run is reached.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    now: datetime
+    max_writes: Optional[int]
+    deadline: Optional[float]
+    writes: int
+
+    def __init__(self, now: datetime = None, settings: TadoSettings = None):
+        self.now = now or datetime.now()
+        settings = settings or TadoSettings()
+        self.max_writes = settings.max_writes_per_run
+        self.deadline = monotonic() + settings.push_deadline_seconds \
+            if settings.push_deadline_seconds else None
+        self.writes = 0
+
+    def get_date(self, weekday: int) -> date:
+        """Returns the date of the next occurence of the weekday, which is today for today's weekday.
+        """
+        today = self.now.date()
+        return today + timedelta(days = (weekday - today.weekday()) % 7)
+
+    def create_pending_write(self, zone_name: str, zone_id: int, weekday: int,
+                             schedule: DailySchedule, current: Optional[DailySchedule]) -> PendingWrite:
+        day = self.get_date(weekday)
+        not_before = self.now.time() if day == self.now.date() else time.min
+
+        first_change = get_first_change(current, schedule, not_before)
+        if first_change is None:
+            # the schedule only differs for the past hours of today, which recur next week
+            takes_effect_at = datetime.combine(day + timedelta(days = 7), time.min)
+        else:
+            takes_effect_at = datetime.combine(day, first_change)
+
+        return PendingWrite(zone_name, zone_id, weekday, schedule, takes_effect_at)
+
+    def order(self, pending_writes: list[PendingWrite]) -> list[PendingWrite]:
+        return sorted(pending_writes, key = lambda w: w.takes_effect_at)
+
+    def is_urgent(self, pending_write: PendingWrite) -> bool:
+        return pending_write.takes_effect_at < datetime.combine(self.now.date() + timedelta(days = 2), time.min)
+
+    def may_send(self, pending_write: PendingWrite) -> bool:
+        """Decides whether a pending write may be sent now and counts it if so.
+        """
+        if not self.is_urgent(pending_write):
+            if self.max_writes is not None and self.writes >= self.max_writes:
+                return False
+            if self.deadline is not None and monotonic() >= self.deadline:
+                return False
+
+        self.writes += 1
+        return True
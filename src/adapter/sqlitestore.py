@@ -0,0 +1,436 @@
+from adapter import codec
+from adapter.tado import DEFAULT_DATA_DIR
+import asyncio
+from datetime import datetime, timezone
+import hashlib
+import logging
+from models.events import AllCalendarEvents, CalendarEvents, Event
+from models.schedules import DailySchedule
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+# to be increased on changes of the tables or of the codec format, the store is rebuilt then
+SCHEMA_VERSION = 6
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS calendars (
+    name TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    calendar TEXT NOT NULL REFERENCES calendars (name) ON DELETE CASCADE,
+    key BLOB NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (calendar, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS zone_days (
+    zone TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    zone_id INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    schedule BLOB NOT NULL,
+    PRIMARY KEY (zone, weekday)
+);
+CREATE TABLE IF NOT EXISTS deferred_zone_days (
+    zone TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    PRIMARY KEY (zone, weekday)
+);
+'''
+
+
+DIGEST_MODULUS = 1 << 160
+
+
+def _normalize(dt: datetime) -> str:
+    # equal points in time are equal, regardless of their time zone
+    return dt.astimezone(timezone.utc).isoformat() if dt.tzinfo else dt.isoformat()
+
+
+def get_event_digest(event: Event) -> bytes:
+    """Returns a stable hash of the normalized content of an event.
+    """
+    text = f'{_normalize(event.start)}|{_normalize(event.end)}|{event.name}'
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def get_event_keys(events: list[Event]) -> list[bytes]:
+    """Returns the keys of the events in the order given. The key is the content hash of an event,
+    equal events are numbered.
+    """
+    keys = []
+    occurrences = {}
+    for event in events:
+        digest = get_event_digest(event)
+        n = occurrences.get(digest, 0)
+        occurrences[digest] = n + 1
+        keys.append(digest if n == 0 else digest + n.to_bytes(4, 'big'))
+    return keys
+
+
+def get_calendar_digest(events: list[Event]) -> str:
+    """Returns a digest of the events of a calendar, which does not depend on the order of the events.
+    It is the number of events and the sum of their hashes, so equal events are counted.
+    """
+    total = 0
+    for event in events:
+        total += int.from_bytes(get_event_digest(event), 'big')
+    return f'{len(events)}:{total % DIGEST_MODULUS:040x}'
+
+
+class SQLiteStore:
+    """Keeps the last known events of all calendars and the daily schedules sent to tado° in memory and
+    in a single SQLite database in the data directory.
+
+    The store lives as long as the service. The database is only read on a cold start; changes are kept
+    in memory and written behind, `flush_delay_seconds` after the first change, in a single transaction.
+    After a crash, the changes of at most that time are lost, which may cause some daily schedules to
+    be sent again.
+
+    Events are stored one row per event keyed by their content hash, and each calendar has a digest of its
+    events, which does not depend on their order. Events and schedules are encoded by the binary `codec`.
+    Flushing a calendar only writes the rows of events that have been added or removed, and an unchanged
+    calendar is detected by comparing its digest, without reading its events. After a restart, the events
+    of a calendar are read in the order of their keys, not in the order they were given.
+
+    The daily schedules whose sending has been deferred to a later run, see `adapter.pushscheduler`, are
+    kept as well, so that they are sent even if the schedules do not change anymore.
+
+    The store may be used from several threads, the access is serialized.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    file_name: str
+    connection: sqlite3.Connection
+    flush_delay_seconds: float
+    lock: threading.RLock
+    db_lock: threading.Lock
+    flush_task: Optional[asyncio.Future] = None
+
+    # in memory, loaded on first use
+    calendars: Optional[dict[str, tuple[str, str, float]]] = None
+    calendar_events: dict[str, CalendarEvents]
+    daily_schedules: Optional[dict[tuple[str, int], tuple[int, DailySchedule]]] = None
+    deferred_zone_days: Optional[set[tuple[str, int]]] = None
+
+    # changes not written yet
+    changed_calendars: set[str]
+    changed_events: set[str]
+    removed_calendars: set[str]
+    changed_zone_days: set[tuple[str, int]]
+    removed_zones: set[str]
+    deferred_changed: bool
+
+    def __init__(self, data_dir: str = DEFAULT_DATA_DIR, file_name: str = 'cache.sqlite', flush_delay_seconds: float = 0.0):
+        self.file_name = os.path.join(data_dir, file_name)
+        self.flush_delay_seconds = flush_delay_seconds
+        os.makedirs(data_dir, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.db_lock = threading.Lock()
+        self.calendar_events = {}
+        self._clear_changes()
+
+        self.connection = sqlite3.connect(self.file_name, check_same_thread = False, isolation_level = None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # the store only contains cached data, which can be fetched again
+            if version:
+                self.logger.info('Rebuilding the store of version %d as version %d.', version, SCHEMA_VERSION)
+            self.connection.executescript('DROP TABLE IF EXISTS events; DROP TABLE IF EXISTS calendars; DROP TABLE IF EXISTS zone_days; '
+                                          'DROP TABLE IF EXISTS deferred_zone_days;')
+
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION:d}')
+
+    def close(self) -> None:
+        """Writes all pending changes and closes the database.
+        """
+        if self.flush_task:
+            self.flush_task.cancel()
+        self.flush()
+        with self.db_lock:
+            self.connection.close()
+
+
+    def read_calendar_events(self, names: Optional[set[str]] = None, source: Optional[str] = None) -> AllCalendarEvents:
+        """Returns the last known events of calendars.
+
+        Args:
+            names (Optional[set[str]]): The names of the calendars, all calendars if not given.
+            source (Optional[str]): Only calendars of this source, e.g. 'ical' or 'churchtools'.
+
+        Returns:
+            AllCalendarEvents: The events of the calendars found.
+        """
+        with self.lock:
+            all_calendars_events = AllCalendarEvents()
+            for name, (calendar_source, _, _) in sorted(self._get_calendars().items()):
+                if (names is not None and name not in names) or (source is not None and calendar_source != source):
+                    continue
+                if name not in self.calendar_events:
+                    self.calendar_events[name] = self._read_events(name)
+                all_calendars_events.events[name] = self.calendar_events[name]
+            return all_calendars_events
+
+    def get_calendar_fetched_at(self, name: str) -> Optional[float]:
+        """Returns the time the events of a calendar have been fetched the last time, as returned by time.time().
+        """
+        with self.lock:
+            calendar = self._get_calendars().get(name)
+            return calendar[2] if calendar else None
+
+    def update_calendar_events(self, all_calendars_events: AllCalendarEvents, source: str,
+                               fetched_at: Optional[dict[str, float]] = None) -> set[str]:
+        """Replaces the events of all calendars of a source. Calendars of the source that are not given
+        anymore are removed.
+
+        Args:
+            all_calendars_events (AllCalendarEvents): The current events of all calendars of the source.
+            source (str): The source of the calendars, e.g. 'ical' or 'churchtools'.
+            fetched_at (Optional[dict[str, float]]): The time the events of a calendar have been fetched,
+                as returned by time.time(). Defaults to now.
+
+        Returns:
+            set[str]: The names of the calendars whose events differ from the stored ones.
+        """
+        now = time.time()
+        changed_calendars = set()
+
+        with self.lock:
+            calendars = self._get_calendars()
+
+            for name, calendar_events in all_calendars_events.events.items():
+                digest = get_calendar_digest(calendar_events.events)
+                calendar = calendars.get(name)
+
+                if not calendar or calendar[1] != digest:
+                    changed_calendars.add(name)
+                    self.changed_events.add(name)
+
+                calendars[name] = (source, digest, (fetched_at or {}).get(name, now))
+                self.calendar_events[name] = calendar_events
+                self.changed_calendars.add(name)
+                self.removed_calendars.discard(name)
+
+            for name in [n for n, c in calendars.items() if c[0] == source and n not in all_calendars_events.events]:
+                del calendars[name]
+                self.calendar_events.pop(name, None)
+                self.changed_calendars.discard(name)
+                self.changed_events.discard(name)
+                self.removed_calendars.add(name)
+
+        self._schedule_flush()
+        return changed_calendars
+
+
+    def read_daily_schedules(self) -> dict[tuple[str, int], DailySchedule]:
+        """Returns the daily schedules sent to tado° by zone name and weekday.
+        """
+        with self.lock:
+            return { key: schedule for key, (_, schedule) in self._get_daily_schedules().items() }
+
+    def write_daily_schedule(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule) -> None:
+        """Stores a daily schedule that has been sent to tado° successfully.
+        """
+        with self.lock:
+            daily_schedules = self._get_daily_schedules()
+            if daily_schedules.get((zone_name, weekday)) == (zone_id, schedule):
+                return
+
+            daily_schedules[(zone_name, weekday)] = (zone_id, schedule)
+            self.changed_zone_days.add((zone_name, weekday))
+
+        self._schedule_flush()
+
+    def remove_other_zones(self, zone_names: set[str]) -> None:
+        """Removes the daily schedules of zones that are not assigned anymore.
+        """
+        with self.lock:
+            daily_schedules = self._get_daily_schedules()
+            removed_keys = [key for key in daily_schedules if key[0] not in zone_names]
+            deferred_zone_days = self._get_deferred_zone_days()
+            removed_deferred_keys = set(key for key in deferred_zone_days if key[0] not in zone_names)
+            if not removed_keys and not removed_deferred_keys:
+                return
+
+            for key in removed_keys:
+                del daily_schedules[key]
+                self.changed_zone_days.discard(key)
+                self.removed_zones.add(key[0])
+            if removed_deferred_keys:
+                deferred_zone_days -= removed_deferred_keys
+                self.deferred_changed = True
+
+        self._schedule_flush()
+
+    def read_deferred_zone_days(self) -> set[tuple[str, int]]:
+        """Returns the zone names and weekdays of the daily schedules deferred to a later run.
+        """
+        with self.lock:
+            return set(self._get_deferred_zone_days())
+
+    def write_deferred_zone_days(self, zone_days: set[tuple[str, int]]) -> None:
+        """Replaces the daily schedules deferred to a later run by the given zone names and weekdays.
+        """
+        with self.lock:
+            if zone_days == self._get_deferred_zone_days():
+                return
+
+            self.deferred_zone_days = set(zone_days)
+            self.deferred_changed = True
+
+        self._schedule_flush()
+
+
+    def flush(self) -> None:
+        """Writes all changes kept in memory to the database within a single transaction.
+        """
+        with self.lock:
+            if not (self.changed_calendars or self.removed_calendars or self.changed_zone_days or self.removed_zones
+                    or self.deferred_changed):
+                return
+
+            # take a snapshot, so that the database is written without blocking the users of the store
+            calendars = { name: self.calendars[name] for name in self.changed_calendars }
+            events = { name: self.calendar_events[name] for name in self.changed_events }
+            removed_calendars = self.removed_calendars
+            daily_schedules = { key: self.daily_schedules[key] for key in self.changed_zone_days }
+            removed_zones = self.removed_zones
+            deferred_zone_days = set(self.deferred_zone_days) if self.deferred_changed else None
+            self._clear_changes()
+
+        try:
+            with self.db_lock, self.connection:
+                self.connection.execute('BEGIN')
+                self._write_calendars(calendars, events, removed_calendars)
+                self._write_daily_schedules(daily_schedules, removed_zones)
+                if deferred_zone_days is not None:
+                    self._write_deferred_zone_days(deferred_zone_days)
+
+            self.logger.debug('Flushed %d calendars, %d changed, %d removed and %d daily schedules, %d zones removed.',
+                              len(calendars), len(events), len(removed_calendars), len(daily_schedules), len(removed_zones))
+
+        except sqlite3.Error as e:
+            self.logger.error('Failed writing the store, retrying with the next change: %s', e)
+            with self.lock:
+                # keep the changes that have not been superseded meanwhile
+                self.changed_calendars |= set(calendars) & set(self.calendars or {})
+                self.changed_events |= set(events) & set(self.calendars or {})
+                self.removed_calendars |= removed_calendars - set(self.calendars or {})
+                self.changed_zone_days |= set(daily_schedules) & set(self.daily_schedules or {})
+                self.removed_zones |= removed_zones
+                self.deferred_changed |= deferred_zone_days is not None
+
+    def _schedule_flush(self) -> None:
+        """Flushes after the delay, or right away if there is no delay or no event loop in this thread.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if not loop or self.flush_delay_seconds <= 0:
+            self.flush()
+            return
+
+        if not self.flush_task or self.flush_task.done():
+            self.flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay_seconds)
+        await asyncio.to_thread(self.flush)
+
+    def _clear_changes(self) -> None:
+        self.changed_calendars = set()
+        self.changed_events = set()
+        self.removed_calendars = set()
+        self.changed_zone_days = set()
+        self.removed_zones = set()
+        self.deferred_changed = False
+
+
+    def _get_calendars(self) -> dict[str, tuple[str, str, float]]:
+        if self.calendars is None:
+            with self.db_lock:
+                rows = self.connection.execute('SELECT name, source, digest, fetched_at FROM calendars').fetchall()
+            self.calendars = { name: (source, digest, fetched_at) for name, source, digest, fetched_at in rows }
+        return self.calendars
+
+    def _read_events(self, name: str) -> CalendarEvents:
+        with self.db_lock:
+            rows = self.connection.execute('SELECT data FROM events WHERE calendar = ?', (name,)).fetchall()
+        return CalendarEvents.model_construct(name = name, events = [codec.decode_event(r[0]) for r in rows])
+
+    def _write_calendars(self, calendars: dict[str, tuple[str, str, float]], events: dict[str, CalendarEvents],
+                         removed_calendars: set[str]) -> None:
+        self.connection.executemany('DELETE FROM calendars WHERE name = ?', [(name,) for name in removed_calendars])
+
+        for name, (source, digest, fetched_at) in calendars.items():
+            self.connection.execute(
+                'INSERT INTO calendars (name, source, digest, fetched_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET source = excluded.source, digest = excluded.digest, fetched_at = excluded.fetched_at',
+                (name, source, digest, fetched_at))
+
+            if name in events:
+                calendar_events = events[name].events
+                self._update_events(name, get_event_keys(calendar_events), calendar_events)
+
+    def _update_events(self, calendar: str, keys: list[bytes], events: list[Event]) -> None:
+        """Writes only the rows of events that have been added or removed, a single row per changed event.
+        """
+        stored_keys = set(row[0] for row in self.connection.execute('SELECT key FROM events WHERE calendar = ?', (calendar,)))
+
+        self.connection.executemany('DELETE FROM events WHERE calendar = ? AND key = ?',
+                                    [(calendar, key) for key in stored_keys.difference(keys)])
+        self.connection.executemany('INSERT INTO events (calendar, key, data) VALUES (?, ?, ?)',
+                                    [(calendar, key, codec.encode_event(event))
+                                     for key, event in zip(keys, events) if key not in stored_keys])
+
+
+    def _get_daily_schedules(self) -> dict[tuple[str, int], tuple[int, DailySchedule]]:
+        if self.daily_schedules is None:
+            with self.db_lock:
+                rows = self.connection.execute('SELECT zone, weekday, zone_id, schedule FROM zone_days').fetchall()
+
+            self.daily_schedules = {}
+            for zone, weekday, zone_id, schedule in rows:
+                try:
+                    self.daily_schedules[(zone, weekday)] = (zone_id, codec.decode_daily_schedule(schedule))
+                except ValueError as exc:
+                    # treated as not sent yet
+                    self.logger.warning('Skipping stored schedule of zone "%s": %s', zone, exc)
+        return self.daily_schedules
+
+    def _write_daily_schedules(self, daily_schedules: dict[tuple[str, int], tuple[int, DailySchedule]],
+                               removed_zones: set[str]) -> None:
+        self.connection.executemany('DELETE FROM zone_days WHERE zone = ?', [(name,) for name in removed_zones])
+
+        for (zone_name, weekday), (zone_id, schedule) in daily_schedules.items():
+            data = codec.encode_daily_schedule(schedule)
+            self.connection.execute(
+                'INSERT INTO zone_days (zone, weekday, zone_id, digest, schedule) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (zone, weekday) DO UPDATE SET zone_id = excluded.zone_id, digest = excluded.digest, schedule = excluded.schedule '
+                'WHERE digest != excluded.digest OR zone_id != excluded.zone_id',
+                (zone_name, weekday, zone_id, hashlib.sha1(data).hexdigest(), data))
+
+    def _get_deferred_zone_days(self) -> set[tuple[str, int]]:
+        if self.deferred_zone_days is None:
+            with self.db_lock:
+                rows = self.connection.execute('SELECT zone, weekday FROM deferred_zone_days').fetchall()
+            self.deferred_zone_days = set((zone, weekday) for zone, weekday in rows)
+        return self.deferred_zone_days
+
+    def _write_deferred_zone_days(self, deferred_zone_days: set[tuple[str, int]]) -> None:
+        self.connection.execute('DELETE FROM deferred_zone_days')
+        self.connection.executemany('INSERT INTO deferred_zone_days (zone, weekday) VALUES (?, ?)', sorted(deferred_zone_days))
@@ -1,11 +1,19 @@
-from datetime import time
+import asyncio
+from datetime import date, time
+import json
 import logging
+import os
 
-import PyTado.interface
 from models.schedules import DailySchedule
 from models.tadoschedules import HomeSchedules, ZoneSchedules
-from PyTado.interface import Tado
 import PyTado.const
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PyTado.interface import Tado
+
+
+DEFAULT_DATA_DIR = '/data'
 
 
 def get_tado_day_type(weekday: int) -> str:
@@ -36,9 +44,24 @@ def _to_tado_schedule(day_type: str, schedule: DailySchedule) -> list[any]:
         for b in schedule.blocks.values()])
 
 class TadoAdapter:
+    """Sets tado° schedules using the PyTado library.
+
+    The refresh token of the activated device and the map of zone names and ids are persisted in the
+    data directory. Thus creating the adapter never touches the network: the device activation, which
+    may block until a human approves it, is done by `connect` in the background, and the zones are only
+    queried if they are not known yet.
+    """
     logger: logging.Logger = logging.getLogger(__name__)
-    tado: Tado = None
+    tado: 'Tado' = None
     zone_ids: dict[str: int] = None
+    zone_names: dict[int: str] = None
+    data_dir: str
+    connected: asyncio.Event
+    # PyTado refreshes its token within a request, so it must not be used by concurrent threads
+    max_concurrent_requests: int = 1
+    # delay after a failed connect, doubled after each further failure
+    connect_retry_seconds: float = 10.0
+    max_connect_retry_seconds: float = 3600.0
 
     TIMETABLE_MON_TO_SUN = 0
     TIMETABLE_MON_TO_FRI_SAT_SUN = 1
@@ -54,21 +77,70 @@ class TadoAdapter:
     # DAY_TYPE_SATURDAY = 'SATURDAY'
     # DAY_TYPE_SUNDAY = 'SUNDAY'
 
-    def __init__(self):
-        self.tado = self._activate_device()
-        self.zone_ids = self._get_zone_ids()
+    def __init__(self, data_dir: str = DEFAULT_DATA_DIR):
+        self.data_dir = data_dir
+        self.connected = asyncio.Event()
+        self._set_zone_ids(self._read_zone_ids_from_file())
+
+    async def connect(self) -> None:
+        """Connects to tado°, retrying with an increasing delay until it succeeds. A network error or an
+        expired device activation must not end the service, as it would take down all other homes too.
+        """
+        delay = self.connect_retry_seconds
+        while True:
+            try:
+                await self._connect()
+                return
+            except Exception as exc:
+                self.logger.error('Failed connecting to tado°, retrying in %.0f seconds: %s', delay, exc)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_connect_retry_seconds)
+
+    async def _connect(self) -> None:
+        """Activates the device and, if the zones are not known yet, gets them from tado°.
+        The blocking calls are executed in a separate thread.
+        """
+        self.tado = await asyncio.to_thread(self._activate_device)
+        if not self.zone_ids:
+            await asyncio.to_thread(self._refresh_zone_ids)
+        self.connected.set()
+
+    async def wait_until_connected(self) -> None:
+        await self.connected.wait()
+
+    async def close(self) -> None:
+        pass
+
+    def _token_file_name(self) -> str:
+        return os.path.join(self.data_dir, 'tado_refresh_token.json')
+
+    def _zones_file_name(self) -> str:
+        return os.path.join(self.data_dir, 'tado_zones.json')
+
+    def _activate_device(self) -> 'Tado':
+        # imported on first use, as PyTado pulls in requests, which the async client does not need
+        from PyTado.http import DeviceActivationStatus
+        from PyTado.interface import Tado
+
+        tado = Tado(token_file_path = self._token_file_name())
+
+        if tado.device_activation_status() == DeviceActivationStatus.NOT_STARTED:
+            # the saved refresh token has been rejected, so start over with a new device activation
+            self.logger.warning('Saved refresh token is not valid anymore.')
+            os.remove(self._token_file_name())
+            tado = Tado(token_file_path = self._token_file_name())
 
-    def _activate_device(self) -> Tado:
-        tado = Tado()
         self.logger.info("Device activation status: %s", tado.device_activation_status())
-        self.logger.warning("ATTENTION: Please activate this device using the verification URL: %s", tado.device_verification_url())
 
-        tado.device_activation()
+        if tado.device_activation_status() != DeviceActivationStatus.COMPLETED:
+            self.logger.warning("ATTENTION: Please activate this device using the verification URL: %s", tado.device_verification_url())
 
-        self.logger.info("Device activation status: %s", tado.device_activation_status())
+            tado.device_activation()
+
+            self.logger.info("Device activation status: %s", tado.device_activation_status())
         return tado
 
-    def _get_zone_ids(self) -> dict[str: int]:
+    def _refresh_zone_ids(self) -> None:
         self.logger.debug('Getting zones')
 
         zones = self.tado.get_zones()
@@ -76,13 +148,62 @@ class TadoAdapter:
 
         zone_ids = { z.get('name') : z.get('id') for z in zones }
         self.logger.info('Tado zones: %s', zone_ids)
-        return zone_ids
 
-    def get_zone_id(self, zone_name: str) -> int:
+        self._set_zone_ids(zone_ids)
+        self._write_zone_ids_to_file(zone_ids)
+
+    def _set_zone_ids(self, zone_ids: dict[str: int]) -> None:
+        self.zone_ids = zone_ids
+        self.zone_names = { id: name for name, id in zone_ids.items() }
+
+    def _read_zone_ids_from_file(self) -> dict[str: int]:
+        try:
+            with open(self._zones_file_name(), 'r', encoding='utf-8') as stream:
+                zone_ids = json.load(stream)
+            self.logger.debug('Tado zones read from file: %s', zone_ids)
+            return zone_ids
+
+        except FileNotFoundError as exc:
+            return {}
+
+        except json.JSONDecodeError as exc:
+            self.logger.error(exc)
+            return {}
+
+    def _write_zone_ids_to_file(self, zone_ids: dict[str: int]) -> None:
+        file_name = self._zones_file_name()
+        try:
+            self._write_file(file_name, json.dumps(zone_ids))
+
+        except OSError as exc:
+            self.logger.warning('Failed writing Tado zones to "%s": %s', file_name, exc)
+
+    def _write_file(self, file_name: str, text: str) -> None:
+        """Writes a temporary file in the same directory first and then replaces the file by it, so that a
+        crash while writing never leaves a truncated file behind.
+        """
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        temp_file_name = file_name + '.tmp'
+        try:
+            with open(temp_file_name, "w", encoding='utf8') as text_file:
+                text_file.write(text)
+                text_file.flush()
+                os.fsync(text_file.fileno())
+            os.replace(temp_file_name, file_name)
+        finally:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+
+    async def get_zone_id(self, zone_name: str) -> int:
+        if zone_name not in self.zone_ids and self.tado:
+            # the zone may have been added or renamed since the zones have been saved
+            await asyncio.to_thread(self._refresh_zone_ids)
         return self.zone_ids[zone_name]
 
-    def get_zone_name(self, zone_id: int) -> str:
-        return next(name for name, id in self.zone_ids.items() if id == zone_id)
+    async def get_zone_name(self, zone_id: int) -> str:
+        if zone_id not in self.zone_names and self.tado:
+            await asyncio.to_thread(self._refresh_zone_ids)
+        return self.zone_names[zone_id]
 
 
     def set_schedules_for_all_zones(self, home_schedules: HomeSchedules) -> None:
@@ -93,11 +214,19 @@ class TadoAdapter:
     def set_schedules_for_zone(self, zone_schedules: ZoneSchedules) -> None:
         self.logger.info('Setting schedule for Tado zone "%s" (%d)', zone_schedules.name, zone_schedules.id)
 
-        for weekday in range(0, 7):
+        # start with today, which takes effect first
+        today = date.today().weekday()
+        for weekday in [(today + n) % 7 for n in range(0, 7)]:
             schedule = zone_schedules.daily_schedules[weekday]
             self.set_schedule_for_zone_and_day(zone_schedules.name, zone_schedules.id, weekday, schedule)
 
-        result = self.tado.set_timetable(zone_schedules.id, 2) # timetable: 2 = Tado.Timetable.SEVEN_DAY
+        self.set_timetable_for_zone(zone_schedules.name, zone_schedules.id)
+
+
+    def set_timetable_for_zone(self, zone_name: str, zone_id: int) -> None:
+        self.logger.debug('Activating seven day timetable for Tado zone "%s" (%d)', zone_name, zone_id)
+
+        result = self.tado.set_timetable(zone_id, 2) # timetable: 2 = Tado.Timetable.SEVEN_DAY
         self.logger.debug('result: %s', result)
 
 
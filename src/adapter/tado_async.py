@@ -0,0 +1,235 @@
+import aiohttp # https://docs.aiohttp.org/
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+import json
+import logging
+from adapter.tado import TadoAdapter, DEFAULT_DATA_DIR, _to_tado_schedule, get_tado_day_type
+from models.schedules import DailySchedule
+from models.tadoschedules import HomeSchedules, ZoneSchedules
+from PyTado.const import CLIENT_ID_DEVICE
+from typing import Any, Optional
+
+
+TADO_API_URL = 'https://my.tado.com/api/v2/'
+TADO_TOKEN_URL = 'https://login.tado.com/oauth2/token'
+TADO_DEVICE_AUTHORIZE_URL = 'https://login.tado.com/oauth2/device_authorize'
+
+
+class AsyncTadoAdapter(TadoAdapter):
+    """Sets tado° schedules using asyncio and a pooled aiohttp client session instead of PyTado.
+
+    Implements the same surface as `TadoAdapter`, but the methods sending schedules are coroutines,
+    so that many zones can be updated concurrently on a single thread. The refresh token file and the
+    zone map are shared with `TadoAdapter`, so both adapters can be used alternately.
+    Only tado° homes of the classic generation are supported, not tado° X.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    session: aiohttp.ClientSession = None
+    home_id: int = None
+    access_token: str = None
+    refresh_token: str = None
+    refresh_at: datetime = None
+    token_lock: asyncio.Lock
+    zone_refresh_task: asyncio.Task = None
+
+    def __init__(self, data_dir: str = DEFAULT_DATA_DIR, max_concurrent_requests: int = 4):
+        super().__init__(data_dir)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.token_lock = asyncio.Lock()
+
+    async def _connect(self) -> None:
+        """Creates the client session, activates the device if there is no valid refresh token and
+        gets the zones from tado° if they are not known yet.
+        """
+        if not self.session:
+            # kept by a retry after a failed connect
+            self.session = self._create_session()
+
+        refresh_token = self._read_refresh_token_from_file()
+        if not refresh_token or not await self._refresh_access_token(refresh_token):
+            await self._activate_device()
+        self.logger.info("Device activation status: %s", 'COMPLETED')
+
+        self.home_id = (await self._request('GET', 'me'))['homes'][0]['id']
+        home = await self._request('GET', f'homes/{self.home_id}')
+        if home.get('generation') == 'LINE_X':
+            raise ValueError('tado° X homes are not supported by the asynchronous tado° client.')
+
+        if not self.zone_ids:
+            await self._refresh_zone_ids()
+        self.connected.set()
+
+    async def close(self) -> None:
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(limit = self.max_concurrent_requests, ttl_dns_cache = 3600),
+            timeout = aiohttp.ClientTimeout(total = 30),
+            headers = { 'Referer': 'https://app.tado.com/' })
+
+
+    async def _activate_device(self) -> None:
+        """Runs the OAuth device authorization flow and waits until a human has approved the device.
+        """
+        params = { 'client_id': CLIENT_ID_DEVICE, 'scope': 'offline_access' }
+        async with self.session.post(TADO_DEVICE_AUTHORIZE_URL, params = params) as response:
+            response.raise_for_status()
+            device_flow = await response.json()
+
+        self.logger.warning("ATTENTION: Please activate this device using the verification URL: %s?user_code=%s",
+                            device_flow['verification_uri'], device_flow['user_code'])
+
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds = device_flow['expires_in'])
+        params = { 'client_id': CLIENT_ID_DEVICE,
+                   'device_code': device_flow['device_code'],
+                   'grant_type': 'urn:ietf:params:oauth:grant-type:device_code' }
+
+        while datetime.now(timezone.utc) < expires_at:
+            await asyncio.sleep(device_flow['interval'])
+
+            async with self.session.post(TADO_TOKEN_URL, params = params) as response:
+                data = await response.json()
+                if response.status == 200:
+                    self._set_tokens(data)
+                    return
+                if response.status != 400 or data.get('error') != 'authorization_pending':
+                    raise ValueError(f'Device activation failed: {data}')
+
+            self.logger.info('Authorization pending, waiting for user to authorize.')
+
+        raise TimeoutError('Device activation has not been approved in time.')
+
+    async def _refresh_access_token(self, refresh_token: str) -> bool:
+        params = { 'client_id': CLIENT_ID_DEVICE, 'grant_type': 'refresh_token', 'refresh_token': refresh_token }
+        async with self.session.post(TADO_TOKEN_URL, params = params) as response:
+            if response.status != 200:
+                self.logger.warning('Failed to refresh token, status code: %s', response.status)
+                return False
+            self._set_tokens(await response.json())
+            return True
+
+    async def _ensure_access_token(self, rejected_access_token: Optional[str] = None) -> None:
+        async with self.token_lock:
+            # a concurrent request may have refreshed the rejected token already
+            if datetime.now(timezone.utc) >= self.refresh_at or self.access_token == rejected_access_token:
+                if not await self._refresh_access_token(self.refresh_token):
+                    raise PermissionError('The tado° refresh token has been rejected, the device needs to be activated again.')
+
+    def _set_tokens(self, data: dict[str, Any]) -> None:
+        self.access_token = data['access_token']
+        self.refresh_token = data['refresh_token']
+        # refresh the access token shortly before it expires
+        self.refresh_at = datetime.now(timezone.utc) + timedelta(seconds = int(data.get('expires_in', 600)) - 30)
+        self._write_refresh_token_to_file(self.refresh_token)
+
+    def _read_refresh_token_from_file(self) -> Optional[str]:
+        try:
+            with open(self._token_file_name(), 'r', encoding='utf-8') as stream:
+                return json.load(stream).get('refresh_token')
+
+        except FileNotFoundError as exc:
+            return None
+
+        except json.JSONDecodeError as exc:
+            self.logger.error(exc)
+            return None
+
+    def _write_refresh_token_to_file(self, refresh_token: str) -> None:
+        # same format as used by PyTado
+        self._write_file(self._token_file_name(), json.dumps({ 'refresh_token': refresh_token }))
+
+
+    async def _request(self, method: str, command: str, payload: Any = None) -> Any:
+        await self._ensure_access_token()
+
+        access_token = self.access_token
+        try:
+            return await self._send_request(method, command, payload, access_token)
+        except aiohttp.ClientResponseError as exc:
+            if exc.status != 401:
+                raise
+
+        # the access token has been revoked before it expired, so refresh it and try once more
+        self.logger.warning('Access token rejected by tado°, refreshing it.')
+        await self._ensure_access_token(rejected_access_token = access_token)
+        return await self._send_request(method, command, payload, self.access_token)
+
+    async def _send_request(self, method: str, command: str, payload: Any, access_token: str) -> Any:
+        headers = { 'Authorization': f'Bearer {access_token}' }
+        async with self.session.request(method, TADO_API_URL + command, json = payload, headers = headers) as response:
+            response.raise_for_status()
+            if response.status == 204:
+                return None
+            return await response.json(content_type = None)
+
+    async def _refresh_zone_ids(self) -> None:
+        self.logger.debug('Getting zones')
+
+        zones = await self._request('GET', f'homes/{self.home_id}/zones')
+        self.logger.debug('Tado zones: %s', zones)
+
+        zone_ids = { z.get('name') : z.get('id') for z in zones }
+        self.logger.info('Tado zones: %s', zone_ids)
+
+        self._set_zone_ids(zone_ids)
+        self._write_zone_ids_to_file(zone_ids)
+
+    async def get_zone_id(self, zone_name: str) -> int:
+        if zone_name not in self.zone_ids:
+            # the zone may have been added or renamed since the zones have been saved
+            await self._refresh_zone_ids_once()
+        return self.zone_ids[zone_name]
+
+    async def get_zone_name(self, zone_id: int) -> str:
+        if zone_id not in self.zone_names:
+            await self._refresh_zone_ids_once()
+        return self.zone_names[zone_id]
+
+    async def _refresh_zone_ids_once(self) -> None:
+        """Gets the zones from tado°, once for all lookups failing at the same time.
+        """
+        if not self.session:
+            return
+        if not self.zone_refresh_task or self.zone_refresh_task.done():
+            self.zone_refresh_task = asyncio.get_running_loop().create_task(self._refresh_zone_ids())
+        await asyncio.shield(self.zone_refresh_task)
+
+
+    async def set_schedules_for_all_zones(self, home_schedules: HomeSchedules) -> None:
+        await asyncio.gather(*[self.set_schedules_for_zone(zone_schedules)
+                               for zone_schedules in home_schedules.schedules.values()])
+
+
+    async def set_schedules_for_zone(self, zone_schedules: ZoneSchedules) -> None:
+        self.logger.info('Setting schedule for Tado zone "%s" (%d)', zone_schedules.name, zone_schedules.id)
+
+        # start with today, which takes effect first
+        today = date.today().weekday()
+        for weekday in [(today + n) % 7 for n in range(0, 7)]:
+            schedule = zone_schedules.daily_schedules[weekday]
+            await self.set_schedule_for_zone_and_day(zone_schedules.name, zone_schedules.id, weekday, schedule)
+
+        await self.set_timetable_for_zone(zone_schedules.name, zone_schedules.id)
+
+
+    async def set_timetable_for_zone(self, zone_name: str, zone_id: int) -> None:
+        self.logger.debug('Activating seven day timetable for Tado zone "%s" (%d)', zone_name, zone_id)
+
+        result = await self._request('PUT', f'homes/{self.home_id}/zones/{zone_id:d}/schedule/activeTimetable',
+                                     { 'id': self.TIMETABLE_MON_TUE_WED_THU_FRI_SAT_SUN })
+        self.logger.debug('result: %s', result)
+
+
+    async def set_schedule_for_zone_and_day(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule) -> None:
+        day_type = get_tado_day_type(weekday)[:3]
+        self.logger.info('Setting schedule for Tado zone "%s" (%d) for %s: %s', zone_name, zone_id, day_type, schedule.to_string())
+
+        tado_schedule = _to_tado_schedule(day_type, schedule)
+        self.logger.debug('Schedule: %s', tado_schedule)
+
+        result = await self._request('PUT', f'homes/{self.home_id}/zones/{zone_id:d}/schedule/timetables/'
+                                     f'{self.TIMETABLE_MON_TUE_WED_THU_FRI_SAT_SUN}/blocks/{day_type}', tado_schedule)
+        self.logger.debug('result: %s', result)
@@ -1,104 +1,192 @@
-import json
+import asyncio
+import inspect
 import logging
+from adapter.pushscheduler import PendingWrite, PushScheduler
+from adapter.sqlitestore import SQLiteStore
 from adapter.tado import TadoAdapter, get_tado_day_type
 from models.schedules import DailySchedule
 from models.tadoschedules import HomeSchedules, ZoneSchedules
-import os
+from services import metrics
+from typing import Any, Optional
 
 
 class CachingTadoAdapter:
+    """Sends only those daily schedules to tado° that differ from the ones sent before.
+
+    Every single daily schedule successfully sent is written to the store right away, so that a retry
+    after a partial failure only sends the days that have not been sent yet. The days deferred by the
+    `PushScheduler`, or not sent due to a failure, are kept in the store and sent by a later run even if
+    their schedules equal the stored ones, e.g. after a full update.
+
+    The wrapped adapter may either be a `TadoAdapter`, whose blocking calls are executed in a separate
+    thread, or an `AsyncTadoAdapter`. The daily schedules of all zones are sent in the order given by the
+    `PushScheduler`, concurrently as far as the wrapped adapter supports it.
+    """
     logger: logging.Logger = logging.getLogger(__name__)
-    current_schedules: HomeSchedules = None
+    current_schedules: dict[tuple[str, int], DailySchedule] = None
+    deferred_zone_days: Optional[set[tuple[str, int]]] = None
     tado_adapter: TadoAdapter
+    store: SQLiteStore
     full_update: bool
+    push_scheduler: PushScheduler
+    requests: asyncio.Semaphore
 
-    def __init__(self, tado_adapter: TadoAdapter, full_update: bool = False):
+    def __init__(self, tado_adapter: TadoAdapter, store: SQLiteStore, full_update: bool = False, push_scheduler: PushScheduler = None):
         self.tado_adapter = tado_adapter
+        self.store = store
         self.full_update = full_update
+        self.push_scheduler = push_scheduler or PushScheduler()
+        self.requests = asyncio.Semaphore(getattr(tado_adapter, 'max_concurrent_requests', 1))
 
-    def get_zone_id(self, zone_name: str) -> int:
-        return self.tado_adapter.get_zone_id(zone_name)
+    async def get_zone_id(self, zone_name: str) -> int:
+        return await self._lookup(self.tado_adapter.get_zone_id, zone_name)
 
-    def get_zone_name(self, zone_id: int) -> str:
-        return self.tado_adapter.get_zone_name(zone_id)
+    async def get_zone_name(self, zone_id: int) -> str:
+        return await self._lookup(self.tado_adapter.get_zone_name, zone_id)
 
 
-    def set_schedules_for_all_zones(self, home_schedules: HomeSchedules) -> None:
-        if self.full_update:
-            self.tado_adapter.set_schedules_for_all_zones(home_schedules)
-        else:
-            for zone_schedules in home_schedules.schedules.values():
-                self.set_schedules_for_zone(zone_schedules)
+    async def set_schedules_for_all_zones(self, home_schedules: HomeSchedules, zone_names: Optional[set[str]] = None) -> None:
+        """Sends the schedules of the given zones.
 
-        self._write_current_schedules_to_cache(home_schedules)
+        Args:
+            zone_names (Optional[set[str]]): The zones whose sent schedules are kept in the store. Defaults to the
+                given zones, while a run updating some zones only keeps the sent schedules of the others.
+        """
+        pending_writes = []
+        for zone_schedules in home_schedules.schedules.values():
+            pending_writes.extend(self._get_pending_writes(zone_schedules))
 
+        await self._send(pending_writes)
 
-    def set_schedules_for_zone(self, zone_schedules: ZoneSchedules) -> None:
         if self.full_update:
-            self.tado_adapter.set_schedules_for_zone(zone_schedules)
-        else:
-            current_schedules = self._get_current_schedules()
-            current_zone_schedules = current_schedules.schedules[zone_schedules.name] \
-                if current_schedules and zone_schedules.name in current_schedules.schedules else None
-
-            if current_zone_schedules and zone_schedules == current_zone_schedules:
-                self.logger.info('Schedule for Tado zone "%s" (%d) is up to date.', zone_schedules.name, zone_schedules.id)
-            else:
-                for weekday in range(0, 7):
-                    schedule = zone_schedules.daily_schedules[weekday]
-                    self.set_schedule_for_zone_and_day(zone_schedules.name, zone_schedules.id, weekday, schedule)
-
-
-    def set_schedule_for_zone_and_day(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule) -> None:
-        if self.full_update:
-            self.tado_adapter.set_schedule_for_zone_and_day(zone_name, zone_id, weekday, schedule)
-        else:
-            current_schedules = self._get_current_schedules()
-            current_zone_schedules = current_schedules.schedules[zone_name] \
-                if current_schedules and zone_name in current_schedules.schedules else None
-            current_daily_schedule = current_zone_schedules.daily_schedules[weekday] \
-                if current_zone_schedules else None
-
-            if current_daily_schedule and schedule == current_daily_schedule:
-                day_type = get_tado_day_type(weekday)
-                self.logger.debug('Schedule for Tado zone "%s" (%d) is up to date for %s.', zone_name, zone_id, day_type)
-            else:
-                self.tado_adapter.set_schedule_for_zone_and_day(zone_name, zone_id, weekday, schedule)
-
-
-    def _get_current_schedules(self) -> HomeSchedules:
-        if not self.current_schedules:
-            self.current_schedules = self._read_current_schedules_from_cache(self._schedules_cache_file_name())
-
-        return self.current_schedules
-
-    def _schedules_cache_file_name(self) -> str:
-        return "./.cache/tado_schedules.json"
-
-    def _read_current_schedules_from_cache(self, file_name: str) -> HomeSchedules:
-        # step 1: Read the file. Since file is small, we are doing a whole read.
-        try:
-            with open(file_name, 'r', encoding='utf-8') as stream:
-                # step 2: Parse the yaml file into a dictionary
-                json_data = json.load(stream) # -> Dict[Any, Any]
-
-            # step 3: Change dictionary into class
-            return HomeSchedules(**json_data)
-
-        except FileNotFoundError as exc:
-            return HomeSchedules()
+            for zone_schedules in home_schedules.schedules.values():
+                await self._call(self.tado_adapter.set_timetable_for_zone, zone_schedules.name, zone_schedules.id)
 
-        except json.JSONDecodeError as exc:
-            self.logger.error(exc)
-            return HomeSchedules()
+        # forget zones that are not assigned anymore
+        self.store.remove_other_zones(zone_names if zone_names is not None else set(home_schedules.schedules))
 
-    def _write_current_schedules_to_cache(self, home_schedules: HomeSchedules) -> None:
-        json_data = home_schedules.model_dump(mode = 'json')
-        json_str = json.dumps(json_data)
-        file_name = self._schedules_cache_file_name()
 
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, "w", encoding='utf8') as text_file:
-            text_file.write(json_str)
+    async def set_schedules_for_zone(self, zone_schedules: ZoneSchedules) -> None:
+        await self._send(self._get_pending_writes(zone_schedules))
 
-        self.current_schedules = home_schedules
+        if self.full_update:
+            await self._call(self.tado_adapter.set_timetable_for_zone, zone_schedules.name, zone_schedules.id)
+
+
+    async def set_schedule_for_zone_and_day(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule) -> None:
+        if not self.full_update and schedule == self._get_current_daily_schedule(zone_name, weekday):
+            day_type = get_tado_day_type(weekday)
+            self.logger.debug('Schedule for Tado zone "%s" (%d) is up to date for %s.', zone_name, zone_id, day_type)
+            return
+
+        await self._call(self.tado_adapter.set_schedule_for_zone_and_day, zone_name, zone_id, weekday, schedule)
+        self._write_current_daily_schedule(zone_name, zone_id, weekday, schedule)
+
+
+    def _get_pending_writes(self, zone_schedules: ZoneSchedules) -> list[PendingWrite]:
+        deferred_zone_days = self._get_deferred_zone_days()
+        if not self.full_update and self._is_zone_up_to_date(zone_schedules) \
+                and not any((zone_schedules.name, weekday) in deferred_zone_days for weekday in range(0, 7)):
+            self.logger.info('Schedule for Tado zone "%s" (%d) is up to date.', zone_schedules.name, zone_schedules.id)
+            metrics.record_cache_lookup('schedules', True, 7)
+            return []
+
+        pending_writes = []
+        for weekday in range(0, 7):
+            schedule = zone_schedules.daily_schedules[weekday]
+            current = self._get_current_daily_schedule(zone_schedules.name, weekday)
+            if not self.full_update:
+                metrics.record_cache_lookup('schedules', schedule == current)
+            if self.full_update or schedule != current or (zone_schedules.name, weekday) in deferred_zone_days:
+                pending_writes.append(self.push_scheduler.create_pending_write(
+                    zone_schedules.name, zone_schedules.id, weekday, schedule, current))
+        return pending_writes
+
+    async def _send(self, pending_writes: list[PendingWrite]) -> bool:
+        """Sends the pending writes in the order given by the push scheduler, using as many concurrent
+        requests as the tado° adapter supports. Sending stops at the first error.
+
+        Args:
+            pending_writes (list[PendingWrite]): The daily schedules to be sent.
+
+        Returns:
+            bool: True if all pending writes have been sent, False if some have been deferred.
+        """
+        queue = list(reversed(self.push_scheduler.order(pending_writes)))
+        self.logger.debug('Pending writes: %s', list(reversed(queue)))
+        deferred = []
+        errors = []
+        failed = []
+
+        async def send_next() -> None:
+            while queue and not errors:
+                pending_write = queue.pop()
+                if not self.push_scheduler.may_send(pending_write):
+                    deferred.append(pending_write)
+                    continue
+                try:
+                    await self._call(self.tado_adapter.set_schedule_for_zone_and_day, pending_write.zone_name,
+                                     pending_write.zone_id, pending_write.weekday, pending_write.schedule)
+                    self._write_current_daily_schedule(pending_write.zone_name, pending_write.zone_id,
+                                                      pending_write.weekday, pending_write.schedule)
+                except Exception as e:
+                    errors.append(e)
+                    failed.append(pending_write)
+
+        concurrent_requests = getattr(self.tado_adapter, 'max_concurrent_requests', 1)
+        await asyncio.gather(*[send_next() for _ in range(0, concurrent_requests)])
+
+        # the days not sent in this run are sent by the next one, even if their schedules do not change anymore
+        unsent = deferred + failed + queue
+        self._write_deferred_zone_days(set((w.zone_name, w.weekday) for w in pending_writes),
+                                       set((w.zone_name, w.weekday) for w in unsent))
+
+        # every day sent successfully is in the store
+        for error in errors[1:]:
+            self.logger.error('Failed setting schedule: %s', error)
+        if errors:
+            raise errors[0]
+
+        if deferred:
+            self.logger.info('Deferred %d daily schedules to the next run: %s', len(deferred), deferred)
+        return not deferred
+
+
+    async def _lookup(self, method, *args) -> Any:
+        if inspect.iscoroutinefunction(method):
+            return await method(*args)
+        return method(*args)
+
+    async def _call(self, method, *args) -> None:
+        async with self.requests:
+            with metrics.record_api_call('tado'):
+                if inspect.iscoroutinefunction(method):
+                    await method(*args)
+                else:
+                    await asyncio.to_thread(method, *args)
+
+
+    def _is_zone_up_to_date(self, zone_schedules: ZoneSchedules) -> bool:
+        return all(zone_schedules.daily_schedules[weekday] == self._get_current_daily_schedule(zone_schedules.name, weekday)
+                   for weekday in range(0, 7))
+
+    def _get_current_daily_schedule(self, zone_name: str, weekday: int) -> Optional[DailySchedule]:
+        if self.current_schedules is None:
+            self.current_schedules = self.store.read_daily_schedules()
+
+        return self.current_schedules.get((zone_name, weekday))
+
+    def _get_deferred_zone_days(self) -> set[tuple[str, int]]:
+        if self.deferred_zone_days is None:
+            self.deferred_zone_days = self.store.read_deferred_zone_days()
+        return self.deferred_zone_days
+
+    def _write_deferred_zone_days(self, pending_zone_days: set[tuple[str, int]], unsent_zone_days: set[tuple[str, int]]) -> None:
+        self.deferred_zone_days = (self._get_deferred_zone_days() - pending_zone_days) | unsent_zone_days
+        self.store.write_deferred_zone_days(self.deferred_zone_days)
+
+    def _write_current_daily_schedule(self, zone_name: str, zone_id: int, weekday: int, schedule: DailySchedule) -> None:
+        self.store.write_daily_schedule(zone_name, zone_id, weekday, schedule)
+
+        if self.current_schedules is not None:
+            self.current_schedules[(zone_name, weekday)] = schedule
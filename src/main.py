@@ -1,13 +1,26 @@
+from time import perf_counter
+# taken before the other imports, for the startup timing logged by main()
+STARTED_AT = perf_counter()
+
 from argparse import ArgumentParser
 import asyncio
 from datetime import time
 import services.core
+import services.fetch
 import services.filewatcher
+import services.jitter
+import services.metrics
+import services.pool
+import services.profiler
+import services.recording
 import services.timer
+import services.webhook
 import adapter.tado
+from adapter.sqlitestore import SQLiteStore
 import logging, logging.handlers
 from models.settings import CoreSettings
-import sys, time
+import os, signal, sys, time
+from typing import Optional
 
 
 def create_file_log_handler(log_file: str = None) -> logging.Handler:
@@ -46,7 +59,80 @@ def configure_log_handler(log_handler: logging.Handler) -> logging.Handler:
     return log_handler
 
 
+def get_max_rss_mb() -> Optional[float]:
+    """Returns the peak resident set size of the process in MB, if the platform reports it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_homes(config_files: list[str], data_dir: str) -> list[tuple[str, str, str]]:
+    """Assigns a name and a data directory to the home of each config file. A single home uses the
+    data directory itself, several homes use a subdirectory named like their config file.
+
+    Args:
+        config_files (list[str]): The config files, one per home.
+        data_dir (str): The directory for persistent data.
+
+    Returns:
+        list[tuple[str, str, str]]: The name, config file and data directory of each home.
+    """
+    if len(config_files) == 1:
+        return [('', config_files[0], data_dir)]
+
+    homes = []
+    for config_file in config_files:
+        name = os.path.splitext(os.path.basename(config_file))[0]
+        if any(name == home[0] for home in homes):
+            raise ValueError(f'Config files of several homes must have different names: {config_file}')
+        homes.append((name, config_file, os.path.join(data_dir, name)))
+    return homes
+
+
+async def replay(archive: str, runs: int, profile_mode: str, data_dir: str) -> None:
+    """Runs the pipeline offline with the inputs of a recorded run, see `services.recording`.
+
+    Args:
+        archive (str): The file name of the recording.
+        runs (int): The number of runs, e.g. to compare their durations.
+        profile_mode (str): Profiles the runs in this mode, if given.
+        data_dir (str): The directory for the profiles.
+    """
+    logger = logging.getLogger(__name__)
+    recording = services.recording.Recording.load(archive)
+    services.recording.use_timezone(recording)
+    settings = CoreSettings(**recording.settings)
+    logger.info("Replaying %s, recorded at %s %s", archive, recording.now, recording.timezone or '')
+
+    profiler = None
+    if profile_mode:
+        profiler = services.profiler.Profiler(os.path.join(data_dir, 'profiles'), profile_mode)
+        profiler.arm(runs)
+    executor = services.pool.create_executor(settings.worker_processes)
+    try:
+        for run in range(0, runs):
+            started_at = time.monotonic()
+            tado = await services.recording.replay(recording, executor, profiler)
+            logger.info("Replayed run %d of %d in %.3f seconds, %d daily schedules sent",
+                        run + 1, runs, time.monotonic() - started_at, len(tado.schedules))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures = True)
+
+
 async def main(argv):
+    # the durations of the phases of the startup, the heavy adapters are imported once a config needs them
+    startup_phases = [('imports', perf_counter() - STARTED_AT)]
+    phase_started_at = perf_counter()
+
+    def end_startup_phase(name: str) -> None:
+        nonlocal phase_started_at
+        startup_phases.append((name, perf_counter() - phase_started_at))
+        phase_started_at = perf_counter()
 
     logging_argparse = ArgumentParser(prog=__file__, add_help=False)
     logging_argparse.add_argument('--log-level', default='INFO', help='set log level')
@@ -74,38 +160,114 @@ async def main(argv):
 
     parsers = [logging_argparse]
     main_parser = ArgumentParser(prog=__file__, parents=parsers)
-    main_parser.add_argument('-c', '--config-file')
+    main_parser.add_argument('-c', '--config-file', action='append',
+                             help='set config file, may be given several times to serve several homes')
+    main_parser.add_argument('-d', '--data-dir', default=adapter.tado.DEFAULT_DATA_DIR,
+                             help='set directory for persistent data like the tado° refresh token and the cache')
+    main_parser.add_argument('--tado-client', choices=['sync', 'async'], default='sync',
+                             help='use the PyTado based (sync) or the asyncio based (async) tado° client')
+    main_parser.add_argument('--replay', metavar='ARCHIVE',
+                             help='run the pipeline offline with the inputs of a recorded run, instead of serving homes')
+    main_parser.add_argument('--replay-runs', type=int, default=1, help='set number of replayed runs')
+    main_parser.add_argument('--replay-profile', choices=['sampling', 'deterministic'],
+                             help='profile the replayed runs, writing to <data dir>/profiles')
     main_args = main_parser.parse_args(argv)
 
-    config_file = main_args.config_file
+    if main_args.replay:
+        await replay(main_args.replay, main_args.replay_runs, main_args.replay_profile, main_args.data_dir)
+        return
+    if not main_args.config_file:
+        main_parser.error('the following arguments are required: -c/--config-file')
 
-    logger.info("Config file is: {}".format(config_file))
+    config_files = main_args.config_file
+    data_dir = main_args.data_dir
 
-    try:
-        # Create a queue that we will use to store our "workload".
-        queue = asyncio.Queue()
-
-        config = CoreSettings.load_from(config_file)
-        polling_minutes = config.polling_minutes
+    logger.info("Config files are: {}".format(', '.join(config_files)))
+    logger.info("Data directory is: {}".format(data_dir))
 
-        tado = adapter.tado.TadoAdapter()
+    tados = []
+    stores = []
+    executor = None
+    try:
+        homes = get_homes(config_files, data_dir)
+        first_config = CoreSettings.load_from(config_files[0])
+        instance_id = services.jitter.get_instance_id(data_dir, first_config.instance_id)
+        logger.info("Instance id is: %s", instance_id)
+        end_startup_phase('config')
+        executor = services.pool.create_executor(first_config.worker_processes)
+
+        # the events of calendars used by several homes are fetched once
+        fetch_stage = services.fetch.FetchStage(instance_id, executor, data_dir)
+
+        # profiles the next runs when armed by the config, SIGUSR1 or POST /profile with the webhook token
+        profiler = services.profiler.Profiler(os.path.join(data_dir, 'profiles'), first_config.profile_mode or 'sampling')
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.arm)
+        except (AttributeError, NotImplementedError):
+            logger.debug('Profiling on SIGUSR1 is not supported on this platform.')
+
+        # records the next runs when armed by the config
+        recorder = services.recording.Recorder(os.path.join(data_dir, 'recordings'))
+
+        queues = {}
+        webhook_homes = {}
+        end_startup_phase('stages')
 
         async with asyncio.TaskGroup() as tg:
-            # Save a reference to the result of this function, otherwise it may get
-            # garbage collected at any time, even before it’s done
-            core_task = tg.create_task(
-                services.core.Service(config_file, queue, tado)
-                .run())
-
-            timer_task = tg.create_task(
-                services.timer.Service(polling_minutes, queue)
-                .run())
-
-            config_file_changes_task = tg.create_task(
-                services.filewatcher.Service(config_file, queue)
-                .run())
-
-            logger.info("Started at %s", time.strftime('%X'))
+            for name, config_file, home_data_dir in homes:
+                # Create a queue that we will use to store our "workload".
+                queue = asyncio.Queue()
+                queues[name] = queue
+                webhook_homes[name] = (config_file, queue)
+                boundaries = services.core.Boundaries()
+
+                config = CoreSettings.load_from(config_file)
+                polling_minutes = config.polling_minutes
+
+                store = SQLiteStore(home_data_dir, flush_delay_seconds = config.cache_flush_seconds or 0)
+                stores.append(store)
+                offset_seconds = services.jitter.get_offset(f'{instance_id}:{name}' if name else instance_id, config.jitter_seconds)
+                logger.info("Home %s: config file %s, data directory %s, polls shifted by %.0f seconds",
+                            name or '-', config_file, home_data_dir, offset_seconds)
+
+                if main_args.tado_client == 'async':
+                    # binds only the class, a local `adapter` would hide the module in all of main()
+                    from adapter.tado_async import AsyncTadoAdapter
+                    tado = AsyncTadoAdapter(home_data_dir)
+                else:
+                    tado = adapter.tado.TadoAdapter(home_data_dir)
+                tados.append(tado)
+
+                # Activate the device in the background, the core service waits for it before using tado°
+                tado_task = tg.create_task(tado.connect())
+
+                # Save a reference to the result of this function, otherwise it may get
+                # garbage collected at any time, even before it’s done
+                core_task = tg.create_task(
+                    services.core.Service(config_file, queue, tado, store, boundaries, fetch_stage, executor, name, profiler, recorder)
+                    .run())
+
+                timer_task = tg.create_task(
+                    services.timer.Service(polling_minutes, queue, boundaries,
+                                           config.min_polling_minutes, config.max_polling_minutes, offset_seconds)
+                    .run())
+
+                config_file_changes_task = tg.create_task(
+                    services.filewatcher.Service(config_file, queue)
+                    .run())
+
+            if first_config.metrics_port:
+                metrics_task = tg.create_task(
+                    services.metrics.Service(first_config.metrics_port, queues, profiler = profiler,
+                                             webhook = services.webhook.Webhook(webhook_homes, first_config.webhook_token),
+                                             token = first_config.webhook_token)
+                    .run())
+
+            end_startup_phase('homes')
+            max_rss_mb = get_max_rss_mb()
+            logger.info("Started at %s in %.0f ms (%s)%s", time.strftime('%X'), (perf_counter() - STARTED_AT) * 1000,
+                        ', '.join(f'{name} {duration * 1000:.0f} ms' for name, duration in startup_phases),
+                        f', max RSS {max_rss_mb:.1f} MB' if max_rss_mb else '')
 
             # queue.put_nowait(services.core.Message())
 
@@ -115,6 +277,14 @@ async def main(argv):
     except Exception as e:
         logger.critical(e)
 
+    finally:
+        for tado in tados:
+            await tado.close()
+        for store in stores:
+            store.close()
+        if executor:
+            executor.shutdown(cancel_futures = True)
+
 
 if __name__ == "__main__":
     asyncio.run(main(sys.argv[1:]))
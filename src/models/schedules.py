@@ -1,7 +1,6 @@
 from datetime import date, datetime, time, timedelta
 from models.events import Event
 from pydantic import BaseModel
-import pytz
 from typing import Dict
 
 
@@ -69,6 +68,11 @@ class DailySchedule(BaseModel):
         if last_end != time.min:
             raise ValueError(f'expected last block end time {b.end} to be {time.min}')
 
+    @staticmethod
+    def _end_of(t: time) -> time:
+        # an end time of 0:00 is 24:00 and thus after any other time of the day
+        return time.max if t == time.min else t
+
     def _get_previous_block_begin(self, t: time) -> time:
         return max([lt for lt in self.blocks.keys() if lt < t])
 
@@ -91,7 +95,7 @@ class DailySchedule(BaseModel):
                 self.blocks[block.end] = Block(start = block.end, end = b.end, temperature = b.temperature)
                 # shorten the timespan of the preceeding time block
                 b.end = block.end
-            elif block.end < b.end:
+            elif block.end < self._end_of(b.end):
                 block.end = b.end
 
         if not self.blocks.get(block.start):
@@ -102,7 +106,7 @@ class DailySchedule(BaseModel):
                 self.blocks[block.start] = block
                 # shorten the timespan of the preceeding time block
                 b.end = block.start
-            elif b.end < block.end:
+            elif self._end_of(b.end) < self._end_of(block.end):
                 #print(f'changing time block starting {b.start} ending {to}, temperature {temperature}')
                 b.end = block.end
         else:
@@ -112,7 +116,7 @@ class DailySchedule(BaseModel):
             b.end = block.end
 
         # Alle dazwischen liegenden Zeitscheiben löschen.
-        for t in list([t for t in self.blocks.keys() if t > block.start and t < block.end]):
+        for t in list([t for t in self.blocks.keys() if t > block.start and t < self._end_of(block.end)]):
             #b = self.blocks[t]
             #print(f'deleting time block starting {t} ending {b.end}, temperature {b.temperature}')
             del self.blocks[t]
@@ -135,6 +139,20 @@ class DailySchedule(BaseModel):
         self._validate_blocks()
 
 
+    def merge_blocks(self) -> None:
+        """Merges adjacent blocks of the same temperature, e.g. of events following each other.
+        """
+        blocks = {}
+        previous_block = None
+        for t, block in self.blocks.items():
+            if previous_block and block.temperature == previous_block.temperature:
+                previous_block.end = block.end
+            else:
+                blocks[t] = block
+                previous_block = block
+        self.blocks = blocks
+
+
     def optimize(self) -> None:
         for t in list([t for t in self.blocks.keys() if t != time()]):
             block = self.blocks[t]
@@ -161,9 +179,9 @@ class DailySchedule(BaseModel):
         cold = cold or 0.0
         earlystart = earlystart or time.min
 
-        utc=pytz.UTC
-        from_ = utc.localize(datetime.combine(date_, time.min))
-        to = from_ + timedelta(days=1)
+        # the events are in local time, so is the day, which has 23 or 25 hours when daylight saving time changes
+        from_ = datetime.combine(date_, time.min).astimezone()
+        to = datetime.combine(date_ + timedelta(days=1), time.min).astimezone()
 
         events = list([e for e in events if e.start < to and e.end > from_])
         schedule = DailySchedule(weekday = date_.weekday(),
@@ -176,4 +194,19 @@ class DailySchedule(BaseModel):
             end_ = time.min if e.end >= to else e.end.time()
             schedule.insert_block(Block(start = begin_, end = end_, temperature = warm))
 
+        # the result does not depend on the order of the events, see `models.weekgrid`
+        schedule.merge_blocks()
         return schedule
+
+
+def get_weekly_schedules(from_date: date, events: list[Event], warm: float,
+                         cold: float = None, earlystart: time = None) -> list[DailySchedule]:
+    """Calculates the daily schedules of the seven days beginning with `from_date`.
+
+    Returns:
+        list[DailySchedule]: The schedules in the order of the weekdays, i.e. 0 = monday to 6 = sunday.
+    """
+    schedules = list([None for _ in range(0, 7)])
+    for d in [from_date + timedelta(days = n) for n in range(0, 7)]: # iterate days starting with from_date. n is NOT the weekday
+        schedules[d.weekday()] = DailySchedule.from_events(d, events, warm, cold, earlystart)
+    return schedules
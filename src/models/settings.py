@@ -1,7 +1,7 @@
 
 from datetime import time
 import json
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ValidationInfo, field_validator
 from typing import List, Optional
 import yaml
 
@@ -46,18 +46,51 @@ class SchedulesSettings(BaseModel):
 class ICalSettings(BaseModel):
     source: str
     name: str
+    timeout_seconds: Optional[int] = None
+    polling_minutes: Optional[int] = None
+    backoff_max_minutes: Optional[int] = None
 
 
 class ChurchToolsSettings(BaseModel):
     url: str
+    username: Optional[str] = None
+    password: Optional[str] = None
+    token: Optional[str] = None
+    masterdata_cache_hours: Optional[int] = 24
+    hot_days: Optional[int] = 2
+    full_refresh_minutes: Optional[int] = 240
+    timeout_seconds: Optional[int] = None
+    polling_minutes: Optional[int] = None
+    backoff_max_minutes: Optional[int] = None
+
+
+class TadoSettings(BaseModel):
+    max_writes_per_run: Optional[int] = None
+    push_deadline_seconds: Optional[int] = None
 
 
 class CoreSettings(BaseModel):
     polling_minutes: Optional[int] = 15
+    min_polling_minutes: Optional[int] = None
+    max_polling_minutes: Optional[int] = None
+    fetch_timeout_seconds: Optional[int] = 30
+    cache_flush_seconds: Optional[int] = 60
+    instance_id: Optional[str] = None
+    jitter_seconds: Optional[int] = None
+    stagger_seconds: Optional[int] = None
+    worker_processes: Optional[int] = None
+    metrics_port: Optional[int] = 8000
+    profile_runs: Optional[int] = None
+    profile_mode: Optional[str] = 'sampling'
+    record_runs: Optional[int] = None
+    record_anonymized: Optional[bool] = False
+    webhook_token: Optional[str] = None
+    schedule_engine: Optional[str] = 'blocks'
     schedules: Optional[List[SchedulesSettings]] = None
     ical_calendars: Optional[List[ICalSettings]] = []
     churchtools: Optional[ChurchToolsSettings] = None
     heating: Optional[HeatingSettings] = None
+    tado: Optional[TadoSettings] = None
     assignments: List[AssignmentSettings] = []
 
     @field_validator('polling_minutes')
@@ -66,6 +99,31 @@ class CoreSettings(BaseModel):
             raise ValueError('polling_minutes must be must be a divisor of 60, i.e. 1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30 or 60')
         return v
 
+    @field_validator('min_polling_minutes', 'max_polling_minutes')
+    def optional_polling_minutes_in_range(cls, v):
+        if v is not None and ((v < 1) or (v > 60) or (60 % v)):
+            raise ValueError('min_polling_minutes and max_polling_minutes must be divisors of 60, i.e. 1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30 or 60')
+        return v
+
+    @field_validator('jitter_seconds', 'stagger_seconds')
+    def spread_seconds_in_range(cls, v, info: ValidationInfo):
+        polling_minutes = info.data.get('polling_minutes')
+        if v is not None and polling_minutes and ((v < 0) or (v >= polling_minutes * 60)):
+            raise ValueError('jitter_seconds and stagger_seconds must be less than polling_minutes')
+        return v
+
+    @field_validator('profile_mode')
+    def profile_mode_known(cls, v):
+        if v is not None and v not in ('sampling', 'deterministic'):
+            raise ValueError('profile_mode must be sampling or deterministic')
+        return v
+
+    @field_validator('schedule_engine')
+    def schedule_engine_known(cls, v):
+        if v is not None and v not in ('blocks', 'grid'):
+            raise ValueError('schedule_engine must be blocks or grid')
+        return v
+
     @classmethod
     def load_from(cls, filename: str):
 
@@ -0,0 +1,123 @@
+from datetime import date, datetime, time, timedelta, timezone
+from models.events import Event
+from models.schedules import Block, DailySchedule, validate_temperature
+import numpy as np
+from typing import Optional
+
+
+# An alternative to `get_weekly_schedules`, which calculates the week of all zones of a home at once.
+# The week is a grid of zones × days × 5 minute slots. The events of all zones are rasterized into
+# the grid by their begin and end slots, and the runs of warm and cold slots of each day are turned
+# into the blocks of its daily schedule. Begin and end are determined as `DailySchedule.from_events`
+# does, in the local wall clock time of the day, so the results are the same.
+
+SLOT = timedelta(minutes = 5)
+SLOT_MICROSECONDS = SLOT // timedelta(microseconds = 1)
+DAY_MICROSECONDS = timedelta(days = 1) // timedelta(microseconds = 1)
+SLOTS_PER_DAY = DAY_MICROSECONDS // SLOT_MICROSECONDS
+DAYS = 7
+EPOCH = datetime(1970, 1, 1, tzinfo = timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds = 1)
+# the start of each slot and the end of the last one, which is 0:00 of the next day
+SLOT_TIMES = [(datetime.min + n * SLOT).time() for n in range(0, SLOTS_PER_DAY + 1)]
+
+
+def _get_microseconds(t: time) -> int:
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1000000 + t.microsecond
+
+
+def _convert_event(e: Event) -> tuple[int, int, int, int]:
+    """Returns the start and end of an event in microseconds since the epoch and of its day.
+    """
+    return ((e.start - EPOCH) // ONE_MICROSECOND, (e.end - EPOCH) // ONE_MICROSECOND,
+            _get_microseconds(e.start.time()), _get_microseconds(e.end.time()))
+
+
+def get_weekly_schedules_for_zones(from_date: date, zones: list[tuple[list[Event], float, Optional[float], Optional[time]]]) -> list[list[DailySchedule]]:
+    """Calculates the daily schedules of the seven days beginning with `from_date` for several zones
+    at once, like `get_weekly_schedules` for each of them.
+
+    A day with an event that does not begin and end on a slot, e.g. at 9:03, is calculated by
+    `DailySchedule.from_events` instead.
+
+    Args:
+        zones (list[tuple[list[Event], float, Optional[float], Optional[time]]]): The events, warm and
+            cold temperatures and early start of each zone.
+
+    Returns:
+        list[list[DailySchedule]]: For each zone the schedules in the order of the weekdays, i.e. 0 = monday to 6 = sunday.
+    """
+    dates = [from_date + timedelta(days = n) for n in range(0, DAYS + 1)]
+    # the local days, which have 23 or 25 hours when daylight saving time changes
+    bounds = np.array([(datetime.combine(d, time.min).astimezone() - EPOCH) // ONE_MICROSECOND for d in dates], dtype = np.int64)
+    day_from = bounds[:-1]
+    day_to = bounds[1:]
+
+    # the events of a calendar are shared by the zones using it, each is converted once
+    converted_events: dict[int, tuple[int, int, int, int]] = {}
+    rows = []
+    begins = []
+    ends = []
+    # the days of the zones calculated by `DailySchedule.from_events`
+    other_days = np.zeros((len(zones), DAYS), dtype = bool)
+    for zone, (events, warm, cold, earlystart) in enumerate(zones):
+        validate_temperature(warm, required = True)
+        validate_temperature(cold)
+        if not events:
+            continue
+
+        earlystart = earlystart or time.min
+        lead = _get_microseconds(earlystart.replace(second = 0, microsecond = 0))
+        converted = np.array([converted_events.get(id(e)) or converted_events.setdefault(id(e), _convert_event(e))
+                              for e in events], dtype = np.int64)
+        start_at, end_at, start_time, end_time = (converted[:, n, None] for n in range(0, 4))
+
+        # events × days
+        overlaps = (start_at < day_to) & (end_at > day_from)
+        begin = np.where(start_at <= day_from, 0, start_time)
+        begin = np.where(begin <= _get_microseconds(earlystart), 0, begin - lead)
+        # an end at 0:00 is the end of the day
+        end = np.where((end_at >= day_to) | (end_time == 0), DAY_MICROSECONDS, end_time)
+        on_slots = (begin % SLOT_MICROSECONDS == 0) & (end % SLOT_MICROSECONDS == 0) & (begin < end)
+
+        other_days[zone] = np.any(overlaps & ~on_slots, axis = 0)
+        event_indexes, days = np.nonzero(overlaps & ~other_days[zone])
+        rows.append(zone * DAYS + days)
+        begins.append(begin[event_indexes, days] // SLOT_MICROSECONDS)
+        ends.append(end[event_indexes, days] // SLOT_MICROSECONDS)
+
+    # +1 at the begin and -1 at the end of each event, the sum up to a slot counts the events covering it
+    counts = np.zeros((len(zones) * DAYS, SLOTS_PER_DAY + 1), dtype = np.int32)
+    if rows:
+        rows = np.concatenate(rows)
+        np.add.at(counts, (rows, np.concatenate(begins)), 1)
+        np.add.at(counts, (rows, np.concatenate(ends)), -1)
+    warm_slots = np.cumsum(counts[:, :-1], axis = 1) > 0
+
+    # the slots beginning a new run, by row
+    changed_rows, changed_slots = np.nonzero(warm_slots[:, 1:] != warm_slots[:, :-1])
+    run_starts = np.split(changed_slots + 1, np.searchsorted(changed_rows, np.arange(1, len(zones) * DAYS)))
+
+    weekly_schedules = []
+    for zone, (events, warm, cold, earlystart) in enumerate(zones):
+        schedules = [None] * DAYS
+        temperatures = (float(cold or 0.0), float(warm))
+        for day, d in enumerate(dates[:-1]):
+            if other_days[zone, day]:
+                schedules[d.weekday()] = DailySchedule.from_events(d, events, warm, cold, earlystart)
+                continue
+
+            row = zone * DAYS + day
+            slots = [0] + run_starts[row].tolist() + [SLOTS_PER_DAY]
+            is_warm = bool(warm_slots[row, 0])
+            blocks = {}
+            if temperatures[0] == temperatures[1]:
+                slots = [0, SLOTS_PER_DAY]
+            for begin, end in zip(slots, slots[1:]):
+                start_time = SLOT_TIMES[begin]
+                blocks[start_time] = Block.model_construct(start = start_time, end = SLOT_TIMES[end % SLOTS_PER_DAY],
+                                                           temperature = temperatures[is_warm])
+                is_warm = not is_warm
+            schedules[d.weekday()] = DailySchedule.model_construct(blocks = blocks)
+        weekly_schedules.append(schedules)
+    return weekly_schedules
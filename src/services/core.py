@@ -1,27 +1,83 @@
-from adapter import event_generator
-import adapter.churchtools
+from adapter.pushscheduler import PushScheduler
+from adapter.sqlitestore import SQLiteStore
 from adapter.tado import TadoAdapter
 from adapter.tadocache import CachingTadoAdapter
-from adapter.ical_retriever import ICalRetriever
-from adapter.event_generator import EventGenerator
+from adapter import codec
 import asyncio
+from concurrent.futures import Executor
+from contextlib import nullcontext
 from datetime import date, datetime, time, timedelta
 from functools import reduce
 import logging, logging.handlers
+import math
+import os
+from typing import TYPE_CHECKING, Optional
 from models.events import AllCalendarEvents
-from models.schedules import DailySchedule
-from models.settings import CoreSettings
+from models.schedules import DailySchedule, get_weekly_schedules
+from models.settings import ChurchToolsSettings, CoreSettings
 from models.tadoschedules import ZoneSchedules, HomeSchedules
+from services.fetch import FetchStage
+from services import metrics
+from services.plan import ExecutionPlan
+import services.pool
+from services.profiler import Profiler
+from services import recording
+from services.recording import Recorder
 import time
 
+if TYPE_CHECKING:
+    from adapter.churchtools import ChurchToolsSession
+
 
 class Message:
     config_changed: bool = False
     full_update: bool = False
+    changed_calendars: Optional[set[str]] = None
+    boundary_zones: Optional[set[str]] = None
 
-    def __init__(self, config_changed: bool = False, full_update: bool = False):
+    def __init__(self, config_changed: bool = False, full_update: bool = False,
+                 changed_calendars: Optional[set[str]] = None, boundary_zones: Optional[set[str]] = None):
         self.config_changed = config_changed
         self.full_update = full_update
+        # reported as changed, e.g. through `services.webhook`, only these are refetched right away
+        self.changed_calendars = changed_calendars
+        # zones whose temperature changes right after this run, see `services.timer`, their sources are fetched
+        # even if not due
+        self.boundary_zones = boundary_zones
+
+
+class Boundaries:
+    """The upcoming points in time at which the temperature of a zone changes, i.e. the heating starts
+    or ends. They are determined by the core service on each run and used by the timer to plan the
+    next wakeup, and by the fetch stage to poll the sources of a zone before its next boundary.
+    """
+    times: list[datetime]
+    zones: dict[datetime, set[str]]
+    changed: asyncio.Event
+
+    def __init__(self):
+        self.times = []
+        self.zones = {}
+        self.changed = asyncio.Event()
+
+    def update(self, zones: dict[datetime, set[str]]) -> None:
+        """Replaces the boundaries by the given local times without time zone, each with the zones changing then.
+        """
+        self.zones = zones
+        times = sorted(zones)
+        if times != self.times:
+            self.times = times
+            self.changed.set()
+
+    def get_next(self, now: datetime, zone_names: Optional[set[str]] = None) -> Optional[datetime]:
+        """Returns the next boundary, of any zone or of one of the given zones.
+        """
+        return next((t for t in self.times if t > now and (zone_names is None or self.zones[t] & zone_names)), None)
+
+    def get_zones(self, now: datetime, until: datetime) -> set[str]:
+        """Returns the zones having a boundary after now up to the given time.
+        """
+        return set(z for t in self.times if now < t <= until for z in self.zones[t])
 
 
 class Service:
@@ -29,11 +85,33 @@ class Service:
     config_file: str
     queue: asyncio.Queue
     tado: TadoAdapter
-
-    def __init__(self, config_file: str, queue: asyncio.Queue, tado: TadoAdapter):
+    store: SQLiteStore
+    churchtools_session: Optional['ChurchToolsSession'] = None
+    fetch_stage: FetchStage
+    boundaries: Boundaries
+    executor: Optional[Executor]
+    name: str
+    profiler: Optional[Profiler]
+    profile_runs: Optional[int] = None
+    recorder: Optional[Recorder]
+    record_runs: Optional[int] = None
+    plan: Optional[ExecutionPlan] = None
+    config_version: Optional[tuple[int, int]] = None
+
+    def __init__(self, config_file: str, queue: asyncio.Queue, tado: TadoAdapter, store: SQLiteStore,
+                 boundaries: Optional[Boundaries] = None, fetch_stage: Optional[FetchStage] = None,
+                 executor: Optional[Executor] = None, name: str = '', profiler: Optional[Profiler] = None,
+                 recorder: Optional[Recorder] = None):
         self.config_file = config_file
+        self.name = name
+        self.profiler = profiler
+        self.recorder = recorder
         self.queue = queue
         self.tado = tado
+        self.store = store
+        self.fetch_stage = fetch_stage or FetchStage()
+        self.boundaries = boundaries or Boundaries()
+        self.executor = executor
 
     async def run(self):
         try:
@@ -41,13 +119,27 @@ class Service:
                 # Get a "work item" out of the queue.
                 msg = await self.queue.get()
 
+                if not self.tado.connected.is_set():
+                    self.logger.info('Waiting for the tado° device activation to be completed.')
+                    await self.tado.wait_until_connected()
+
                 # Wait until the queue is fully processed.
                 started_at = time.monotonic()
                 try:
-                    config = CoreSettings.load_from(self.config_file)
+                    plan = self.load_plan(msg.config_changed)
+                    config = plan.settings
 
                     self.logger.debug('Starting work, message: %s', msg)
-                    Worker(config, self.tado).execute(msg)
+                    churchtools_session = self.get_churchtools_session(config.churchtools)
+                    worker = Worker(config, self.tado, self.store, churchtools_session, self.fetch_stage, self.boundaries,
+                                    self.executor, self.name, plan)
+                    if self.profiler:
+                        self.arm_profiler(config)
+                    if self.recorder:
+                        self.arm_recorder(config)
+                    async with self.profiler.profile(self.name) if self.profiler else nullcontext(), \
+                               self.recorder.record(msg, config, self.tado, self.name) if self.recorder else nullcontext():
+                        await worker.execute(msg)
 
                     duration = time.monotonic() - started_at
                     self.logger.debug('Finished work after %.2f seconds', duration)
@@ -56,95 +148,234 @@ class Service:
                     duration = time.monotonic() - started_at
                     self.logger.exception('Failed work after %.2f seconds with: %s', duration, e)
 
+                metrics.STAGE_SECONDS.observe(duration, stage = 'run')
+
                 # Notify the queue that the "work item" has been processed.
                 self.queue.task_done()
 
         except asyncio.CancelledError:
             pass
 
+    def load_plan(self, config_changed: bool = False) -> ExecutionPlan:
+        """Returns the plan compiled from the config file, which is loaded and compiled again only when
+        the file has changed since.
+        """
+        stat = os.stat(self.config_file)
+        config_version = (stat.st_mtime_ns, stat.st_size)
+        if config_changed or not self.plan or config_version != self.config_version:
+            with metrics.STAGE_SECONDS.time(stage = 'config_load'):
+                self.plan = ExecutionPlan(CoreSettings.load_from(self.config_file))
+            self.config_version = config_version
+            self.logger.debug('Compiled the config: %d zones, %d iCal calendars, %d ChurchTools resources.',
+                              len(self.plan.zones), len(self.plan.ical_calendars), len(self.plan.resource_names))
+        return self.plan
+
+    def arm_profiler(self, config: CoreSettings) -> None:
+        """Arms the profiler whenever `profile_runs` is set to a new value.
+        """
+        if config.profile_runs != self.profile_runs:
+            self.profile_runs = config.profile_runs
+            if config.profile_runs:
+                self.profiler.arm(config.profile_runs, config.profile_mode)
+
+    def arm_recorder(self, config: CoreSettings) -> None:
+        """Arms the recorder whenever `record_runs` is set to a new value.
+        """
+        if config.record_runs != self.record_runs:
+            self.record_runs = config.record_runs
+            if config.record_runs:
+                self.recorder.arm(config.record_runs, bool(config.record_anonymized))
+
+    def get_churchtools_session(self, settings: Optional[ChurchToolsSettings]) -> Optional['ChurchToolsSession']:
+        """Returns the ChurchTools session, which is kept across runs by the fetch stage.
+        """
+        self.churchtools_session = self.fetch_stage.get_churchtools_session(settings)
+        return self.churchtools_session
+
 
 class Worker:
     logger: logging.Logger = logging.getLogger(__name__)
     settings: CoreSettings
+    plan: ExecutionPlan
     tado: TadoAdapter
-
-    def __init__(self, settings: CoreSettings, tado: TadoAdapter):
+    store: SQLiteStore
+    churchtools_session: Optional['ChurchToolsSession']
+    fetch_stage: FetchStage
+    boundaries: Boundaries
+    executor: Optional[Executor]
+    home: str
+
+    def __init__(self, settings: CoreSettings, tado: TadoAdapter, store: SQLiteStore,
+                 churchtools_session: Optional['ChurchToolsSession'] = None,
+                 fetch_stage: Optional[FetchStage] = None, boundaries: Optional[Boundaries] = None,
+                 executor: Optional[Executor] = None, home: str = '', plan: Optional[ExecutionPlan] = None):
         self.settings = settings
+        self.plan = plan or ExecutionPlan(settings)
+        self.home = home
         self.tado = tado
+        self.store = store
+        self.churchtools_session = churchtools_session
+        self.fetch_stage = fetch_stage or FetchStage()
+        self.boundaries = boundaries or Boundaries()
+        self.executor = executor
 
-    def execute(self, message: Message):
+    async def execute(self, message: Message):
 
-        from_date = datetime.now().date()
+        # the time of the recording while recording or replaying the run, see `services.recording`
+        from_date = recording.now().date()
         to_date = from_date + timedelta(days=6)
 
         all_events = AllCalendarEvents()
 
-        if self.settings.schedules:
-            all_events = \
-                EventGenerator(self.settings.schedules) \
-                    .generate_events(from_date, to_date)
-
-        having_updates = False
-
-        # retrieve events from iCal calendars
-        if self.settings.ical_calendars:
-            all_calendar_events, calendars_having_updates = \
-                ICalRetriever(self.settings.ical_calendars) \
-                    .retrieve_events(from_date, to_date)
-            if calendars_having_updates:
-                having_updates = calendars_having_updates
-            all_events.events.update(all_calendar_events.events)
-
-        # retrieve bookings from ChurchTools resources
-        if self.settings.churchtools and self.settings.churchtools.url:
-            all_resources_events, resources_having_updates = \
-                adapter.churchtools.ResourceBookingsRetriever(self.settings.churchtools) \
-                    .retrieve_events_of_all_resources(assigned_resource_names, from_date, to_date)
-            if calendars_having_updates:
-                having_updates = calendars_having_updates
-            all_events.events.update(all_resources_events.events)
-
+        if self.plan.event_generator:
+            all_events = self.plan.event_generator.generate_events(from_date, to_date)
+
+        # retrieve events from iCal calendars and bookings from ChurchTools resources concurrently,
+        # all of them while recording the run
+        with metrics.STAGE_SECONDS.time(stage = 'fetch'):
+            fetched = await self.fetch_stage.fetch(self.plan, self.store, self.churchtools_session, from_date, to_date,
+                                                   force = message.full_update or message.config_changed or bool(recording.get_recording()),
+                                                   refetch = message.changed_calendars,
+                                                   boundary_calendars = self.get_calendar_names(message.boundary_zones),
+                                                   next_boundaries = self.get_seconds_until_next_boundaries(), home = self.home)
+        calendars_having_updates = fetched.calendars_having_updates
+        all_events.events.update(fetched.events.events)
+
+        # let the timer wake up around the upcoming changes of the temperatures
+        self.boundaries.update(self.get_upcoming_boundaries(all_events, fetched.unavailable_calendars))
+
+        # all zones, unless only the ones of changed calendars need to be recomputed
+        zone_names = None
+        # zones with daily schedules deferred by a previous run, which are sent even without updates
+        deferred_zones = set(zone for zone, _ in self.store.read_deferred_zone_days())
         if message.full_update:
             self.logger.info('Performing a full update of all Tado zones.')
         elif message.config_changed:
             self.logger.info('Configuration changed. Performing a full update of all Tado zones.')
-        elif having_updates:
+        elif calendars_having_updates:
             # are there any required resources having updates? (set intersection)
-            zones_outdated = set([a.tadozone for a in self.settings.assignments if set(a.calendar_names) & calendars_having_updates])
+            zones_outdated = self.plan.get_zone_names(calendars_having_updates)
             if zones_outdated:
                 self.logger.debug('Tado zones that need to be updated due to Calendar updates: %s', zones_outdated)
+            elif deferred_zones:
+                self.logger.info('No Calendar has relevant updates. Sending the deferred schedules of Tado zones %s.', sorted(deferred_zones))
             else:
                 self.logger.info('No Calendar has relevant updates. All Tado zones are up to date.')
+                self.record_zones_up_to_date(fetched.unavailable_calendars)
                 return
+            if message.changed_calendars is not None:
+                zone_names = zones_outdated | deferred_zones
+        elif message.changed_calendars is not None:
+            if not deferred_zones:
+                self.logger.info('The changed calendars %s have no updates. All Tado zones are up to date.', sorted(message.changed_calendars))
+                self.record_zones_up_to_date(fetched.unavailable_calendars)
+                return
+            self.logger.info('The changed calendars %s have no updates. Sending the deferred schedules of Tado zones %s.',
+                             sorted(message.changed_calendars), sorted(deferred_zones))
+            zone_names = deferred_zones
         else:
             self.logger.info('No Calendar has updates. All Tado zones are up to date.')
 
         # generate weekly schedules for all zones
-        tado = CachingTadoAdapter(self.tado, message.full_update)
-        home_schedules = self.generate_schedules_for_all_zones(all_events, from_date, tado)
+        push_scheduler = PushScheduler(settings = self.settings.tado)
+        tado = CachingTadoAdapter(self.tado, self.store, message.full_update, push_scheduler)
+        with metrics.STAGE_SECONDS.time(stage = 'generate'):
+            home_schedules = await self.generate_schedules_for_all_zones(all_events, from_date, tado, fetched.unavailable_calendars,
+                                                                         zone_names)
         self.logger.debug('Updated set of schedules: %s', home_schedules)
-        tado.set_schedules_for_all_zones(home_schedules)
-
+        with metrics.STAGE_SECONDS.time(stage = 'push'):
+            # keeps the cached schedules of the zones skipped in this run
+            await tado.set_schedules_for_all_zones(home_schedules, set(z.tadozone for z in self.plan.zones))
+        self.record_zones_up_to_date(fetched.unavailable_calendars)
+
+
+    def record_zones_up_to_date(self, unavailable_calendars: set[str]) -> None:
+        now = time.time()
+        for z in self.plan.zones:
+            if not set(z.calendar_names) & unavailable_calendars:
+                metrics.ZONE_LAST_SUCCESS.set(now, home = self.home, zone = z.tadozone)
+
+
+    def get_upcoming_boundaries(self, all_events: AllCalendarEvents, unavailable_calendars: set[str] = set()) -> dict[datetime, set[str]]:
+        """Returns the points in time of the coming week at which the heating of a zone starts or ends.
+
+        Returns:
+            dict[datetime, set[str]]: The local times without time zone, each with the zones changing then.
+        """
+        now = recording.now().astimezone()
+        until = now + timedelta(days = 7)
+
+        boundaries = {}
+        for z in self.plan.zones:
+            lead = timedelta(hours = z.earlystart.hour, minutes = z.earlystart.minute) if z.earlystart else timedelta()
+            calendar_names = [n for n in z.calendar_names if n in all_events.events and n not in unavailable_calendars]
+            for e in all_events.select_events(calendar_names):
+                for boundary in (e.start - lead, e.end):
+                    if now < boundary < until:
+                        boundaries.setdefault(boundary.astimezone().replace(tzinfo = None), set()).add(z.tadozone)
+        return boundaries
+
+
+    def get_calendar_names(self, zone_names: Optional[set[str]]) -> set[str]:
+        """Returns the calendars assigned to any of the given zones.
+        """
+        return set(n for z in self.plan.zones if zone_names and z.tadozone in zone_names for n in z.calendar_names)
+
+
+    def get_seconds_until_next_boundaries(self) -> dict[str, float]:
+        """Returns the seconds until the next boundary known from the previous run of the zones of each calendar.
+        """
+        now = recording.now().astimezone().replace(tzinfo = None)
+        seconds = {}
+        for z in self.plan.zones:
+            boundary = self.boundaries.get_next(now, { z.tadozone })
+            if boundary:
+                for n in z.calendar_names:
+                    seconds[n] = min(seconds.get(n, math.inf), (boundary - now).total_seconds())
+        return seconds
+
+
+    async def generate_schedules_for_all_zones(self, all_resources_events: AllCalendarEvents, from_date: date, tado: TadoAdapter,
+                                               unavailable_calendars: set[str] = set(),
+                                               zone_names: Optional[set[str]] = None) -> HomeSchedules:
+        """Generates the schedules of all zones, or of the given ones, with a process pool one zone per task
+        or with the grid engine all zones at once.
+        """
+        zones = []
+        for z in self.plan.zones:
+            if zone_names is not None and z.tadozone not in zone_names:
+                continue
+
+            # rather keep the schedules in tado° than replace them by ones missing events
+            missing_calendar_names = set(z.calendar_names) & unavailable_calendars
+            if missing_calendar_names:
+                self.logger.error('Skipping Tado zone "%s", because the events of %s are not available.', z.tadozone, sorted(missing_calendar_names))
+                continue
 
-    def generate_schedules_for_all_zones(self, all_resources_events: AllCalendarEvents, from_date: date, tado: TadoAdapter) -> HomeSchedules:
+            # select events from required resources
+            zones.append((z.tadozone, all_resources_events.select_events(z.calendar_names), z.warm, z.cold, z.earlystart))
+
+        # calculate time schedule for each day of the week
+        # list of schedules in order of the weekday where the index is 0=monday to 6=sunday
+        if self.settings.schedule_engine == 'grid':
+            # all zones at once, imported on first use as NumPy is heavy
+            from models.weekgrid import get_weekly_schedules_for_zones
+            weekly_schedules = get_weekly_schedules_for_zones(from_date, [(events, warm, cold, earlystart)
+                                                                          for _, events, warm, cold, earlystart in zones])
+        elif self.executor:
+            loop = asyncio.get_running_loop()
+            encoded_schedules = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, services.pool.generate_daily_schedules,
+                                     [codec.encode_event(e) for e in events], from_date, warm, cold, earlystart)
+                for _, events, warm, cold, earlystart in zones])
+            weekly_schedules = [[codec.decode_daily_schedule(s) for s in schedules] for schedules in encoded_schedules]
+        else:
+            weekly_schedules = [get_weekly_schedules(from_date, events, warm, cold, earlystart)
+                                for _, events, warm, cold, earlystart in zones]
 
         home_schedules = HomeSchedules()
-        for a in self.settings.assignments:
-
-            # select events from required resources
-            events = all_resources_events.select_events(a.calendar_names)
-            warm = a.warm or self.settings.heating.warm
-            cold = a.cold or self.settings.heating.cold
-            earlystart = a.earlystart or self.settings.heating.earlystart
-
-            # calculate time schedule for each day of the week
-            # list of schedules in order of the weekday where the index is 0=monday to 6=sunday
-            schedules = list([None for _ in range(0, 7)])
-            for d in [from_date + timedelta(days = n) for n in range(0, 7)]: # iterate days starting with from_date. n is NOT the weekday
-                schedules[d.weekday()] = DailySchedule.from_events(d, events, warm, cold, earlystart)
-
-            home_schedules.insert(ZoneSchedules(name = a.tadozone,
-                                                id = tado.get_zone_id(a.tadozone),
+        for (tadozone, _, _, _, _), schedules in zip(zones, weekly_schedules):
+            home_schedules.insert(ZoneSchedules(name = tadozone,
+                                                id = await tado.get_zone_id(tadozone),
                                                 daily_schedules = schedules))
         return home_schedules
-
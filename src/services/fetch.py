@@ -0,0 +1,380 @@
+from adapter.sqlitestore import SQLiteStore
+from adapter.tado import DEFAULT_DATA_DIR
+import asyncio
+from concurrent.futures import Executor
+from datetime import date
+import functools
+import logging
+import math
+from models.events import AllCalendarEvents, CalendarEvents
+from models.settings import ChurchToolsSettings
+from services import metrics
+from services.jitter import get_offset
+from services.plan import ExecutionPlan
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from adapter.churchtools import ChurchToolsSession
+    from adapter.ical_retriever import ICalRetriever
+
+
+DUE_TOLERANCE_SECONDS = 60
+
+
+class Source:
+    """A source of events to be fetched.
+
+    The fetched events are shared by all homes using the source, so they are named independent of a
+    home: an iCal calendar by its key, ChurchTools resources by their names. `shared_names` maps the
+    calendar names of the home to these.
+    """
+    calendar_names: set[str]
+    timeout: float
+    retrieve: Callable[[], AllCalendarEvents]
+    polling_minutes: float
+    backoff_max_minutes: Optional[float]
+    shared_names: dict[str, str]
+    label: str
+
+    def __init__(self, calendar_names: set[str], timeout: float, retrieve: Callable[[], AllCalendarEvents],
+                 polling_minutes: float, backoff_max_minutes: Optional[float] = None,
+                 shared_names: Optional[dict[str, str]] = None, label: Optional[str] = None):
+        self.calendar_names = calendar_names
+        # names the source in metrics, since a URL may contain secrets
+        self.label = label or ', '.join(sorted(calendar_names))
+        self.timeout = timeout
+        self.retrieve = retrieve
+        self.polling_minutes = polling_minutes
+        self.backoff_max_minutes = backoff_max_minutes
+        self.shared_names = shared_names or { name: name for name in calendar_names }
+
+    def covers(self, shared_events: AllCalendarEvents) -> bool:
+        """Returns whether the shared events include all calendars of the home.
+        """
+        return all(shared_name in shared_events.events for shared_name in self.shared_names.values())
+
+    def select(self, shared_events: AllCalendarEvents) -> AllCalendarEvents:
+        """Returns the calendars of the home out of the shared events, named as in the home.
+        """
+        all_calendars_events = AllCalendarEvents()
+        for name, shared_name in self.shared_names.items():
+            calendar_events = shared_events.events.get(shared_name)
+            if calendar_events is not None:
+                all_calendars_events.events[name] = CalendarEvents(name = name, events = calendar_events.events)
+        return all_calendars_events
+
+
+class FetchResult:
+    """The events of all sources of a run.
+    """
+    events: AllCalendarEvents
+    calendars_having_updates: set[str]
+    stale_sources: dict[str, float]
+    unavailable_calendars: set[str]
+
+    def __init__(self):
+        self.events = AllCalendarEvents()
+        self.calendars_having_updates = set()
+        # calendars of sources that could neither be fetched nor be taken from a previous run
+        self.unavailable_calendars = set()
+        # age in seconds of the events of sources that could not be fetched in time
+        self.stale_sources = {}
+
+
+class FetchStage:
+    """Fetches the events of all sources concurrently, each with its own timeout.
+
+    Each iCal calendar and ChurchTools are separate sources, fetched in worker threads. When a source
+    does not respond in time or fails, its last known events are used instead and marked as stale with
+    their age, so that the zones can still be updated on time. A fetch that timed out keeps running in
+    the background and provides the events for the next run; no second fetch of the same source is
+    started meanwhile.
+
+    Each source is polled in its own interval, the last known events of the sources that are not due
+    are used. In adaptive mode the interval of a source grows while it has no changes, but not beyond
+    the next boundary of its zones. Right before a boundary the sources of the zones changing then are
+    fetched even if not due, so that a late booking is sent to tado° in time.
+
+    With `stagger_seconds`, the fetch of each source is delayed by a fixed offset derived from the
+    instance id and the source, so that several instances do not hit the same server at once.
+
+    The stage is kept across runs and may be shared by the core services of several homes. Sources
+    are identified by their URL, so an iCal calendar or a ChurchTools instance used by several homes
+    is fetched once per interval and its events are handed to every home. A ChurchTools instance is
+    fetched with the resources of all homes using it, through a single session, which keeps its login and
+    caches in `data_dir`.
+
+    With an executor, the iCal calendars are parsed in worker processes, see `services.pool`.
+
+    The adapters of iCal and ChurchTools are imported once a config uses them, as they pull in heavy
+    libraries.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    instance_id: str
+    executor: Optional[Executor]
+    data_dir: str
+    last_events: dict[str, tuple[AllCalendarEvents, float]]
+    in_flight: dict[str, asyncio.Future]
+    intervals: dict[str, float]
+    next_due: dict[str, float]
+    polled_at: dict[str, float]
+    churchtools_sessions: dict[str, 'ChurchToolsSession']
+    churchtools_resource_names: dict[str, dict[str, set[str]]]
+
+    def __init__(self, instance_id: str = '', executor: Optional[Executor] = None, data_dir: str = DEFAULT_DATA_DIR):
+        self.instance_id = instance_id
+        self.executor = executor
+        self.data_dir = data_dir
+        self.last_events = {}
+        self.in_flight = {}
+        self.intervals = {}
+        self.next_due = {}
+        self.polled_at = {}
+        self.churchtools_sessions = {}
+        # the resources of the current plan of each home by ChurchTools instance
+        self.churchtools_resource_names = {}
+
+    def get_churchtools_session(self, settings: Optional[ChurchToolsSettings]) -> Optional['ChurchToolsSession']:
+        """Returns the session with a ChurchTools instance, which is kept across runs and shared by all homes
+        logging in with the same credentials. Other changes of the settings are taken over by the session.
+        """
+        if not settings or not settings.url:
+            return None
+        from adapter.churchtools import ChurchToolsSession
+
+        session = self.churchtools_sessions.get(settings.url)
+        if not session or (session.settings.username, session.settings.password, session.settings.token) \
+                != (settings.username, settings.password, settings.token):
+            session = ChurchToolsSession(settings, self.data_dir)
+            self.churchtools_sessions[settings.url] = session
+        else:
+            session.settings = settings
+        return session
+
+    async def fetch(self, plan: ExecutionPlan, store: SQLiteStore,
+                    churchtools_session: Optional['ChurchToolsSession'],
+                    from_date: date, to_date: date, force: bool = False,
+                    refetch: Optional[set[str]] = None, boundary_calendars: Optional[set[str]] = None,
+                    next_boundaries: Optional[dict[str, float]] = None, home: str = '') -> FetchResult:
+        """Fetches the sources of a home that are due and takes the last known events of the others. Only the
+        sources of calendars assigned to a zone are fetched, see `ExecutionPlan`.
+
+        Args:
+            store (SQLiteStore): The store of the home, used to determine changes and for stale events after a restart.
+            force (bool): Fetch all sources, unless just fetched for another home.
+            refetch (Optional[set[str]]): Calendar names reported as changed, their sources are fetched right away
+                and ChurchTools fetches its whole bookings window.
+            boundary_calendars (Optional[set[str]]): Calendar names of zones changing right after this run, their
+                sources are fetched unless just fetched for another home.
+            next_boundaries (Optional[dict[str, float]]): Seconds until the next boundary of the zones of each
+                calendar name, the interval of a source is not backed off beyond it.
+            home (str): The name of the home, whose resources replace the ones of its previous plan.
+        """
+        settings = plan.settings
+        resource_names = plan.resource_names
+        default_timeout = settings.fetch_timeout_seconds
+        default_polling_minutes = settings.polling_minutes
+        if plan.ical_calendars:
+            from adapter.ical_retriever import ICalRetriever
+            ical_retriever = ICalRetriever(plan.ical_calendars, store, self.executor)
+
+        sources: dict[str, Source] = {}
+        for c in plan.ical_calendars:
+            key = f'ical:{c.source}'
+            if key in sources:
+                # the same calendar under another name
+                sources[key].calendar_names.add(c.name)
+                sources[key].shared_names[c.name] = key
+                continue
+            timeout = c.timeout_seconds or default_timeout
+            sources[key] = Source(
+                { c.name }, timeout, functools.partial(_retrieve_ical_calendar, ical_retriever, c, key, from_date, to_date, timeout),
+                c.polling_minutes or default_polling_minutes, c.backoff_max_minutes, { c.name: key }, f'ical:{c.name}')
+
+        if churchtools_session and resource_names:
+            from adapter.churchtools import ResourceBookingsRetriever
+            churchtools_retriever = ResourceBookingsRetriever(churchtools_session, store)
+            ct_settings = churchtools_session.settings
+            key = f'churchtools:{ct_settings.url}'
+            # fetch the resources of all homes at once
+            all_resource_names = self._update_resource_names(home, key, resource_names)
+            sources[key] = Source(
+                set(resource_names), ct_settings.timeout_seconds or default_timeout,
+                functools.partial(churchtools_retriever.get_events, all_resource_names, from_date, to_date),
+                ct_settings.polling_minutes or default_polling_minutes, ct_settings.backoff_max_minutes,
+                label = 'churchtools')
+        else:
+            # the home does not use ChurchTools (anymore)
+            self._update_resource_names(home)
+
+        now = time.monotonic()
+        changed_keys = set(key for key in sources if refetch and sources[key].calendar_names & refetch)
+        if churchtools_session and f'churchtools:{churchtools_session.settings.url}' in changed_keys:
+            churchtools_session.request_full_refresh()
+        boundary_keys = set(key for key in sources if boundary_calendars and sources[key].calendar_names & boundary_calendars)
+        due_keys = [key for key in sources
+                    if key in changed_keys or self._needs_fetch(key, sources[key], force or key in boundary_keys, now)]
+        for key in sources:
+            metrics.record_cache_lookup('sources', key not in due_keys)
+        fetched = await asyncio.gather(*[self._fetch_source(key, sources[key].timeout, sources[key].retrieve,
+                                                            get_offset(f'{self.instance_id}:{key}', settings.stagger_seconds),
+                                                            sources[key].label)
+                                         for key in due_keys])
+        fetched_events = dict(zip(due_keys, fetched))
+
+        result = FetchResult()
+        ical_events = AllCalendarEvents()
+        churchtools_events = AllCalendarEvents()
+        fetched_at = {}
+        for key, source in sources.items():
+            if key not in fetched_events:
+                shared_events, fetched_at[key] = self.last_events[key]
+                events = source.select(shared_events)
+                self.logger.debug('Source "%s" is not due yet, using its events of %.0f seconds ago.', key, time.time() - fetched_at[key])
+
+            elif fetched_events[key] is None:
+                events, age = self._get_stale_events(key, source, store)
+                if events is None:
+                    self.logger.error('No events of source "%s" available.', key)
+                    result.unavailable_calendars |= source.calendar_names
+                    continue
+                self.logger.warning('Using stale events of source "%s", %.0f seconds old.', key, age)
+                result.stale_sources[key] = age
+                fetched_at[key] = time.time() - age
+
+            else:
+                events = source.select(fetched_events[key])
+                fetched_at[key] = time.time()
+
+            if key.startswith('churchtools:'):
+                churchtools_events.events.update(events.events)
+            else:
+                ical_events.events.update(events.events)
+
+        # determine changes and update the caches, once per retriever
+        calendars_fetched_at = { name: fetched_at[key] for key in fetched_at for name in sources[key].calendar_names }
+        if plan.ical_calendars:
+            result.calendars_having_updates |= ical_retriever.update_cache(ical_events, calendars_fetched_at)
+            result.events.events.update(ical_events.events)
+        if churchtools_session and resource_names:
+            result.calendars_having_updates |= churchtools_retriever.update_cache(churchtools_events, calendars_fetched_at)
+            result.events.events.update(churchtools_events.events)
+
+        for key, events in fetched_events.items():
+            if events is not None:
+                changed = bool(sources[key].calendar_names & result.calendars_having_updates)
+                until_boundary = min((next_boundaries[name] for name in sources[key].calendar_names
+                                      if next_boundaries and name in next_boundaries), default = None)
+                self._schedule_next_poll(key, sources[key], changed, now, until_boundary)
+
+        return result
+
+    def _update_resource_names(self, home: str, key: Optional[str] = None, resource_names: set[str] = set()) -> set[str]:
+        """Replaces the resources of the home by the ones of its current plan and returns the resources of all
+        homes using the ChurchTools instance, so that resources no home uses anymore are not fetched.
+        """
+        for names_by_home in self.churchtools_resource_names.values():
+            names_by_home.pop(home, None)
+        if not key:
+            return set()
+
+        names_by_home = self.churchtools_resource_names.setdefault(key, {})
+        names_by_home[home] = set(resource_names)
+        return set().union(*names_by_home.values())
+
+    def _needs_fetch(self, key: str, source: Source, force: bool, now: float) -> bool:
+        if key not in self.last_events or not source.covers(self.last_events[key][0]):
+            return True
+        if force:
+            # another home may just have fetched the source
+            return now - self.polled_at.get(key, -math.inf) > DUE_TOLERANCE_SECONDS
+        return self._is_due(key, now)
+
+    def _is_due(self, key: str, now: float) -> bool:
+        # the timer does not wake up to the second
+        return now + DUE_TOLERANCE_SECONDS >= self.next_due.get(key, 0.0)
+
+    def _schedule_next_poll(self, key: str, source: Source, changed: bool, now: float,
+                            until_boundary: Optional[float] = None) -> None:
+        """Polls the source again after its interval. In adaptive mode, the interval is doubled after each
+        poll without changes up to the maximum, and reset after a change.
+
+        Args:
+            until_boundary (Optional[float]): Seconds until the next boundary of the zones of the source, a
+                backed off interval is shortened so that the source is polled before it.
+        """
+        interval = source.polling_minutes * 60
+        if source.backoff_max_minutes and not changed and key in self.intervals:
+            interval = min(self.intervals[key] * 2, max(source.backoff_max_minutes * 60, interval))
+
+        if interval != self.intervals.get(key, interval):
+            self.logger.info('Polling source "%s" every %.0f minutes.', key, interval / 60)
+        self.intervals[key] = interval
+        next_due = now + interval
+        if until_boundary is not None and interval > source.polling_minutes * 60:
+            # the backoff must not skip the boundary, still polling at least in the regular interval
+            next_due = min(next_due, now + max(until_boundary - DUE_TOLERANCE_SECONDS, source.polling_minutes * 60))
+        self.next_due[key] = next_due
+        self.polled_at[key] = now
+
+    async def _fetch_source(self, key: str, timeout: float, retrieve: Callable[[], AllCalendarEvents],
+                            delay: float = 0.0, label: Optional[str] = None) -> Optional[AllCalendarEvents]:
+        """Fetches a source in a worker thread, or joins the fetch still running since a previous run.
+
+        Args:
+            delay (float): Seconds to wait before starting a new fetch, the timeout starts afterwards.
+            label (Optional[str]): Names the source in the metrics, defaults to the key.
+
+        Returns:
+            Optional[AllCalendarEvents]: The events, or None if the source did not respond in time or failed.
+        """
+        future = self.in_flight.get(key)
+        if not future or future.done():
+            if delay:
+                self.logger.debug('Fetching source "%s" in %.1f seconds.', key, delay)
+                await asyncio.sleep(delay)
+            future = asyncio.ensure_future(asyncio.to_thread(retrieve))
+            future.add_done_callback(functools.partial(self._remember_events, key))
+            self.in_flight[key] = future
+
+        started_at = time.monotonic()
+        try:
+            # shielded, so that a timeout does not cancel the fetch
+            events = await asyncio.wait_for(asyncio.shield(future), timeout)
+            self.logger.debug('Fetched source "%s" in %.2f seconds.', key, time.monotonic() - started_at)
+            return events
+
+        except TimeoutError:
+            self.logger.warning('Source "%s" did not respond within %d seconds.', key, timeout)
+            return None
+
+        except Exception as e:
+            self.logger.error('Failed fetching source "%s": %s', key, e)
+            return None
+
+        finally:
+            metrics.SOURCE_FETCH_SECONDS.observe(time.monotonic() - started_at, source = label or key)
+
+    def _remember_events(self, key: str, future: asyncio.Future) -> None:
+        if not future.cancelled() and not future.exception():
+            self.last_events[key] = (future.result(), time.time())
+
+    def _get_stale_events(self, key: str, source: Source, store: SQLiteStore) -> tuple[Optional[AllCalendarEvents], float]:
+        """Returns the last events fetched for a source and their age. After a restart these are the stored ones.
+        """
+        if key in self.last_events and source.covers(self.last_events[key][0]):
+            shared_events, fetched_at = self.last_events[key]
+            return (source.select(shared_events), time.time() - fetched_at)
+
+        stored_events = store.read_calendar_events(source.calendar_names, 'churchtools' if key.startswith('churchtools:') else 'ical')
+        if not stored_events.events:
+            return (None, 0.0)
+        fetched_at = min(store.get_calendar_fetched_at(name) for name in stored_events.events)
+        return (stored_events, time.time() - fetched_at)
+
+
+def _retrieve_ical_calendar(retriever: 'ICalRetriever', setting, key: str, from_date: date, to_date: date, timeout: float) -> AllCalendarEvents:
+    all_calendars_events = AllCalendarEvents()
+    all_calendars_events.events[key] = retriever.retrieve_calendar_events(setting, from_date, to_date, timeout)
+    return all_calendars_events
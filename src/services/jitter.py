@@ -0,0 +1,64 @@
+import hashlib
+import logging
+import os
+from typing import Optional
+import uuid
+
+
+# Several instances of the add-on polling the same ChurchTools server and calendar hosts would all
+# wake up on the same full minutes. Each instance therefore shifts its polls by a fixed offset derived
+# from its instance id: the offsets differ between instances, but stay the same across restarts, so
+# the average polling interval is kept.
+
+INSTANCE_ID_FILE_NAME = 'instance_id'
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def get_instance_id(data_dir: str, instance_id: Optional[str] = None) -> str:
+    """Returns the configured instance id, or a random one created on the first start and kept in the data directory.
+
+    Args:
+        data_dir (str): The directory for persistent data.
+        instance_id (Optional[str]): The configured instance id, if any.
+
+    Returns:
+        str: The instance id.
+    """
+    if instance_id:
+        return instance_id
+
+    file_name = os.path.join(data_dir, INSTANCE_ID_FILE_NAME)
+    try:
+        with open(file_name, 'r', encoding='utf-8') as file:
+            instance_id = file.read().strip()
+    except FileNotFoundError:
+        pass
+
+    if not instance_id:
+        instance_id = uuid.uuid4().hex
+        try:
+            os.makedirs(data_dir, exist_ok = True)
+            with open(file_name, 'w', encoding='utf-8') as file:
+                file.write(instance_id)
+            logger.info('Created instance id %s', instance_id)
+        except OSError as e:
+            logger.warning('Could not save instance id to %s: %s', file_name, e)
+    return instance_id
+
+
+def get_offset(seed: str, max_seconds: Optional[float]) -> float:
+    """Returns a deterministic offset in [0, max_seconds), evenly distributed over different seeds.
+
+    Args:
+        seed (str): E.g. the instance id, optionally combined with the name of a source.
+        max_seconds (Optional[float]): The upper limit of the offset, None or 0 for no offset.
+
+    Returns:
+        float: The offset in seconds, rounded to milliseconds.
+    """
+    if not max_seconds or max_seconds <= 0:
+        return 0.0
+    digest = hashlib.sha1(seed.encode('utf-8')).digest()
+    fraction = int.from_bytes(digest[:8], 'big') / 2**64
+    return round(fraction * max_seconds, 3)
@@ -0,0 +1,302 @@
+import asyncio
+import bisect
+from contextlib import contextmanager
+import hmac
+import logging
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+# Metrics in the Prometheus text format, served on `/metrics`. The metrics are module level, so that
+# any stage can record to them without passing a registry around. They are updated from the event
+# loop and from worker threads, each metric has its own lock.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# the runs `POST /profile` may arm at once, each writes its profiles to the data directory
+MAX_PROFILE_RUNS = 10
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + '}'
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Metric:
+    name: str
+    documentation: str
+    type: str
+    labelnames: tuple[str, ...]
+    lock: threading.Lock
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'metric {self.name} expects the labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}'] + self._render_samples()
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+    values: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0.0)
+
+    def _render_samples(self) -> list[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f'{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(v)}' for key, v in values]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    buckets: tuple[float, ...]
+    counts: dict[tuple[str, ...], list[int]]
+    sums: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        # index of the first bucket the value fits in, the last one is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observes the duration of the block in seconds, also when it raises.
+        """
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started_at, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        with self.lock:
+            return sum(self.counts.get(self._key(labels), []))
+
+    def _render_samples(self) -> list[str]:
+        with self.lock:
+            items = sorted((key, list(counts), self.sums[key]) for key, counts in self.counts.items())
+
+        samples = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(f'{self.name}_bucket{_format_labels(labels | { "le": _format_value(bound) })} {cumulative}')
+            samples.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            samples.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return samples
+
+
+class Registry:
+    metrics: list[Metric]
+    collectors: list[Callable[[], None]]
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Adds a function that updates gauges right before they are rendered, e.g. a queue depth.
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS: Histogram = REGISTRY.register(Histogram(
+    'planned_heating_stage_seconds', 'Duration of the stages of a run.', ('stage',)))
+SOURCE_FETCH_SECONDS: Histogram = REGISTRY.register(Histogram(
+    'planned_heating_source_fetch_seconds', 'Duration of fetching a calendar source, including timeouts and failures.', ('source',)))
+API_CALLS: Counter = REGISTRY.register(Counter(
+    'planned_heating_api_calls_total', 'Calls of the tado°, ChurchTools and iCal HTTP APIs.', ('api',)))
+API_ERRORS: Counter = REGISTRY.register(Counter(
+    'planned_heating_api_errors_total', 'Failed calls of the tado°, ChurchTools and iCal HTTP APIs.', ('api',)))
+CACHE_LOOKUPS: Counter = REGISTRY.register(Counter(
+    'planned_heating_cache_lookups_total', 'Lookups of the caches by result, hit or miss.', ('cache', 'result')))
+CACHE_HIT_RATIO: Gauge = REGISTRY.register(Gauge(
+    'planned_heating_cache_hit_ratio', 'Share of the lookups of a cache that were hits since the start.', ('cache',)))
+QUEUE_DEPTH: Gauge = REGISTRY.register(Gauge(
+    'planned_heating_queue_depth', 'Messages waiting for the core service of a home.', ('home',)))
+ZONE_LAST_SUCCESS: Gauge = REGISTRY.register(Gauge(
+    'planned_heating_zone_last_success_timestamp_seconds', 'Time the schedules of a zone were last found or made up to date in tado°.', ('home', 'zone')))
+
+
+def record_cache_lookup(cache: str, hit: bool, count: int = 1) -> None:
+    CACHE_LOOKUPS.inc(count, cache = cache, result = 'hit' if hit else 'miss')
+    hits = CACHE_LOOKUPS.get(cache = cache, result = 'hit')
+    CACHE_HIT_RATIO.set(hits / (hits + CACHE_LOOKUPS.get(cache = cache, result = 'miss')), cache = cache)
+
+
+def is_authorized(expected_token: Optional[str], authorization: Optional[str], token: Optional[str]) -> bool:
+    """Returns whether a request passes the expected token as `Authorization: Bearer <token>` or as `token=<token>`.
+    Without an expected token no request is authorized.
+    """
+    if authorization and authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    return bool(expected_token) and bool(token) and hmac.compare_digest(token.encode('utf-8'), expected_token.encode('utf-8'))
+
+
+@contextmanager
+def record_api_call(api: str) -> Iterator[None]:
+    """Counts a call of an API and, when the block raises, its error.
+    """
+    API_CALLS.inc(api = api)
+    try:
+        yield
+    except BaseException:
+        API_ERRORS.inc(api = api)
+        raise
+
+
+class Service:
+    """Serves the metrics in the Prometheus text format on `/metrics`, with a profiler `POST /profile` and
+    with a webhook `POST /changed`, see `services.webhook`.
+
+    The profiler and the webhook are served only with a token, which a request has to pass. The profiler
+    arms at most `MAX_PROFILE_RUNS` runs at once.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    port: int
+    queues: dict[str, asyncio.Queue]
+    registry: Registry
+    profiler: Optional[Any]
+    webhook: Optional[Any]
+    token: Optional[str]
+
+    def __init__(self, port: int, queues: Optional[dict[str, asyncio.Queue]] = None, registry: Registry = REGISTRY,
+                 profiler: Optional[Any] = None, webhook: Optional[Any] = None, token: Optional[str] = None):
+        self.port = port
+        self.queues = queues or {}
+        self.registry = registry
+        self.profiler = profiler
+        self.webhook = webhook
+        self.token = token
+        self.registry.add_collector(self.collect_queue_depths)
+
+    def collect_queue_depths(self) -> None:
+        for home, queue in self.queues.items():
+            QUEUE_DEPTH.set(queue.qsize(), home = home)
+
+    def create_app(self) -> 'web.Application':
+        from aiohttp import web
+
+        async def get_metrics(request: web.Request) -> web.Response:
+            return web.Response(body = self.registry.render().encode('utf-8'),
+                                headers = { 'Content-Type': CONTENT_TYPE, 'Cache-Control': 'no-store' })
+
+        async def post_profile(request: web.Request) -> web.Response:
+            # arms the profiler for the next runs, see `services.profiler.Profiler`
+            if not is_authorized(self.token, request.headers.get('Authorization'), request.query.get('token')):
+                raise web.HTTPUnauthorized(text = 'invalid token')
+            try:
+                runs = int(request.query.get('runs', '1'))
+            except ValueError:
+                raise web.HTTPBadRequest(text = 'runs must be a number')
+            if not 1 <= runs <= MAX_PROFILE_RUNS:
+                raise web.HTTPBadRequest(text = f'runs must be between 1 and {MAX_PROFILE_RUNS}')
+            mode = request.query.get('mode')
+            if mode not in (None, 'sampling', 'deterministic'):
+                raise web.HTTPBadRequest(text = 'mode must be sampling or deterministic')
+            self.profiler.arm(runs, mode)
+            return web.Response(text = f'Profiling the next {runs} runs.\n')
+
+        app = web.Application()
+        app.router.add_get('/metrics', get_metrics)
+        if self.profiler and self.token:
+            app.router.add_post('/profile', post_profile)
+        if self.webhook and self.webhook.token:
+            app.router.add_post('/changed', self.webhook.post_changed)
+        return app
+
+    async def run(self):
+        from aiohttp import web
+
+        runner = web.AppRunner(self.create_app(), access_log = None)
+        await runner.setup()
+        try:
+            try:
+                await web.TCPSite(runner, port = self.port).start()
+            except OSError as e:
+                # the service works without metrics
+                self.logger.error('Cannot serve metrics on port %d: %s', self.port, e)
+                return
+            self.logger.info('Serving metrics on port %d', self.port)
+            if not self.token:
+                self.logger.info('POST /profile and POST /changed are disabled, as no webhook_token is configured.')
+            await asyncio.Event().wait()
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            await runner.cleanup()
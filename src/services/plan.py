@@ -0,0 +1,74 @@
+from adapter.event_generator import EventGenerator
+from datetime import time
+import importlib.util
+from models.settings import CoreSettings, ICalSettings
+from typing import Optional
+
+
+class ZonePlan:
+    """A tado° zone with the calendars assigned to it and its temperatures, resolved against the
+    defaults of `heating`.
+    """
+    tadozone: str
+    calendar_names: list[str]
+    warm: float
+    cold: Optional[float]
+    earlystart: Optional[time]
+
+    def __init__(self, tadozone: str, calendar_names: list[str], warm: float, cold: Optional[float], earlystart: Optional[time]):
+        self.tadozone = tadozone
+        self.calendar_names = calendar_names
+        self.warm = warm
+        self.cold = cold
+        self.earlystart = earlystart
+
+
+class ExecutionPlan:
+    """The config of a home compiled for its runs: the zones with their resolved temperatures, the
+    calendars they use and the sources of these.
+
+    Only the schedules and iCal calendars assigned to a zone are generated and fetched, the other
+    assigned calendars are ChurchTools resources. The plan is validated when compiled, so that an
+    unknown calendar name, a missing warm temperature, invalid days of a schedule or the grid engine
+    without NumPy fail when the config is loaded instead of in the middle of a run.
+
+    Raises:
+        ValueError: The config is not valid.
+    """
+    settings: CoreSettings
+    zones: list[ZonePlan]
+    calendar_names: set[str]
+    event_generator: Optional[EventGenerator]
+    ical_calendars: list[ICalSettings]
+    resource_names: set[str]
+
+    def __init__(self, settings: CoreSettings):
+        self.settings = settings
+        heating = settings.heating
+        self.zones = []
+        for a in settings.assignments:
+            warm = a.warm or (heating.warm if heating else None)
+            if not warm:
+                raise ValueError(f'No warm temperature for Tado zone "{a.tadozone}", set it in heating or in the assignment')
+            self.zones.append(ZonePlan(a.tadozone, list(a.calendar_names), warm,
+                                       a.cold or (heating.cold if heating else None),
+                                       a.earlystart or (heating.earlystart if heating else None)))
+        self.calendar_names = set(n for z in self.zones for n in z.calendar_names)
+
+        schedules = [s for s in settings.schedules or [] if s.name in self.calendar_names]
+        self.event_generator = EventGenerator(schedules) if schedules else None
+        self.ical_calendars = [c for c in settings.ical_calendars or [] if c.name in self.calendar_names]
+
+        self.resource_names = self.calendar_names - set([s.name for s in settings.schedules or []] +
+                                                        [c.name for c in settings.ical_calendars or []])
+        if self.resource_names and not (settings.churchtools and settings.churchtools.url):
+            raise ValueError(f'Unknown calendar names {sorted(self.resource_names)}, neither schedules nor iCal calendars '
+                             'and no ChurchTools configured')
+
+        if settings.schedule_engine == 'grid' and not importlib.util.find_spec('numpy'):
+            raise ValueError('schedule_engine grid requires NumPy')
+
+    def get_zone_names(self, calendar_names: set[str]) -> set[str]:
+        """Returns the zones using any of the given calendars.
+        """
+        return set(z.tadozone for z in self.zones if set(z.calendar_names) & calendar_names)
@@ -0,0 +1,45 @@
+from adapter import codec
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, time
+import logging
+from models.schedules import get_weekly_schedules
+import multiprocessing
+from typing import Optional
+
+
+# Optional process pool for the CPU bound work of a run: parsing the iCal calendars, one task per
+# source, and generating the schedules, one task per zone. Events and schedules cross the process
+# boundary encoded by the cache codec, which is more compact and faster to pickle than the models.
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def create_executor(processes: Optional[int]) -> Optional[ProcessPoolExecutor]:
+    """Creates a pool of worker processes, which is kept for the lifetime of the service.
+
+    Args:
+        processes (Optional[int]): The number of worker processes, None or 0 to do the work in the
+            event loop process.
+
+    Returns:
+        Optional[ProcessPoolExecutor]: The pool, or None without worker processes.
+    """
+    if not processes:
+        return None
+    logger.info('Parsing calendars and generating schedules in %d worker processes.', processes)
+    # not forked, since the event loop process runs threads
+    return ProcessPoolExecutor(max_workers = processes, mp_context = multiprocessing.get_context('spawn'))
+
+
+def generate_daily_schedules(encoded_events: list[bytes], from_date: date, warm: float,
+                             cold: Optional[float] = None, earlystart: Optional[time] = None) -> list[bytes]:
+    """Generates the daily schedules of a zone in a worker process, see `get_weekly_schedules`.
+
+    Args:
+        encoded_events (list[bytes]): The events of the zone, encoded by `codec.encode_event`.
+
+    Returns:
+        list[bytes]: The schedules in the order of the weekdays, encoded by `codec.encode_daily_schedule`.
+    """
+    events = [codec.decode_event(e) for e in encoded_events]
+    return [codec.encode_daily_schedule(s) for s in get_weekly_schedules(from_date, events, warm, cold, earlystart)]
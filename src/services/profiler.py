@@ -0,0 +1,196 @@
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+import logging
+import os
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+if TYPE_CHECKING:
+    import cProfile
+
+
+# Functions that mark the stages of a run, by file and function name. A sample is attributed to the
+# innermost stage on its stack, so parsing during a fetch counts as parsing.
+STAGE_FUNCTIONS = {
+    ('fetch.py', 'fetch'): 'fetch',
+    ('ical_retriever.py', 'retrieve_calendar_events'): 'fetch',
+    ('churchtools.py', 'get_events'): 'fetch',
+    ('ical_retriever.py', 'get_events_from_ics'): 'parse',
+    ('ical_retriever.py', 'parse_ics_events'): 'parse',
+    ('churchtools.py', 'get_events_by_resource_name'): 'parse',
+    ('core.py', 'generate_schedules_for_all_zones'): 'generate',
+    ('schedules.py', 'get_weekly_schedules'): 'generate',
+    ('tadocache.py', 'set_schedules_for_all_zones'): 'push',
+    ('tado.py', 'set_schedule_for_zone_and_day'): 'push',
+    ('tado_async.py', 'set_schedule_for_zone_and_day'): 'push',
+    ('sqlitestore.py', 'update_calendar_events'): 'cache',
+    ('sqlitestore.py', 'read_calendar_events'): 'cache',
+    ('sqlitestore.py', 'read_daily_schedules'): 'cache',
+    ('sqlitestore.py', 'flush'): 'cache',
+}
+
+# Innermost functions of threads waiting for work, e.g. the event loop waiting for I/O.
+IDLE_FUNCTIONS = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('thread.py', '_worker'),
+    ('tasks.py', 'sleep'),
+}
+
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of all other threads in a fixed interval.
+    """
+    interval: float
+    stacks: Counter
+    stopped: threading.Event
+
+    def __init__(self, interval: float):
+        super().__init__(name = 'profiler', daemon = True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            thread_names = { t.ident: t.name for t in threading.enumerate() }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame:
+                    stack.append((os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[(thread_names.get(thread_id, str(thread_id)), tuple(stack))] += 1
+
+
+def get_stage(stack: tuple[tuple[str, str], ...]) -> str:
+    """Returns the innermost stage of a sampled stack, 'idle' for a thread waiting for work or 'other'.
+    """
+    for function in reversed(stack):
+        stage = STAGE_FUNCTIONS.get(function)
+        if stage:
+            return stage
+    if stack and stack[-1] in IDLE_FUNCTIONS:
+        return 'idle'
+    return 'other'
+
+
+class Profiler:
+    """Profiles the next runs of the core services once armed, by a config flag, the signal SIGUSR1 or
+    `POST /profile` on the metrics port. Each profiled run writes its profile and a summary per stage
+    to the output directory.
+
+    The sampling profiler samples the stacks of all threads, including the fetches in worker threads,
+    and writes them in the folded format of flame graph tools. The deterministic profiler uses cProfile
+    for the event loop thread only and writes a pstats file. While not armed, a run just checks a counter.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    output_dir: str
+    mode: str
+    interval: float
+    armed_runs: int
+    active: bool
+
+    def __init__(self, output_dir: str, mode: str = 'sampling', interval: float = 0.005):
+        self.output_dir = output_dir
+        self.mode = mode
+        self.interval = interval
+        self.armed_runs = 0
+        self.active = False
+
+    def arm(self, runs: int = 1, mode: Optional[str] = None) -> None:
+        self.armed_runs = max(runs, 0)
+        if mode:
+            self.mode = mode
+        self.logger.info('Profiling the next %d runs (%s).', self.armed_runs, self.mode)
+
+    @asynccontextmanager
+    async def profile(self, name: str = '') -> AsyncIterator[None]:
+        """Profiles the enclosed run if armed. Runs of several homes are profiled one at a time.
+        """
+        if not self.armed_runs or self.active:
+            yield
+            return
+
+        self.armed_runs -= 1
+        self.active = True
+        file_name = os.path.join(self.output_dir, f'profile-{name + "-" if name else ""}{datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]}')
+        started_at = time.monotonic()
+        sampler = None
+        profile = None
+        if self.mode == 'deterministic':
+            # imported on first use, as pstats is slow to import
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            sampler = _Sampler(self.interval)
+            sampler.start()
+
+        try:
+            yield
+
+        finally:
+            duration = time.monotonic() - started_at
+            if profile:
+                profile.disable()
+            if sampler:
+                sampler.stopped.set()
+                sampler.join()
+            self.active = False
+
+            try:
+                os.makedirs(self.output_dir, exist_ok = True)
+                if profile:
+                    self._write_deterministic(file_name, profile, duration)
+                else:
+                    self._write_sampled(file_name, sampler.stacks, duration)
+            except OSError as e:
+                self.logger.error('Failed writing profile %s: %s', file_name, e)
+
+    def _write_sampled(self, file_name: str, stacks: Counter, duration: float) -> None:
+        with open(file_name + '.folded', 'w', encoding='utf-8') as stream:
+            for (thread_name, stack), count in sorted(stacks.items()):
+                frames = ';'.join(f'{function} ({file})' for file, function in stack)
+                stream.write(f'{thread_name};{frames} {count}\n')
+
+        samples_by_stage = Counter()
+        for (_, stack), count in stacks.items():
+            samples_by_stage[get_stage(stack)] += count
+        total = sum(samples_by_stage.values()) or 1
+
+        # the sampler needs the GIL, so busy threads delay the samples
+        lines = [f'Run of {duration:.3f} s, {total} samples of all threads, at most every {self.interval * 1000:.0f} ms', '',
+                 f'{"stage":<12} {"samples":>8} {"share":>7}']
+        for stage, count in samples_by_stage.most_common():
+            lines.append(f'{stage:<12} {count:>8} {count / total:>7.1%}')
+        self._write_summary(file_name, lines)
+
+    def _write_deterministic(self, file_name: str, profile: 'cProfile.Profile', duration: float) -> None:
+        import pstats
+
+        profile.dump_stats(file_name + '.prof')
+
+        stats = pstats.Stats(profile)
+        seconds_by_stage = Counter()
+        for (file, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+            stage = STAGE_FUNCTIONS.get((os.path.basename(file), function))
+            if stage:
+                seconds_by_stage[stage] += cumulative
+
+        lines = [f'Run of {duration:.3f} s in the event loop thread, cumulative seconds include nested stages', '',
+                 f'{"stage":<12} {"seconds":>9}']
+        for stage, seconds in seconds_by_stage.most_common():
+            lines.append(f'{stage:<12} {seconds:>9.3f}')
+        self._write_summary(file_name, lines)
+
+    def _write_summary(self, file_name: str, lines: list[str]) -> None:
+        with open(file_name + '.txt', 'w', encoding='utf-8') as stream:
+            stream.write('\n'.join(lines) + '\n')
+        self.logger.info('Wrote profile %s', file_name)
@@ -0,0 +1,329 @@
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+import zipfile
+
+
+# The inputs of a run are captured where they enter the pipeline, by `capture`. The recording of a run
+# is a context variable, so that it is seen by the fetches in worker threads, too, while runs of other
+# homes are not recorded.
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'recording.json'
+# properties of iCal events which may contain personal data
+SENSITIVE_ICS_PROPERTIES = { b'SUMMARY', b'DESCRIPTION', b'LOCATION', b'ORGANIZER', b'ATTENDEE', b'CONTACT',
+                             b'COMMENT', b'URL', b'UID', b'CATEGORIES', b'ATTACH', b'RELATED-TO' }
+
+T = TypeVar('T')
+
+
+def get_local_timezone() -> Optional[str]:
+    """Returns the name of the local time zone, e.g. Europe/Berlin, if it can be determined.
+    """
+    if os.environ.get('TZ'):
+        return os.environ['TZ'].lstrip(':')
+    localtime = os.path.realpath('/etc/localtime')
+    if 'zoneinfo/' in localtime:
+        return localtime.split('zoneinfo/', 1)[1]
+    return None
+
+
+def anonymize_ics(data: bytes) -> bytes:
+    """Replaces the summaries of the events and removes the other properties that may contain personal
+    data, including their folded continuation lines. The times are kept as they are.
+    """
+    lines = []
+    sensitive = False
+    count = 0
+    uids = 0
+    for line in data.splitlines():
+        if line[:1] in (b' ', b'\t'):
+            if not sensitive:
+                lines.append(line)
+            continue
+        name = re.split(rb'[;:]', line, maxsplit = 1)[0].upper()
+        sensitive = name in SENSITIVE_ICS_PROPERTIES or name.startswith(b'X-')
+        if name == b'SUMMARY':
+            count += 1
+            lines.append(b'SUMMARY:Event %d' % count)
+        elif name == b'UID':
+            uids += 1
+            lines.append(b'UID:%d' % uids)
+        elif not sensitive:
+            lines.append(line)
+    return b'\r\n'.join(lines) + b'\r\n'
+
+
+class Recording:
+    """The inputs of a run of `Worker.execute`: the clock time, the config, the raw iCal calendars,
+    the ChurchTools resources and bookings, and the tado° zones.
+
+    A recording is saved as a zip archive with a manifest in JSON and the iCal calendars as they were
+    loaded. The config is saved without the ChurchTools credentials.
+    """
+    now: datetime
+    timezone: Optional[str]
+    message: dict[str, bool]
+    settings: dict[str, Any]
+    zone_ids: dict[str, int]
+    inputs: dict[str, dict[str, Any]]
+    replaying: bool
+
+    def __init__(self, now: datetime, timezone: Optional[str], message: dict[str, bool], settings: dict[str, Any],
+                 zone_ids: Optional[dict[str, int]] = None, inputs: Optional[dict[str, dict[str, Any]]] = None,
+                 replaying: bool = False):
+        self.now = now
+        self.timezone = timezone
+        self.message = message
+        self.settings = settings
+        self.zone_ids = zone_ids or {}
+        self.inputs = inputs or {}
+        self.replaying = replaying
+
+    def get(self, kind: str, key: str) -> Any:
+        try:
+            return self.inputs[kind][key]
+        except KeyError:
+            raise LookupError(f'The recording has no {kind} input "{key}".')
+
+    def put(self, kind: str, key: str, value: Any) -> None:
+        self.inputs.setdefault(kind, {})[key] = value
+
+    def save(self, file_name: str) -> None:
+        manifest_inputs = {}
+        with zipfile.ZipFile(file_name, 'w', compression = zipfile.ZIP_DEFLATED) as archive:
+            for kind, values in sorted(self.inputs.items()):
+                manifest_inputs[kind] = {}
+                for key, value in sorted(values.items()):
+                    if isinstance(value, bytes):
+                        member = f'{kind}/{len(manifest_inputs[kind])}'
+                        archive.writestr(member, value)
+                        manifest_inputs[kind][key] = { 'file': member }
+                    else:
+                        manifest_inputs[kind][key] = { 'value': value }
+
+            archive.writestr(MANIFEST_NAME, json.dumps({
+                'version': FORMAT_VERSION,
+                'now': self.now.isoformat(),
+                'timezone': self.timezone,
+                'message': self.message,
+                'settings': self.settings,
+                'zone_ids': self.zone_ids,
+                'inputs': manifest_inputs,
+            }, indent = 2, ensure_ascii = False))
+
+    @classmethod
+    def load(cls, file_name: str) -> 'Recording':
+        with zipfile.ZipFile(file_name) as archive:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+            if manifest.get('version') != FORMAT_VERSION:
+                raise ValueError(f'Unsupported version {manifest.get("version")} of recording "{file_name}".')
+            inputs = { kind: { key: archive.read(entry['file']) if 'file' in entry else entry['value']
+                               for key, entry in values.items() }
+                       for kind, values in manifest['inputs'].items() }
+
+        return Recording(datetime.fromisoformat(manifest['now']), manifest['timezone'], manifest['message'],
+                         manifest['settings'], manifest['zone_ids'], inputs)
+
+    def anonymize(self) -> 'Recording':
+        """Returns a copy that can be shared: calendars, zones, sources and events are renamed consistently,
+        the iCal calendars are stripped of personal data. The times of the events are kept.
+        """
+        settings = json.loads(json.dumps(self.settings))
+        calendar_names = {}
+        zone_names = {}
+        sources = {}
+
+        def rename(names: dict[str, str], name: str, prefix: str) -> str:
+            return names.setdefault(name, f'{prefix} {len(names) + 1}')
+
+        for s in settings.get('schedules') or []:
+            s['name'] = rename(calendar_names, s['name'], 'Calendar')
+        for c in settings.get('ical_calendars') or []:
+            c['name'] = rename(calendar_names, c['name'], 'Calendar')
+            c['source'] = sources.setdefault(c['source'], f'calendar-{len(sources) + 1}.ics')
+        if settings.get('churchtools'):
+            sources[settings['churchtools']['url']] = 'https://churchtools.invalid/'
+            settings['churchtools']['url'] = sources[settings['churchtools']['url']]
+        for a in settings.get('assignments') or []:
+            a['tadozone'] = rename(zone_names, a['tadozone'], 'Zone')
+            a['calendar_names'] = [rename(calendar_names, n, 'Calendar') for n in a['calendar_names']]
+        settings.pop('instance_id', None)
+
+        inputs = {}
+        for source, data in self.inputs.get('ical', {}).items():
+            inputs.setdefault('ical', {})[sources.get(source, source)] = anonymize_ics(data)
+        for url, ids in self.inputs.get('churchtools_resources', {}).items():
+            inputs.setdefault('churchtools_resources', {})[sources.get(url, url)] = \
+                { rename(calendar_names, name, 'Calendar'): id for name, id in ids.items() }
+        for url, bookings in self.inputs.get('churchtools_bookings', {}).items():
+            inputs.setdefault('churchtools_bookings', {})[sources.get(url, url)] = \
+                [b | { 'caption': f'Booking {n + 1}' } for n, b in enumerate(bookings)]
+
+        zone_ids = { rename(zone_names, name, 'Zone'): id for name, id in self.zone_ids.items() }
+        return Recording(self.now, self.timezone, self.message, settings, zone_ids, inputs)
+
+
+_recording: ContextVar[Optional[Recording]] = ContextVar('recording', default = None)
+
+
+def get_recording() -> Optional[Recording]:
+    """Returns the recording of the current run, which is being recorded or replayed, if any.
+    """
+    return _recording.get()
+
+
+def capture(kind: str, key: str, load: Callable[[], T]) -> T:
+    """Loads an input of a run. While recording, the input is added to the recording, while replaying,
+    it is taken from the recording instead.
+
+    Args:
+        kind (str): The kind of input, e.g. 'ical'.
+        key (str): Identifies the input among the ones of its kind, e.g. the URL.
+        load (Callable[[], T]): Loads the input, the result is either bytes or serializable to JSON.
+    """
+    recording = _recording.get()
+    if recording is None:
+        return load()
+    if recording.replaying:
+        return recording.get(kind, key)
+    value = load()
+    recording.put(kind, key, value)
+    return value
+
+
+def now() -> datetime:
+    """Returns the local time without time zone, which is the time of the recording while recording or
+    replaying a run.
+    """
+    recording = _recording.get()
+    return recording.now if recording else datetime.now()
+
+
+class Recorder:
+    """Records the next runs of the core services once armed by the config flag `record_runs`. Each run
+    is written to an archive in the output directory, which `replay` runs offline.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    output_dir: str
+    anonymized: bool
+    armed_runs: int
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.anonymized = False
+        self.armed_runs = 0
+
+    def arm(self, runs: int = 1, anonymized: bool = False) -> None:
+        self.armed_runs = max(runs, 0)
+        self.anonymized = anonymized
+        self.logger.info('Recording the next %d runs%s.', self.armed_runs, ', anonymized' if anonymized else '')
+
+    @asynccontextmanager
+    async def record(self, message: Any, settings: Any, tado: Any, name: str = '') -> AsyncIterator[None]:
+        """Records the enclosed run if armed. Runs of several homes are recorded one at a time.
+
+        Args:
+            message (Message): The message the run is started with.
+            settings (CoreSettings): The config of the run.
+            tado (TadoAdapter): The tado° adapter, whose zones are recorded.
+        """
+        if not self.armed_runs or _recording.get():
+            yield
+            return
+
+        self.armed_runs -= 1
+        settings_data = settings.model_dump(mode = 'json', exclude_unset = True)
+        for key in ('username', 'password', 'token'):
+            settings_data.get('churchtools', {}).pop(key, None)
+        recording = Recording(datetime.now(), get_local_timezone(),
+                              { 'config_changed': message.config_changed, 'full_update': message.full_update },
+                              settings_data)
+        file_name = os.path.join(self.output_dir, f'recording-{name + "-" if name else ""}{recording.now.strftime("%Y%m%d-%H%M%S")}.zip')
+        token = _recording.set(recording)
+        try:
+            yield
+
+        finally:
+            _recording.reset(token)
+            recording.zone_ids = dict(getattr(tado, 'zone_ids', None) or {})
+            try:
+                os.makedirs(self.output_dir, exist_ok = True)
+                (recording.anonymize() if self.anonymized else recording).save(file_name)
+                self.logger.info('Wrote recording %s', file_name)
+            except OSError as e:
+                self.logger.error('Failed writing recording %s: %s', file_name, e)
+
+
+class ReplayTadoAdapter:
+    """Stands in for tado° when replaying a run: knows the recorded zones and keeps the schedules sent.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    zone_ids: dict[str, int]
+    zone_names: dict[int, str]
+    schedules: dict[tuple[str, int], Any]
+
+    def __init__(self, zone_ids: dict[str, int]):
+        self.zone_ids = zone_ids
+        self.zone_names = { id: name for name, id in zone_ids.items() }
+        self.schedules = {}
+
+    def get_zone_id(self, zone_name: str) -> int:
+        return self.zone_ids[zone_name]
+
+    def get_zone_name(self, zone_id: int) -> str:
+        return self.zone_names[zone_id]
+
+    async def set_timetable_for_zone(self, zone_name: str, zone_id: int) -> None:
+        pass
+
+    async def set_schedule_for_zone_and_day(self, zone_name: str, zone_id: int, weekday: int, schedule: Any) -> None:
+        self.schedules[(zone_name, weekday)] = schedule
+
+
+async def replay(recording: Recording, executor: Optional[Any] = None, profiler: Optional[Any] = None) -> ReplayTadoAdapter:
+    """Runs `Worker.execute` offline with the inputs and the clock time of a recording, against an empty
+    cache, so that the schedules of all zones are generated and sent as in a first run.
+
+    The local time zone should be the one of the recording, see `use_timezone`.
+
+    Returns:
+        ReplayTadoAdapter: The tado° stand-in with the schedules sent in the run.
+    """
+    # imported here, as the adapters capture their inputs with this module
+    from adapter.sqlitestore import SQLiteStore
+    from models.settings import CoreSettings
+    from services.core import Message, Worker
+    from services.fetch import FetchStage
+
+    settings = CoreSettings(**recording.settings)
+    tado = ReplayTadoAdapter(recording.zone_ids)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fetch_stage = FetchStage(executor = executor, data_dir = temp_dir)
+        store = SQLiteStore(temp_dir)
+        token = _recording.set(Recording(recording.now, recording.timezone, recording.message, recording.settings,
+                                         recording.zone_ids, recording.inputs, replaying = True))
+        try:
+            worker = Worker(settings, tado, store, fetch_stage.get_churchtools_session(settings.churchtools),
+                            fetch_stage, executor = executor, home = 'replay')
+            async with profiler.profile('replay') if profiler else nullcontext():
+                await worker.execute(Message(**recording.message))
+        finally:
+            _recording.reset(token)
+            store.close()
+    return tado
+
+
+def use_timezone(recording: Recording) -> None:
+    """Switches the local time zone of the process to the one of the recording, if known.
+    """
+    if recording.timezone:
+        os.environ['TZ'] = recording.timezone
+        time.tzset()
@@ -1,45 +1,113 @@
 import asyncio
 from datetime import datetime, timedelta
 import logging, logging.handlers
-from services.core import Message
+from services.core import Boundaries, Message
+from typing import Optional
+
+
+def round_minutes(dt: datetime, minutes: float) -> datetime:
+    return datetime(dt.year, dt.month, dt.day, dt.hour, int(dt.minute // minutes * minutes))
+
+
+def get_next_wakeup(now: datetime, next_boundary: Optional[datetime], minutes: float,
+                    min_minutes: Optional[float] = None, max_minutes: Optional[float] = None,
+                    offset_seconds: float = 0.0) -> datetime:
+    """Determines the next wakeup on the full minutes of the polling interval, shifted by the offset.
+
+    The interval is shortened to `min_minutes` while a boundary is imminent, i.e. within the regular
+    interval, and lengthened to `max_minutes` while there is no boundary within that longer interval.
+    In any case the timer wakes up `min_minutes` before the next boundary, so that a late change is
+    sent to tado° before the boundary takes effect. This wakeup is not shifted.
+
+    Args:
+        now (datetime): The current local time.
+        next_boundary (Optional[datetime]): The next boundary in local time, if known.
+        minutes (float): The regular polling interval.
+        min_minutes (Optional[float]): The polling interval around imminent boundaries, defaults to `minutes`.
+        max_minutes (Optional[float]): The polling interval while nothing changes, defaults to `minutes`.
+        offset_seconds (float): The jitter of this instance, shifts the wakeups on the full minutes.
+
+    Returns:
+        datetime: The local time of the next wakeup.
+    """
+    min_minutes = min(min_minutes or minutes, minutes)
+    max_minutes = max(max_minutes or minutes, minutes)
+
+    interval = minutes
+    if next_boundary and next_boundary - now <= timedelta(minutes = minutes):
+        interval = min_minutes
+    elif not next_boundary or next_boundary - now > timedelta(minutes = max_minutes):
+        interval = max_minutes
+
+    offset = timedelta(seconds = offset_seconds)
+    wakeup = round_minutes(now - offset + timedelta(minutes = interval), interval) + offset
+
+    if next_boundary:
+        before_boundary = next_boundary - timedelta(minutes = min_minutes)
+        if now < before_boundary < wakeup:
+            wakeup = before_boundary
+    return wakeup
+
 
 class Service:
     logger: logging.Logger = logging.getLogger(__name__)
     minutes: float
+    min_minutes: Optional[float]
+    max_minutes: Optional[float]
+    offset_seconds: float
     queue: asyncio.Queue
+    boundaries: Boundaries
 
-    def __init__(self, minutes: float, queue: asyncio.Queue):
+    def __init__(self, minutes: float, queue: asyncio.Queue, boundaries: Optional[Boundaries] = None,
+                 min_minutes: Optional[float] = None, max_minutes: Optional[float] = None,
+                 offset_seconds: float = 0.0):
         self.minutes = minutes
+        self.min_minutes = min_minutes
+        self.max_minutes = max_minutes
+        self.offset_seconds = offset_seconds
         self.queue = queue
+        self.boundaries = boundaries or Boundaries()
 
     async def run(self):
-        def get_delay(seconds: float) -> tuple[datetime, float]:
-            dt = datetime.now() + timedelta(seconds= seconds)
-            return (dt, seconds)
-
-        def get_delay_to_next_full_minutes() -> tuple[datetime, float]:
-            now = datetime.now()
-            dt = round_minutes(now + timedelta(minutes = self.minutes), self.minutes)
-            delay = (dt - now).total_seconds()
-            return (dt, delay)
-
-        def round_minutes(dt: datetime, minutes: float) -> datetime:
-            return datetime(dt.year, dt.month, dt.day, dt.hour, (dt.minute // minutes) * minutes)
-
         try:
-            dt, delay = get_delay(10)
+            # the first run is a full update right away, the core service waits for tado° if needed
+            dt = datetime.now()
             first_run = True
 
             while True:
                 self.logger.debug("Waiting until %s", dt)
-                await asyncio.sleep(delay)
 
-                message = Message(full_update = first_run)
+                # boundaries learned meanwhile may require an earlier wakeup
+                self.boundaries.changed.clear()
+                delay = max((dt - datetime.now()).total_seconds(), 0.0)
+                try:
+                    await asyncio.wait_for(self.boundaries.changed.wait(), delay)
+                    if not first_run:
+                        dt = min(dt, self.get_next_wakeup())
+                    continue
+                except TimeoutError:
+                    pass
+
+                message = Message(full_update = first_run, boundary_zones = self.get_boundary_zones())
                 self.logger.debug('Submitting work. Message: %s', message)
                 self.queue.put_nowait(message)
 
-                dt, delay = get_delay_to_next_full_minutes()
                 first_run = False
+                dt = self.get_next_wakeup()
 
         except asyncio.CancelledError:
             pass
+
+    def get_boundary_zones(self) -> set[str]:
+        """Returns the zones having a boundary within the polling interval around imminent boundaries, so that
+        their sources are fetched on the wakeup before the boundary.
+        """
+        now = datetime.now()
+        min_minutes = min(self.min_minutes or self.minutes, self.minutes)
+        # the wait may end slightly before the planned wakeup
+        return self.boundaries.get_zones(now, now + timedelta(minutes = min_minutes + 1))
+
+    def get_next_wakeup(self) -> datetime:
+        now = datetime.now()
+        return get_next_wakeup(now, self.boundaries.get_next(now), self.minutes, self.min_minutes, self.max_minutes,
+                               self.offset_seconds)
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from models.settings import CoreSettings
+from services.core import Message
+from services import metrics
+from services.plan import ExecutionPlan
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+CHURCHTOOLS_SOURCE = 'churchtools'
+
+
+class Webhook:
+    """Accepts reports of changed calendars on `POST /changed` of the metrics port, so that the heating
+    reacts within seconds instead of at the next poll.
+
+    `POST /changed?calendar=<name>` reports a calendar by its name in the config, the parameter may be
+    repeated. `POST /changed?source=churchtools` reports a change of any ChurchTools booking, e.g. by a
+    ChurchTools automation. Each home using one of the calendars gets a message that refetches just
+    their sources and recomputes the zones assigned to them, see `services.core.Worker`.
+
+    A request has to pass the token as `Authorization: Bearer <token>` or as `token=<token>`. Without a
+    token the webhook is not served, see `services.metrics.Service`, and rejects any request.
+    """
+    logger: logging.Logger = logging.getLogger(__name__)
+    homes: dict[str, tuple[str, asyncio.Queue]]
+    token: Optional[str]
+
+    def __init__(self, homes: dict[str, tuple[str, asyncio.Queue]], token: Optional[str] = None):
+        """
+        Args:
+            homes (dict[str, tuple[str, asyncio.Queue]]): The config file and the queue of the core service by home name.
+            token (Optional[str]): The token a request has to pass, no request is accepted without.
+        """
+        self.homes = homes
+        self.token = token
+
+    def is_authorized(self, authorization: Optional[str], token: Optional[str]) -> bool:
+        return metrics.is_authorized(self.token, authorization, token)
+
+    def notify(self, calendar_names: set[str], sources: set[str]) -> dict[str, set[str]]:
+        """Enqueues a message for each home using one of the changed calendars or sources. The configs are
+        read anew, so that the current assignments are used.
+
+        Returns:
+            dict[str, set[str]]: The changed calendars by home, for the homes using any.
+        """
+        notified = {}
+        for name, (config_file, queue) in self.homes.items():
+            try:
+                plan = ExecutionPlan(CoreSettings.load_from(config_file))
+            except Exception as e:
+                self.logger.error('Cannot read config file %s: %s', config_file, e)
+                continue
+
+            changed_calendars = plan.calendar_names & calendar_names
+            if CHURCHTOOLS_SOURCE in sources:
+                changed_calendars |= plan.resource_names
+            if changed_calendars:
+                self.logger.info('Home %s: calendars %s changed.', name or '-', sorted(changed_calendars))
+                queue.put_nowait(Message(changed_calendars = changed_calendars))
+                notified[name] = changed_calendars
+        return notified
+
+    async def post_changed(self, request: 'web.Request') -> 'web.Response':
+        from aiohttp import web
+
+        if not self.is_authorized(request.headers.get('Authorization'), request.query.get('token')):
+            raise web.HTTPUnauthorized(text = 'invalid token')
+        calendar_names = set(request.query.getall('calendar', []))
+        sources = set(request.query.getall('source', []))
+        if sources - { CHURCHTOOLS_SOURCE }:
+            raise web.HTTPBadRequest(text = f'source must be {CHURCHTOOLS_SOURCE}')
+        if not calendar_names and not sources:
+            raise web.HTTPBadRequest(text = 'calendar or source required')
+
+        notified = self.notify(calendar_names, sources)
+        if not notified:
+            raise web.HTTPNotFound(text = 'no home uses these calendars')
+        return web.Response(status = 202, text = ''.join(f'{name or "-"}: {", ".join(sorted(calendars))}\n'
+                                                          for name, calendars in notified.items()))
@@ -0,0 +1,70 @@
+from adapter.bookingswindow import BookingsWindow
+from datetime import date, datetime, time, timedelta
+from dateutil import tz
+import unittest
+
+
+MONDAY = date(2025, 11, 17)
+SUNDAY = MONDAY + timedelta(days = 6)
+HOUR = 3600
+
+
+def create_booking(key: str, day: date) -> dict:
+    start = datetime.combine(day, time(10), tz.tzlocal())
+    return { 'key': key, 'resource_id': 5, 'caption': key,
+             'start': start.isoformat(), 'end': (start + timedelta(hours = 2)).isoformat() }
+
+
+def create_window(full_refresh_at: float) -> BookingsWindow:
+    window = BookingsWindow()
+    window.update(MONDAY, SUNDAY, [create_booking(str(n), MONDAY + timedelta(days = n)) for n in range(0, 7)])
+    window.resource_ids = [5]
+    window.full_refresh_at = full_refresh_at
+    return window
+
+
+class BookingsWindowTest(unittest.TestCase):
+
+    def test_empty_window_fetches_all_days(self):
+        ranges = BookingsWindow().get_ranges_to_fetch([5], MONDAY, SUNDAY, 2, HOUR, 0.0)
+        self.assertEqual(ranges, [(MONDAY, SUNDAY)])
+
+    def test_same_window_fetches_hot_days_only(self):
+        ranges = create_window(0.0).get_ranges_to_fetch([5], MONDAY, SUNDAY, 2, HOUR, 60.0)
+        self.assertEqual(ranges, [(MONDAY, MONDAY + timedelta(days = 1))])
+
+    def test_next_day_fetches_hot_days_and_new_day(self):
+        tuesday = MONDAY + timedelta(days = 1)
+        ranges = create_window(0.0).get_ranges_to_fetch([5], tuesday, SUNDAY + timedelta(days = 1), 2, HOUR, 60.0)
+        self.assertEqual(ranges, [(tuesday, tuesday + timedelta(days = 1)), (SUNDAY + timedelta(days = 1), SUNDAY + timedelta(days = 1))])
+
+    def test_due_full_refresh_fetches_all_days(self):
+        ranges = create_window(0.0).get_ranges_to_fetch([5], MONDAY, SUNDAY, 2, HOUR, HOUR)
+        self.assertEqual(ranges, [(MONDAY, SUNDAY)])
+
+    def test_other_resources_fetch_all_days(self):
+        ranges = create_window(0.0).get_ranges_to_fetch([5, 6], MONDAY, SUNDAY, 2, HOUR, 60.0)
+        self.assertEqual(ranges, [(MONDAY, SUNDAY)])
+
+    def test_update_replaces_bookings_of_fetched_days_only(self):
+        window = create_window(0.0)
+        window.update(MONDAY, MONDAY + timedelta(days = 1), [create_booking('new', MONDAY)])
+
+        self.assertEqual([b['key'] for b in window.select(MONDAY, SUNDAY)], ['new', '2', '3', '4', '5', '6'])
+
+    def test_slide_drops_past_bookings(self):
+        window = create_window(0.0)
+        window.slide(MONDAY + timedelta(days = 2))
+
+        self.assertEqual(sorted(window.bookings), ['2', '3', '4', '5', '6'])
+        self.assertEqual(window.covered_from, MONDAY + timedelta(days = 2))
+
+    def test_json_round_trip(self):
+        window = create_window(42.0)
+        restored = BookingsWindow.from_json(window.to_json())
+
+        self.assertEqual(restored.to_json(), window.to_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
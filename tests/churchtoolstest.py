@@ -0,0 +1,209 @@
+from adapter.churchtools import ChurchToolsSession, ResourceBookingsRetriever
+from adapter.sqlitestore import SQLiteStore
+from datetime import date, datetime
+from dateutil import tz
+from models.settings import ChurchToolsSettings
+import json
+import os
+import requests
+import tempfile
+import unittest
+
+
+def create_resource(id: int, name: str) -> dict:
+    return { 'id': id, 'name': name, 'nameTranslated': name, 'doesRequireCalEntry': False, 'isAutoAccept': True,
+             'isVirtual': False, 'randomString': 'abc', 'resourceTypeId': 1, 'sortKey': id }
+
+
+def create_booking(id: int, resource_id: int, start: str, end: str, caption: str) -> dict:
+    return { 'base': { 'id': id, 'caption': caption, 'resource': { 'id': resource_id } },
+             'calculated': { 'startDate': start, 'endDate': end } }
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, data = None):
+        self.status_code = status_code
+        self.data = data
+        self.content = json.dumps(data).encode('utf-8')
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Client Error')
+
+
+class FakeChurchToolsApi:
+    """Answers like the ChurchTools login and API, with a new login cookie per login.
+    """
+
+    def __init__(self, resources: list[dict] = None):
+        self.headers = {}
+        self.valid_cookies = []
+        self.logins = 0
+        self.requests = []
+        self.resources = resources if resources is not None else [create_resource(1, 'Hall'), create_resource(2, 'Chapel')]
+        self.bookings = []
+
+    def expire_sessions(self):
+        self.valid_cookies.clear()
+
+    # the login of the `churchtools` client
+    def login(self, username: str, password: str) -> bool:
+        if password != 'secret':
+            return False
+        self.logins += 1
+        self.valid_cookies.append({ 'ChurchTools_ct_church': f'session-{self.logins}' })
+        return True
+
+    def get_login_cookie(self) -> dict[str, str]:
+        return self.valid_cookies[-1]
+
+    # the requests of the HTTP session
+    def get(self, url: str, params = None, cookies = None, timeout = None) -> FakeResponse:
+        if self.headers.get('Authorization') != 'Login token' and cookies not in self.valid_cookies:
+            return FakeResponse(401, { 'message': 'Session expired' })
+
+        endpoint = url.split('/api/', 1)[1]
+        self.requests.append((endpoint, cookies))
+        if endpoint == 'resource/masterdata':
+            return FakeResponse(200, { 'data': { 'resources': self.resources } })
+        if endpoint == 'bookings':
+            return FakeResponse(200, { 'data': self.bookings })
+        return FakeResponse(404)
+
+
+class FakeApiChurchToolsSession(ChurchToolsSession):
+
+    def __init__(self, settings: ChurchToolsSettings, api: FakeChurchToolsApi, data_dir: str):
+        super().__init__(settings, data_dir)
+        api.headers.update(self.http.headers)
+        self.http = api
+        self.api = api
+
+    def _create_client(self):
+        return self.api
+
+
+class ChurchToolsSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.api = FakeChurchToolsApi()
+        self.settings = ChurchToolsSettings(url = 'https://example.church.tools/', username = 'tado', password = 'secret')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_session(self, settings: ChurchToolsSettings = None) -> ChurchToolsSession:
+        return FakeApiChurchToolsSession(settings or self.settings, self.api, self.temp_dir.name)
+
+    def test_login_is_reused_across_polls(self):
+        session = self.create_session()
+
+        session.request('bookings')
+        session.request('bookings')
+
+        self.assertEqual(self.api.logins, 1)
+        self.assertEqual(self.api.requests, [('bookings', { 'ChurchTools_ct_church': 'session-1' })] * 2)
+
+    def test_saved_login_is_reused_after_a_restart(self):
+        self.create_session().request('bookings')
+
+        self.create_session().request('bookings')
+
+        self.assertEqual(self.api.logins, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, 'churchtools_session.json')))
+
+    def test_expired_session_logs_in_again_and_repeats_the_request(self):
+        session = self.create_session()
+        session.request('bookings')
+        self.api.expire_sessions()
+
+        self.assertEqual(session.request('bookings'), { 'data': [] })
+
+        self.assertEqual(self.api.logins, 2)
+        self.assertEqual(self.api.requests[-1], ('bookings', { 'ChurchTools_ct_church': 'session-2' }))
+        # the new login is saved for the next restart
+        self.create_session().request('bookings')
+        self.assertEqual(self.api.logins, 2)
+
+    def test_failed_login_raises_permission_error(self):
+        session = self.create_session(self.settings.model_copy(update = { 'password': 'wrong' }))
+
+        with self.assertRaises(PermissionError):
+            session.request('bookings')
+
+    def test_token_is_used_without_login(self):
+        session = self.create_session(ChurchToolsSettings(url = 'https://example.church.tools/', token = 'token'))
+
+        session.request('bookings')
+
+        self.assertEqual(self.api.logins, 0)
+        self.assertEqual(self.api.requests, [('bookings', None)])
+
+    def test_masterdata_is_cached_within_its_lifetime(self):
+        session = self.create_session()
+
+        self.assertEqual(session.get_resource_ids_by_name(), { 'Hall': 1, 'Chapel': 2 })
+        self.assertEqual(self.create_session().get_resource_ids_by_name(), { 'Hall': 1, 'Chapel': 2 })
+
+        self.assertEqual([endpoint for endpoint, _ in self.api.requests], ['resource/masterdata'])
+
+    def test_masterdata_is_fetched_again_after_its_lifetime(self):
+        session = self.create_session()
+        session.get_resources()
+        self.api.resources.append(create_resource(3, 'Office'))
+
+        session.resources_fetched_at -= self.settings.masterdata_cache_hours * 3600 + 1
+
+        self.assertEqual(session.get_resource_ids_by_name(), { 'Hall': 1, 'Chapel': 2, 'Office': 3 })
+        self.assertEqual([endpoint for endpoint, _ in self.api.requests], ['resource/masterdata'] * 2)
+        # the masterdata fetched again is saved for the next restart
+        self.assertEqual(self.create_session().get_resource_ids_by_name(), { 'Hall': 1, 'Chapel': 2, 'Office': 3 })
+        self.assertEqual(len(self.api.requests), 2)
+
+
+class ResourceBookingsRetrieverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.api = FakeChurchToolsApi([create_resource(1, 'Hall'), create_resource(2, 'Chapel'), create_resource(3, 'Office'),
+                                       create_resource(9, 'Garage')])
+        settings = ChurchToolsSettings(url = 'https://example.church.tools/', token = 'token')
+        self.store = SQLiteStore(self.temp_dir.name)
+        self.retriever = ResourceBookingsRetriever(FakeApiChurchToolsSession(settings, self.api, self.temp_dir.name), self.store)
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_each_booking_lands_in_its_resource(self):
+        self.api.bookings = [
+            create_booking(1, 1, '2025-11-17T09:00:00Z', '2025-11-17T10:00:00Z', 'Service'),
+            create_booking(2, 2, '2025-11-17T11:00:00Z', '2025-11-17T12:00:00Z', 'Choir'),
+            create_booking(3, 1, '2025-11-18T18:00:00Z', '2025-11-18T20:00:00Z', 'Youth'),
+            # a booking of a resource that is not assigned to any zone
+            create_booking(4, 9, '2025-11-17T09:00:00Z', '2025-11-17T10:00:00Z', 'Car wash'),
+            create_booking(5, 1, '2025-11-19T07:00:00Z', '2025-11-19T08:00:00Z', 'Prayer'),
+        ]
+
+        events = self.retriever.get_events_by_resource_name({ 'Hall': 1, 'Chapel': 2, 'Office': 3 },
+                                                            date(2025, 11, 17), date(2025, 11, 23))
+
+        self.assertEqual({ name: [e.name for e in resource_events] for name, resource_events in events.items() },
+                         { 'Hall': ['Service', 'Youth', 'Prayer'], 'Chapel': ['Choir'], 'Office': [] })
+        self.assertEqual(events['Chapel'][0].start, datetime(2025, 11, 17, 11, 0, tzinfo = tz.tzutc()))
+        self.assertEqual(events['Chapel'][0].end, datetime(2025, 11, 17, 12, 0, tzinfo = tz.tzutc()))
+
+    def test_unknown_resource_name_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.retriever.get_events({ 'Hall', 'Basement' }, date(2025, 11, 17), date(2025, 11, 23))
+
+        self.assertFalse([endpoint for endpoint, _ in self.api.requests if endpoint == 'bookings'])
+
+
+if __name__ == '__main__':
+    unittest.main()
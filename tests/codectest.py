@@ -0,0 +1,60 @@
+from adapter import codec
+from datetime import datetime, time, timedelta, timezone
+from dateutil import tz
+from models.events import Event
+from models.schedules import Block, DailySchedule
+import unittest
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_event_round_trip(self):
+        event = Event(start = datetime(2025, 11, 17, 10, 0, tzinfo = tz.tzlocal()),
+                      end = datetime(2025, 11, 17, 11, 30, 15, 500, tzinfo = timezone(timedelta(hours = -5))),
+                      name = 'Gottesdienst für alle')
+
+        decoded = codec.decode_event(codec.encode_event(event))
+
+        self.assertEqual(decoded, event)
+        self.assertEqual(decoded.start.utcoffset(), event.start.utcoffset())
+
+    def test_naive_event_round_trip(self):
+        event = Event(start = datetime(2025, 11, 17, 10, 0), end = datetime(2025, 11, 17, 12, 0), name = '')
+
+        self.assertEqual(codec.decode_event(codec.encode_event(event)), event)
+
+    def test_event_with_naive_and_aware_datetimes_round_trip(self):
+        event = Event(start = datetime(2025, 11, 17, 10, 0), end = datetime(2025, 11, 17, 12, 0, tzinfo = timezone.utc), name = 'x')
+
+        decoded = codec.decode_event(codec.encode_event(event))
+
+        self.assertIsNone(decoded.start.tzinfo)
+        self.assertEqual(decoded.end.utcoffset(), timedelta(0))
+
+    def test_decoded_event_is_a_complete_model(self):
+        event = Event(start = datetime(2025, 11, 17, 10, 0, tzinfo = timezone.utc), end = datetime(2025, 11, 17, 12, 0, tzinfo = timezone.utc),
+                      name = 'Gottesdienst')
+
+        decoded = codec.decode_event(codec.encode_event(event))
+
+        self.assertEqual(decoded.model_fields_set, event.model_fields_set)
+        self.assertEqual(decoded.model_dump_json(), event.model_dump_json())
+        self.assertEqual(decoded.model_copy(update = { 'name': 'Taufe' }), event.model_copy(update = { 'name': 'Taufe' }))
+        self.assertEqual(repr(decoded), repr(event))
+
+    def test_daily_schedule_round_trip(self):
+        schedule = DailySchedule(blocks = { time.min: Block(temperature = 17.0) })
+        schedule.insert_block(Block(start = time(8, 15), end = time(12), temperature = 21.5))
+
+        self.assertEqual(codec.decode_daily_schedule(codec.encode_daily_schedule(schedule)), schedule)
+
+    def test_other_format_version_is_rejected(self):
+        data = bytearray(codec.encode_daily_schedule(DailySchedule()))
+        data[3] = codec.FORMAT_VERSION + 1
+
+        with self.assertRaises(ValueError):
+            codec.decode_daily_schedule(bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
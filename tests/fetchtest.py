@@ -0,0 +1,178 @@
+import asyncio
+from adapter.sqlitestore import SQLiteStore
+from datetime import datetime, timedelta
+from models.events import AllCalendarEvents, CalendarEvents
+from models.settings import CoreSettings
+import os
+from services.core import Message, Worker
+from services.fetch import FetchStage, Source
+from services.recording import ReplayTadoAdapter
+import tempfile
+import threading
+import unittest
+
+
+def create_events(name: str) -> AllCalendarEvents:
+    all_events = AllCalendarEvents()
+    all_events.events[name] = CalendarEvents(name = name, events = [])
+    return all_events
+
+
+class FetchStageTest(unittest.TestCase):
+
+    def test_source_responding_in_time_is_remembered(self):
+        stage = FetchStage()
+
+        events = asyncio.run(stage._fetch_source('ical:a', 1.0, lambda: create_events('a')))
+
+        self.assertEqual(list(events.events), ['a'])
+        self.assertIn('ical:a', stage.last_events)
+
+    def test_slow_source_keeps_running_and_is_joined_by_the_next_run(self):
+        stage = FetchStage()
+        release = threading.Event()
+        calls = []
+
+        def retrieve() -> AllCalendarEvents:
+            calls.append(1)
+            release.wait(5.0)
+            return create_events('a')
+
+        async def run() -> tuple:
+            first = await stage._fetch_source('ical:a', 0.05, retrieve)
+            release.set()
+            second = await stage._fetch_source('ical:a', 1.0, retrieve)
+            return (first, second)
+
+        first, second = asyncio.run(run())
+
+        self.assertIsNone(first)
+        self.assertEqual(list(second.events), ['a'])
+        self.assertEqual(len(calls), 1)
+
+    def test_failing_source_returns_none(self):
+        def retrieve() -> AllCalendarEvents:
+            raise ConnectionError('unreachable')
+
+        self.assertIsNone(asyncio.run(FetchStage()._fetch_source('churchtools', 1.0, retrieve)))
+
+    def test_unchanged_source_backs_off_up_to_the_maximum(self):
+        stage = FetchStage()
+        source = Source({ 'a' }, 1.0, lambda: None, 5, 15)
+
+        intervals = []
+        for _ in range(4):
+            stage._schedule_next_poll('ical:a', source, False, 0.0)
+            intervals.append(stage.intervals['ical:a'] / 60)
+
+        self.assertEqual(intervals, [5, 10, 15, 15])
+
+        stage._schedule_next_poll('ical:a', source, True, 0.0)
+        self.assertEqual(stage.intervals['ical:a'], 5 * 60)
+
+    def test_source_without_backoff_keeps_its_interval(self):
+        stage = FetchStage()
+        source = Source({ 'a' }, 1.0, lambda: None, 5)
+
+        stage._schedule_next_poll('ical:a', source, False, 100.0)
+        stage._schedule_next_poll('ical:a', source, False, 100.0)
+
+        self.assertEqual(stage.next_due['ical:a'], 400.0)
+        self.assertFalse(stage._is_due('ical:a', 200.0))
+        self.assertTrue(stage._is_due('ical:a', 390.0))
+
+    def test_backed_off_interval_ends_before_the_next_boundary(self):
+        stage = FetchStage()
+        source = Source({ 'a' }, 1.0, lambda: None, 5, 60)
+        stage._schedule_next_poll('ical:a', source, False, 0.0)
+
+        stage._schedule_next_poll('ical:a', source, False, 0.0, 8 * 60)
+        self.assertEqual(stage.intervals['ical:a'], 10 * 60)
+        self.assertEqual(stage.next_due['ical:a'], 7 * 60)
+
+        # polled at least in the regular interval, the wakeup before the boundary fetches it in time
+        stage._schedule_next_poll('ical:a', source, False, 0.0, 2 * 60)
+        self.assertEqual(stage.next_due['ical:a'], 5 * 60)
+
+        stage._schedule_next_poll('ical:a', source, False, 0.0, 90 * 60)
+        self.assertEqual(stage.next_due['ical:a'], 40 * 60)
+
+    def test_shared_events_are_named_as_in_the_home(self):
+        shared_events = create_events('ical:https://example.org/hall.ics')
+        source = Source({ 'Hall', 'Main hall' }, 1.0, lambda: None, 15,
+                        shared_names = { 'Hall': 'ical:https://example.org/hall.ics', 'Main hall': 'ical:https://example.org/hall.ics' })
+
+        events = source.select(shared_events)
+
+        self.assertEqual(sorted(events.events), ['Hall', 'Main hall'])
+        self.assertEqual(events.events['Hall'].name, 'Hall')
+
+    def test_resources_are_the_ones_of_the_current_plans_of_all_homes(self):
+        stage = FetchStage()
+
+        self.assertEqual(stage._update_resource_names('a', 'churchtools:https://ct', { 'Hall', 'Chapel' }), { 'Hall', 'Chapel' })
+        self.assertEqual(stage._update_resource_names('b', 'churchtools:https://ct', { 'Office' }), { 'Hall', 'Chapel', 'Office' })
+        # removed from the config of home a
+        self.assertEqual(stage._update_resource_names('a', 'churchtools:https://ct', { 'Hall' }), { 'Hall', 'Office' })
+        # home b does not use ChurchTools anymore
+        stage._update_resource_names('b')
+        self.assertEqual(stage._update_resource_names('a', 'churchtools:https://ct', { 'Hall' }), { 'Hall' })
+
+    def test_resources_not_fetched_for_another_home_are_fetched(self):
+        stage = FetchStage()
+        stage.last_events['churchtools:https://ct'] = (create_events('Hall'), 0.0)
+        stage.next_due['churchtools:https://ct'] = 1000.0
+
+        self.assertFalse(stage._needs_fetch('churchtools:https://ct', Source({ 'Hall' }, 1.0, lambda: None, 15), False, 0.0))
+        self.assertTrue(stage._needs_fetch('churchtools:https://ct', Source({ 'Hall', 'Chapel' }, 1.0, lambda: None, 15), False, 0.0))
+
+
+class BoundaryFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings = CoreSettings(
+            ical_calendars = [{ 'name': name, 'source': os.path.join(self.temp_dir.name, f'{name}.ics'), 'polling_minutes': 60 }
+                              for name in ('Hall', 'Chapel')],
+            heating = { 'warm': 20.0, 'cold': 16.0 },
+            assignments = [{ 'tadozone': 'Hall', 'calendar_names': ['Hall'] },
+                           { 'tadozone': 'Chapel', 'calendar_names': ['Chapel'] }])
+        self.store = SQLiteStore(os.path.join(self.temp_dir.name, 'store'))
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def write_ics(self, name: str, hour: int) -> None:
+        start = datetime.combine(datetime.now().date() + timedelta(days = 1), datetime.min.time()) + timedelta(hours = hour)
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'BEGIN:VEVENT', 'UID:1@example.org',
+                 f'DTSTART:{start.strftime("%Y%m%dT%H%M%S")}', f'DTEND:{(start + timedelta(hours = 2)).strftime("%Y%m%dT%H%M%S")}',
+                 'SUMMARY:Service', 'END:VEVENT', 'END:VCALENDAR']
+        with open(os.path.join(self.temp_dir.name, f'{name}.ics'), 'wb') as stream:
+            stream.write('\r\n'.join(lines).encode('utf-8'))
+
+    def test_sources_of_zones_changing_next_are_fetched_before_the_boundary(self):
+        self.write_ics('Hall', 9)
+        self.write_ics('Chapel', 9)
+        fetch_stage = FetchStage()
+
+        async def execute(message: Message) -> ReplayTadoAdapter:
+            tado = ReplayTadoAdapter({ 'Hall': 1, 'Chapel': 2 })
+            await Worker(self.settings, tado, self.store, fetch_stage = fetch_stage).execute(message)
+            return tado
+
+        asyncio.run(execute(Message(full_update = True)))
+        self.write_ics('Hall', 10)
+        self.write_ics('Chapel', 10)
+        # not just fetched for another home
+        for key in fetch_stage.polled_at:
+            fetch_stage.polled_at[key] -= 120
+
+        self.assertEqual(asyncio.run(execute(Message())).schedules, {})
+        tado = asyncio.run(execute(Message(boundary_zones = { 'Hall' })))
+
+        self.assertEqual(set(zone for zone, _ in tado.schedules), { 'Hall' })
+
+
+if __name__ == '__main__':
+    unittest.main()
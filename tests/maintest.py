@@ -1,5 +1,22 @@
+import os
+import subprocess
+import sys
 import unittest
 
 
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+class MainTest(unittest.TestCase):
+
+    def test_heavy_adapters_are_not_imported_at_startup(self):
+        # in a new interpreter, as other tests import the adapters
+        result = subprocess.run([sys.executable, '-c', 'import main, sys; '
+                                 'print(sorted(m for m in ("churchtools", "icalendar", "requests", "PyTado.interface", "pstats") if m in sys.modules))'],
+                                cwd = SRC_DIR, capture_output = True, text = True, check = True)
+
+        self.assertEqual(result.stdout.strip(), '[]')
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
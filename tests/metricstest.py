@@ -0,0 +1,88 @@
+from aiohttp.test_utils import TestClient, TestServer
+import asyncio
+from services.metrics import Counter, Gauge, Histogram, MAX_PROFILE_RUNS, Registry, Service
+from services.profiler import Profiler
+import tempfile
+import unittest
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter_is_rendered_with_escaped_labels(self):
+        registry = Registry()
+        counter = registry.register(Counter('calls_total', 'Calls.', ('api',)))
+        counter.inc(api = 'tado')
+        counter.inc(2, api = 'say "hi"')
+
+        self.assertEqual(registry.render(),
+                         '# HELP calls_total Calls.\n'
+                         '# TYPE calls_total counter\n'
+                         'calls_total{api="say \\"hi\\""} 2.0\n'
+                         'calls_total{api="tado"} 1.0\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('stage_seconds', 'Stages.', ('stage',), buckets = (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, stage = 'fetch')
+
+        self.assertEqual(histogram.render()[2:], [
+            'stage_seconds_bucket{stage="fetch",le="0.1"} 2',
+            'stage_seconds_bucket{stage="fetch",le="1.0"} 3',
+            'stage_seconds_bucket{stage="fetch",le="+Inf"} 4',
+            'stage_seconds_sum{stage="fetch"} 3.65',
+            'stage_seconds_count{stage="fetch"} 4'])
+
+    def test_collectors_update_gauges_before_rendering(self):
+        registry = Registry()
+        gauge = registry.register(Gauge('queue_depth', 'Depth.', ('home',)))
+        registry.add_collector(lambda: gauge.set(3, home = 'a'))
+
+        self.assertIn('queue_depth{home="a"} 3.0', registry.render())
+
+    def test_unknown_labels_are_rejected(self):
+        with self.assertRaises(ValueError):
+            Counter('calls_total', 'Calls.', ('api',)).inc(zone = 'x')
+
+
+class ServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def post(self, service: Service, path: str, headers: dict = None) -> int:
+        async def post() -> int:
+            async with TestClient(TestServer(service.create_app())) as client:
+                response = await client.post(path, headers = headers)
+                return response.status
+        return asyncio.run(post())
+
+    def test_profile_requires_the_token(self):
+        service = Service(0, registry = Registry(), profiler = self.profiler, token = 'secret')
+
+        self.assertEqual(self.post(service, '/profile?runs=2'), 401)
+        self.assertEqual(self.post(service, '/profile?runs=2&token=wrong'), 401)
+        self.assertEqual(self.profiler.armed_runs, 0)
+
+        self.assertEqual(self.post(service, '/profile?runs=2', { 'Authorization': 'Bearer secret' }), 200)
+        self.assertEqual(self.profiler.armed_runs, 2)
+
+    def test_profile_runs_are_limited(self):
+        service = Service(0, registry = Registry(), profiler = self.profiler, token = 'secret')
+
+        self.assertEqual(self.post(service, f'/profile?runs={MAX_PROFILE_RUNS + 1}&token=secret'), 400)
+        self.assertEqual(self.post(service, '/profile?runs=0&token=secret'), 400)
+        self.assertEqual(self.profiler.armed_runs, 0)
+
+    def test_profile_is_not_served_without_a_token(self):
+        service = Service(0, registry = Registry(), profiler = self.profiler)
+
+        self.assertEqual(self.post(service, '/profile?runs=1'), 404)
+        self.assertEqual(self.profiler.armed_runs, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import time
+from models.settings import CoreSettings
+import os
+from services.core import Service
+from services.plan import ExecutionPlan
+import tempfile
+import unittest
+import yaml
+
+
+SETTINGS = {
+    'schedules': [{ 'name': 'Mass', 'start': '09:00', 'end': '11:00', 'days_of_week': 'Sun' },
+                  { 'name': 'Unused', 'start': '09:00', 'end': '11:00', 'days_of_week': 'Mon-Fri' }],
+    'ical_calendars': [{ 'name': 'Hall', 'source': 'https://example.org/hall.ics' },
+                       { 'name': 'Old hall', 'source': 'https://example.org/old.ics' }],
+    'churchtools': { 'url': 'https://example.church.tools' },
+    'heating': { 'warm': 20.0, 'cold': 16.0, 'earlystart': '00:30' },
+    'assignments': [{ 'tadozone': 'Church', 'calendar_names': ['Mass', 'Chapel'], 'warm': 18.0 },
+                    { 'tadozone': 'Hall', 'calendar_names': ['Hall'], 'earlystart': '01:00' }],
+}
+
+
+class ExecutionPlanTest(unittest.TestCase):
+
+    def test_zones_have_the_heating_defaults_resolved(self):
+        plan = ExecutionPlan(CoreSettings(**SETTINGS))
+
+        self.assertEqual([(z.tadozone, z.warm, z.cold, z.earlystart) for z in plan.zones],
+                         [('Church', 18.0, 16.0, time(0, 30)), ('Hall', 20.0, 16.0, time(1, 0))])
+
+    def test_only_assigned_calendars_are_generated_and_fetched(self):
+        plan = ExecutionPlan(CoreSettings(**SETTINGS))
+
+        self.assertEqual(list(plan.event_generator.active_days), ['Mass'])
+        self.assertEqual(plan.event_generator.active_days['Mass'], { 6 })
+        self.assertEqual([c.name for c in plan.ical_calendars], ['Hall'])
+        self.assertEqual(plan.resource_names, { 'Chapel' })
+        self.assertEqual(plan.get_zone_names({ 'Chapel', 'Old hall' }), { 'Church' })
+
+    def test_unknown_calendar_names_fail_without_churchtools(self):
+        with self.assertRaisesRegex(ValueError, 'Chapel'):
+            ExecutionPlan(CoreSettings(**(SETTINGS | { 'churchtools': None })))
+
+    def test_invalid_days_of_week_fail(self):
+        schedules = [{ 'name': 'Mass', 'start': '09:00', 'end': '11:00', 'days_of_week': 'Sun,Sny' }]
+
+        with self.assertRaisesRegex(ValueError, 'Sny'):
+            ExecutionPlan(CoreSettings(**(SETTINGS | { 'schedules': schedules })))
+
+    def test_plan_is_compiled_again_only_when_the_config_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config_file = os.path.join(temp_dir, 'config.yaml')
+            with open(config_file, 'w', encoding='utf-8') as stream:
+                yaml.safe_dump(SETTINGS, stream)
+            service = Service(config_file, asyncio.Queue(), None, None)
+
+            plan = service.load_plan()
+            self.assertIs(service.load_plan(), plan)
+
+            with open(config_file, 'w', encoding='utf-8') as stream:
+                yaml.safe_dump(SETTINGS | { 'polling_minutes': 5 }, stream)
+            changed_plan = service.load_plan()
+            self.assertEqual(changed_plan.settings.polling_minutes, 5)
+            # a change reported by the file watcher is compiled anyway
+            self.assertIsNot(service.load_plan(True), changed_plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+from adapter import codec
+from adapter.ical_retriever import get_events_from_ics, parse_ics_events
+from datetime import date, datetime, time, timedelta
+from dateutil import tz
+from icalendar import Calendar
+from models.events import Event
+from models.schedules import get_weekly_schedules
+from services.pool import create_executor, generate_daily_schedules
+import unittest
+
+
+ICS = b'''BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+UID:1
+DTSTART:20251117T100000
+DTEND:20251117T120000
+SUMMARY:Gottesdienst
+END:VEVENT
+BEGIN:VEVENT
+UID:2
+DTSTART:20251119T180000
+DTEND:20251119T193000
+SUMMARY:Chorprobe
+END:VEVENT
+BEGIN:VEVENT
+UID:3
+DTSTART:20251201T180000
+DTEND:20251201T193000
+SUMMARY:Next month
+END:VEVENT
+END:VCALENDAR
+'''
+
+
+def create_events() -> list[Event]:
+    start = datetime(2025, 11, 17, 8, 0, tzinfo = tz.tzlocal())
+    return [Event(start = start + timedelta(hours = n * 9), end = start + timedelta(hours = n * 9 + 2), name = f'Booking {n}')
+            for n in range(0, 20)]
+
+
+class PoolTest(unittest.TestCase):
+
+    def test_parsed_events_equal_the_ones_parsed_in_process(self):
+        expected = [e for e in get_events_from_ics(Calendar.from_ical(ICS)) if e.start.date() <= date(2025, 11, 23)]
+
+        events = [codec.decode_event(e) for e in parse_ics_events(ICS, date(2025, 11, 17), date(2025, 11, 23))]
+
+        self.assertEqual(events, expected)
+        self.assertEqual(len(events), 2)
+
+    def test_schedules_generated_in_worker_process_equal_the_ones_generated_in_process(self):
+        events = create_events()
+        expected = get_weekly_schedules(date(2025, 11, 17), events, 20.0, 16.0, time(0, 30))
+
+        executor = create_executor(1)
+        try:
+            encoded = executor.submit(generate_daily_schedules, [codec.encode_event(e) for e in events],
+                                      date(2025, 11, 17), 20.0, 16.0, time(0, 30)).result()
+        finally:
+            executor.shutdown()
+
+        self.assertEqual([codec.decode_daily_schedule(s) for s in encoded], expected)
+
+    def test_no_executor_without_worker_processes(self):
+        self.assertIsNone(create_executor(None))
+        self.assertIsNone(create_executor(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
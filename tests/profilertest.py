@@ -0,0 +1,56 @@
+import asyncio
+import os
+from services.profiler import Profiler, get_stage
+import tempfile
+import unittest
+
+
+def generate_schedules_for_all_zones() -> int:
+    # named like the stage function, which the sampler finds in core.py only
+    return sum(i * i for i in range(0, 200000))
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_innermost_stage_wins(self):
+        stack = (('main.py', 'main'), ('fetch.py', 'fetch'), ('ical_retriever.py', 'retrieve_calendar_events'),
+                 ('ical_retriever.py', 'get_events_from_ics'), ('cal.py', 'from_ical'))
+
+        self.assertEqual(get_stage(stack), 'parse')
+        self.assertEqual(get_stage((('base_events.py', 'run_forever'), ('selectors.py', 'select'))), 'idle')
+        self.assertEqual(get_stage((('main.py', 'main'),)), 'other')
+
+    def test_unarmed_profiler_writes_nothing(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profiler = Profiler(temp_dir)
+
+            async def run() -> None:
+                async with profiler.profile():
+                    generate_schedules_for_all_zones()
+
+            asyncio.run(run())
+
+            self.assertEqual(os.listdir(temp_dir), [])
+
+    def test_armed_profiler_profiles_the_given_number_of_runs(self):
+        for mode, extension in (('sampling', '.folded'), ('deterministic', '.prof')):
+            with self.subTest(mode = mode), tempfile.TemporaryDirectory() as temp_dir:
+                profiler = Profiler(temp_dir, mode, interval = 0.001)
+                profiler.arm(1)
+
+                async def run() -> None:
+                    for _ in range(0, 2):
+                        async with profiler.profile('home'):
+                            generate_schedules_for_all_zones()
+                            await asyncio.sleep(0.01)
+
+                asyncio.run(run())
+
+                files = sorted(os.listdir(temp_dir))
+                self.assertEqual(len(files), 2)
+                self.assertTrue(files[0].startswith('profile-home-'))
+                self.assertEqual({ os.path.splitext(f)[1] for f in files }, { extension, '.txt' })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+from adapter.pushscheduler import PushScheduler, get_first_change
+from datetime import datetime, time
+from models.schedules import Block, DailySchedule
+from models.settings import TadoSettings
+import unittest
+
+
+def create_schedule(start: time, end: time) -> DailySchedule:
+    schedule = DailySchedule(blocks = { time.min: Block(temperature = 17.0) })
+    schedule.insert_block(Block(start = start, end = end, temperature = 21.0))
+    return schedule
+
+
+# a Wednesday
+NOW = datetime(2025, 11, 19, 10, 0)
+WEDNESDAY = 2
+
+
+class GetFirstChangeTest(unittest.TestCase):
+
+    def test_unknown_current_schedule_changes_immediately(self):
+        self.assertEqual(get_first_change(None, create_schedule(time(8), time(12)), time(10)), time(10))
+
+    def test_equal_schedules_have_no_change(self):
+        self.assertIsNone(get_first_change(create_schedule(time(8), time(12)), create_schedule(time(8), time(12))))
+
+    def test_first_change_is_found(self):
+        self.assertEqual(get_first_change(create_schedule(time(8), time(12)), create_schedule(time(8), time(14))), time(12))
+
+    def test_changes_before_not_before_are_ignored(self):
+        self.assertIsNone(get_first_change(create_schedule(time(8), time(9)), create_schedule(time(7), time(9)), time(10)))
+
+
+class PushSchedulerTest(unittest.TestCase):
+
+    def test_writes_are_ordered_by_the_time_they_take_effect(self):
+        scheduler = PushScheduler(NOW)
+        current = create_schedule(time(8), time(12))
+        changed = create_schedule(time(8), time(20))
+
+        writes = scheduler.order([
+            scheduler.create_pending_write('Hall', 1, WEDNESDAY - 1, changed, current), # next Tuesday
+            scheduler.create_pending_write('Hall', 1, WEDNESDAY + 1, changed, current), # tomorrow
+            scheduler.create_pending_write('Office', 2, WEDNESDAY, changed, current),   # today 12:00
+            scheduler.create_pending_write('Office', 2, WEDNESDAY + 2, changed, None),  # Friday 0:00
+        ])
+
+        self.assertEqual([(w.zone_name, w.weekday) for w in writes],
+                         [('Office', WEDNESDAY), ('Hall', WEDNESDAY + 1), ('Office', WEDNESDAY + 2), ('Hall', WEDNESDAY - 1)])
+
+    def test_changes_in_the_past_hours_of_today_take_effect_next_week(self):
+        scheduler = PushScheduler(NOW)
+        write = scheduler.create_pending_write('Hall', 1, WEDNESDAY, create_schedule(time(7), time(9)), create_schedule(time(8), time(9)))
+
+        self.assertEqual(write.takes_effect_at, datetime(2025, 11, 26))
+        self.assertFalse(scheduler.is_urgent(write))
+
+    def test_only_urgent_writes_are_sent_when_the_budget_is_exhausted(self):
+        scheduler = PushScheduler(NOW, TadoSettings(max_writes_per_run = 1))
+        writes = [scheduler.create_pending_write('Hall', 1, weekday, create_schedule(time(8), time(12)), None)
+                  for weekday in range(0, 7)]
+
+        sent = [w.weekday for w in scheduler.order(writes) if scheduler.may_send(w)]
+
+        self.assertEqual(sent, [WEDNESDAY, WEDNESDAY + 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+from adapter.sqlitestore import SQLiteStore
+from datetime import datetime, timedelta
+from models.settings import CoreSettings
+import os
+from services.core import Message, Worker
+from services.recording import Recorder, Recording, ReplayTadoAdapter, anonymize_ics, replay
+import tempfile
+import unittest
+
+
+def create_ics(from_date) -> bytes:
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'X-WR-CALNAME:Parish Hall']
+    for day in range(0, 7):
+        start = datetime.combine(from_date + timedelta(days = day), datetime.min.time()) + timedelta(hours = 9 + day)
+        lines += ['BEGIN:VEVENT', f'UID:{day}@parish.example', f'DTSTART:{start.strftime("%Y%m%dT%H%M%S")}',
+                  f'DTEND:{(start + timedelta(hours = 2)).strftime("%Y%m%dT%H%M%S")}',
+                  f'SUMMARY:Choir rehearsal with Jane Doe', 'DESCRIPTION:Contact jane@example.org,',
+                  ' call 0123 456', 'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines).encode('utf-8')
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ics_file = os.path.join(self.temp_dir.name, 'hall.ics')
+        with open(self.ics_file, 'wb') as stream:
+            stream.write(create_ics(datetime.now().date()))
+        self.settings = CoreSettings(
+            ical_calendars = [{ 'name': 'Hall', 'source': self.ics_file }],
+            heating = { 'warm': 20.0, 'cold': 16.0, 'earlystart': '00:30' },
+            assignments = [{ 'tadozone': 'Parish Hall', 'calendar_names': ['Hall'] }])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def record(self, anonymized: bool = False) -> tuple[Recording, ReplayTadoAdapter]:
+        output_dir = os.path.join(self.temp_dir.name, 'recordings')
+        recorder = Recorder(output_dir)
+        recorder.arm(1, anonymized)
+        tado = ReplayTadoAdapter({ 'Parish Hall': 3 })
+        store = SQLiteStore(os.path.join(self.temp_dir.name, 'store'))
+        message = Message(full_update = True)
+
+        async def run() -> None:
+            async with recorder.record(message, self.settings, tado):
+                await Worker(self.settings, tado, store).execute(message)
+
+        try:
+            asyncio.run(run())
+        finally:
+            store.close()
+        file_names = os.listdir(output_dir)
+        self.assertEqual(len(file_names), 1)
+        return (Recording.load(os.path.join(output_dir, file_names[0])), tado)
+
+    def test_replay_sends_the_recorded_schedules_offline(self):
+        recording, recorded_tado = self.record()
+        os.remove(self.ics_file)
+
+        replayed_tado = asyncio.run(replay(recording))
+
+        self.assertEqual(len(recorded_tado.schedules), 7)
+        self.assertEqual(replayed_tado.schedules, recorded_tado.schedules)
+
+    def test_anonymized_recording_replays_the_same_schedules_without_names(self):
+        recording, recorded_tado = self.record(anonymized = True)
+
+        replayed_tado = asyncio.run(replay(recording))
+
+        self.assertEqual(recording.zone_ids, { 'Zone 1': 3 })
+        self.assertEqual(list(replayed_tado.schedules), [('Zone 1', weekday) for (_, weekday) in recorded_tado.schedules])
+        self.assertEqual(list(replayed_tado.schedules.values()), list(recorded_tado.schedules.values()))
+        data = recording.get('ical', 'calendar-1.ics')
+        for name in (b'Jane', b'jane', b'0123', b'Parish', b'parish'):
+            self.assertNotIn(name, data)
+        self.assertNotIn(self.ics_file, str(recording.settings))
+
+    def test_anonymize_ics_drops_folded_lines_of_removed_properties(self):
+        data = b'BEGIN:VEVENT\r\nSUMMARY:Secret\r\nDESCRIPTION:a\r\n b\r\nDTSTART:20251117T090000\r\nEND:VEVENT\r\n'
+
+        self.assertEqual(anonymize_ics(data), b'BEGIN:VEVENT\r\nSUMMARY:Event 1\r\nDTSTART:20251117T090000\r\nEND:VEVENT\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
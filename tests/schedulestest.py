@@ -1,4 +1,6 @@
-from datetime import time
+from datetime import date, datetime, time
+from dateutil import tz
+from models.events import Event
 from models.schedules import Block, DailySchedule
 import unittest
 
@@ -181,4 +183,44 @@ class DailyScheduleTest(unittest.TestCase):
         self.assertEqual(schedule.blocks[time.min], Block(end = time(8), temperature = 0.0))
         self.assertEqual(schedule.blocks[time(8)], Block(start = time(8), end = time(15), temperature = 15.0))
         self.assertEqual(schedule.blocks[time(15)], Block(start = time(15), end = time.min, temperature = 0.0))
+
+    def test_insert_block_overlapping_block_until_midnight_with_same_temperature_gets_merged(self):
+        schedule = DailySchedule()
+        schedule.insert_block(Block(start = time(23), end = time.min, temperature = 15.0))
+        schedule.insert_block(Block(start = time(22), end = time(23, 5), temperature = 15.0))
+
+        self.assertEqual(list(schedule.blocks), [time.min, time(22)])
+
+        self.assertEqual(schedule.blocks[time.min], Block(end = time(22), temperature = 0.0))
+        self.assertEqual(schedule.blocks[time(22)], Block(start = time(22), end = time.min, temperature = 15.0))
+
+    def test_insert_block_until_midnight_over_blocks_with_same_temperature_gets_merged(self):
+        schedule = DailySchedule()
+        schedule.insert_block(Block(start = time(20), end = time(21), temperature = 15.0))
+        schedule.insert_block(Block(start = time(22), end = time(23), temperature = 15.0))
+        schedule.insert_block(Block(start = time(20, 30), end = time.min, temperature = 15.0))
+
+        self.assertEqual(list(schedule.blocks), [time.min, time(20)])
+        self.assertEqual(schedule.blocks[time(20)], Block(start = time(20), end = time.min, temperature = 15.0))
         
+
+    # from_events
+
+    def test_from_events_splits_event_at_local_midnight(self):
+        event = Event(start = datetime(2025, 11, 17, 23, 15, tzinfo = tz.tzlocal()),
+                      end = datetime(2025, 11, 18, 0, 20, tzinfo = tz.tzlocal()), name = 'Late')
+
+        monday = DailySchedule.from_events(date(2025, 11, 17), [event], 20.0, 16.0)
+        tuesday = DailySchedule.from_events(date(2025, 11, 18), [event], 20.0, 16.0)
+
+        self.assertEqual(list(monday.blocks.values())[-1], Block(start = time(23, 15), end = time.min, temperature = 20.0))
+        self.assertEqual(list(tuesday.blocks.values())[0], Block(end = time(0, 20), temperature = 20.0))
+
+    def test_from_events_merges_events_following_each_other(self):
+        first = Event(start = datetime(2025, 11, 17, 9, tzinfo = tz.tzlocal()), end = datetime(2025, 11, 17, 12, tzinfo = tz.tzlocal()), name = 'First')
+        second = Event(start = datetime(2025, 11, 17, 12, tzinfo = tz.tzlocal()), end = datetime(2025, 11, 17, 14, tzinfo = tz.tzlocal()), name = 'Second')
+
+        schedule = DailySchedule.from_events(date(2025, 11, 17), [first, second], 20.0, 16.0)
+
+        self.assertEqual(list(schedule.blocks), [time.min, time(9), time(14)])
+        self.assertEqual(schedule, DailySchedule.from_events(date(2025, 11, 17), [second, first], 20.0, 16.0))
@@ -0,0 +1,127 @@
+from adapter.sqlitestore import SQLiteStore
+from datetime import datetime, timedelta, timezone
+from dateutil import tz
+from models.events import AllCalendarEvents, CalendarEvents, Event
+import asyncio
+import tempfile
+import unittest
+
+
+START = datetime(2025, 11, 17, 10, 0, tzinfo = tz.tzutc())
+
+
+def create_all_events(name: str, count: int) -> AllCalendarEvents:
+    events = [Event(start = START + timedelta(days = n), end = START + timedelta(days = n, hours = 2), name = f'Event {n}')
+              for n in range(0, count)]
+    all_events = AllCalendarEvents()
+    all_events.events[name] = CalendarEvents(name = name, events = events)
+    return all_events
+
+
+class SQLiteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = SQLiteStore(self.temp_dir.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_new_calendar_has_updates(self):
+        self.assertEqual(self.store.update_calendar_events(create_all_events('Hall', 3), 'ical'), {'Hall'})
+
+    def test_unchanged_calendar_has_no_updates(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+
+        self.assertEqual(self.store.update_calendar_events(create_all_events('Hall', 3), 'ical'), set())
+
+    def test_reordered_events_have_no_updates(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        all_events = create_all_events('Hall', 3)
+        all_events.events['Hall'].events.reverse()
+
+        self.assertEqual(self.store.update_calendar_events(all_events, 'ical'), set())
+
+    def test_events_in_other_time_zone_have_no_updates(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        all_events = create_all_events('Hall', 3)
+        for e in all_events.events['Hall'].events:
+            e.start = e.start.astimezone(timezone(timedelta(hours = 1)))
+
+        self.assertEqual(self.store.update_calendar_events(all_events, 'ical'), set())
+
+    def test_duplicated_event_is_an_update(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        all_events = create_all_events('Hall', 3)
+        all_events.events['Hall'].events.append(all_events.events['Hall'].events[0])
+
+        self.assertEqual(self.store.update_calendar_events(all_events, 'ical'), {'Hall'})
+
+    def test_changed_events_are_stored(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        all_events = create_all_events('Hall', 3)
+        all_events.events['Hall'].events[1].name = 'Changed'
+
+        self.assertEqual(self.store.update_calendar_events(all_events, 'ical'), {'Hall'})
+        self.assertEqual(self.store.read_calendar_events(source = 'ical'), all_events)
+
+    def test_moved_added_and_removed_events_are_read_after_a_restart(self):
+        self.store.update_calendar_events(create_all_events('Hall', 5), 'ical')
+        all_events = create_all_events('Hall', 6)
+        events = all_events.events['Hall'].events
+        events[0:3] = [events[2], events[5], events[0], events[0]]
+        del events[-2]
+        self.store.update_calendar_events(all_events, 'ical')
+        self.store.close()
+
+        self.store = SQLiteStore(self.temp_dir.name)
+
+        # in the order of their keys
+        read_events = self.store.read_calendar_events(source = 'ical').events['Hall'].events
+        self.assertEqual(sorted(e.model_dump_json() for e in read_events), sorted(e.model_dump_json() for e in events))
+        self.assertEqual(self.store.update_calendar_events(all_events, 'ical'), set())
+
+    def test_event_inserted_at_the_front_writes_a_single_row(self):
+        self.store.update_calendar_events(create_all_events('Hall', 20), 'ical')
+        all_events = create_all_events('Hall', 20)
+        all_events.events['Hall'].events.insert(0, Event(start = START - timedelta(days = 1), end = START, name = 'Early'))
+        changes = self.store.connection.total_changes
+
+        self.store.update_calendar_events(all_events, 'ical')
+
+        # the row of the calendar and the row of the event
+        self.assertEqual(self.store.connection.total_changes - changes, 2)
+
+    def test_calendars_not_given_anymore_are_removed(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        self.store.update_calendar_events(create_all_events('Room', 1), 'churchtools')
+        self.store.update_calendar_events(AllCalendarEvents(), 'ical')
+
+        self.assertEqual(list(self.store.read_calendar_events().events), ['Room'])
+
+    def test_steady_state_does_not_read_the_database(self):
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        statements = []
+        self.store.connection.set_trace_callback(statements.append)
+
+        self.store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+        self.store.read_calendar_events(source = 'ical')
+
+        self.assertFalse([s for s in statements if s.startswith('SELECT')])
+
+    def test_changes_are_written_behind(self):
+        store = SQLiteStore(self.temp_dir.name, 'delayed.sqlite', flush_delay_seconds = 60)
+
+        async def update() -> None:
+            store.update_calendar_events(create_all_events('Hall', 3), 'ical')
+            self.assertEqual(SQLiteStore(self.temp_dir.name, 'delayed.sqlite').read_calendar_events().events, {})
+            store.close()
+
+        asyncio.run(update())
+
+        self.assertEqual(list(SQLiteStore(self.temp_dir.name, 'delayed.sqlite').read_calendar_events().events), ['Hall'])
+
+
+if __name__ == '__main__':
+    unittest.main()
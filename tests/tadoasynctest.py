@@ -0,0 +1,233 @@
+import aiohttp
+from adapter.tado_async import AsyncTadoAdapter, TADO_API_URL, TADO_TOKEN_URL
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+import json
+from models.schedules import Block, DailySchedule
+import os
+import tempfile
+import unittest
+
+
+class FakeResponse:
+
+    def __init__(self, status: int, data = None):
+        self.status = status
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def json(self, content_type = 'application/json'):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status = self.status)
+
+
+class FakeTadoSession:
+    """Answers like the tado° token endpoint and API, counting the token refreshes.
+    """
+
+    def __init__(self, zones: list[dict] = None):
+        self.refresh_tokens = { 'refresh-0' }
+        self.access_tokens = set()
+        self.refreshes = 0
+        self.zones = zones or [{ 'id': 1, 'name': 'Hall' }, { 'id': 2, 'name': 'Chapel' }]
+        self.zone_requests = 0
+        self.requests = []
+
+    def revoke_access_tokens(self):
+        self.access_tokens.clear()
+
+    def post(self, url: str, params: dict = None):
+        assert url == TADO_TOKEN_URL and params['grant_type'] == 'refresh_token'
+        if params['refresh_token'] not in self.refresh_tokens:
+            return FakeResponse(400, { 'error': 'invalid_grant' })
+
+        self.refreshes += 1
+        self.refresh_tokens = { f'refresh-{self.refreshes}' }
+        self.access_tokens.add(f'access-{self.refreshes}')
+        return FakeResponse(200, { 'access_token': f'access-{self.refreshes}', 'refresh_token': f'refresh-{self.refreshes}',
+                                   'expires_in': 600 })
+
+    def request(self, method: str, url: str, json = None, headers: dict = None):
+        if headers['Authorization'].removeprefix('Bearer ') not in self.access_tokens:
+            return FakeResponse(401)
+
+        command = url.removeprefix(TADO_API_URL)
+        self.requests.append((method, command, json))
+        if command == 'me':
+            return FakeResponse(200, { 'homes': [{ 'id': 7 }] })
+        if command == 'homes/7':
+            return FakeResponse(200, { 'id': 7, 'generation': 'PRE_LINE_X' })
+        if command == 'homes/7/zones':
+            self.zone_requests += 1
+            return FakeResponse(200, self.zones)
+        if method == 'PUT':
+            return FakeResponse(200, json)
+        return FakeResponse(404)
+
+    async def close(self):
+        pass
+
+
+class FakeSessionTadoAdapter(AsyncTadoAdapter):
+
+    def __init__(self, data_dir: str, session: FakeTadoSession):
+        super().__init__(data_dir)
+        self.fake_session = session
+
+    def _create_session(self):
+        return self.fake_session
+
+
+class AsyncTadoAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.session = FakeTadoSession()
+        self.write_json('tado_refresh_token.json', { 'refresh_token': 'refresh-0' })
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_json(self, file_name: str, data):
+        with open(os.path.join(self.temp_dir.name, file_name), 'w', encoding = 'utf-8') as stream:
+            json.dump(data, stream)
+
+    def read_json(self, file_name: str):
+        with open(os.path.join(self.temp_dir.name, file_name), 'r', encoding = 'utf-8') as stream:
+            return json.load(stream)
+
+    def run_connected(self, coroutine_function):
+        async def run():
+            tado = FakeSessionTadoAdapter(self.temp_dir.name, self.session)
+            await tado.connect()
+            try:
+                return await coroutine_function(tado)
+            finally:
+                await tado.close()
+        return asyncio.run(run())
+
+    def test_connect_refreshes_and_persists_the_token(self):
+        async def connected(tado):
+            return tado.access_token, tado.home_id, tado.zone_ids
+
+        access_token, home_id, zone_ids = self.run_connected(connected)
+
+        self.assertEqual(access_token, 'access-1')
+        self.assertEqual(home_id, 7)
+        self.assertEqual(zone_ids, { 'Hall': 1, 'Chapel': 2 })
+        self.assertEqual(self.read_json('tado_refresh_token.json'), { 'refresh_token': 'refresh-1' })
+        self.assertEqual(self.read_json('tado_zones.json'), { 'Hall': 1, 'Chapel': 2 })
+
+    def test_failed_connect_is_retried(self):
+        post = self.session.post
+        failures = []
+
+        def fail_once(url: str, params: dict = None):
+            if not failures:
+                failures.append(url)
+                raise aiohttp.ClientConnectionError('tado° not reachable')
+            return post(url, params)
+
+        self.session.post = fail_once
+
+        async def connect():
+            tado = FakeSessionTadoAdapter(self.temp_dir.name, self.session)
+            tado.connect_retry_seconds = 0
+            await tado.connect()
+            return tado.connected.is_set(), tado.access_token
+
+        with self.assertLogs('adapter.tado_async', 'ERROR'):
+            self.assertEqual(asyncio.run(connect()), (True, 'access-1'))
+        self.assertEqual(failures, [TADO_TOKEN_URL])
+
+    def test_persisted_token_is_used_by_the_next_connect(self):
+        async def connected(tado):
+            pass
+
+        self.run_connected(connected)
+        self.run_connected(connected)
+
+        self.assertEqual(self.session.refreshes, 2)
+        self.assertEqual(self.read_json('tado_refresh_token.json'), { 'refresh_token': 'refresh-2' })
+
+    def test_expired_access_token_is_refreshed_before_the_request(self):
+        async def expire_and_request(tado):
+            tado.refresh_at = datetime.now(timezone.utc) - timedelta(seconds = 1)
+            await tado._request('GET', 'me')
+            return tado.access_token
+
+        self.assertEqual(self.run_connected(expire_and_request), 'access-2')
+        self.assertEqual(self.read_json('tado_refresh_token.json'), { 'refresh_token': 'refresh-2' })
+
+    def test_rejected_access_token_is_refreshed_and_the_request_retried(self):
+        async def revoke_and_request(tado):
+            self.session.revoke_access_tokens()
+            return await tado._request('GET', 'me')
+
+        self.assertEqual(self.run_connected(revoke_and_request), { 'homes': [{ 'id': 7 }] })
+        self.assertEqual(self.session.refreshes, 2)
+        self.assertEqual(self.read_json('tado_refresh_token.json'), { 'refresh_token': 'refresh-2' })
+
+    def test_concurrently_rejected_requests_refresh_the_token_once(self):
+        async def revoke_and_request(tado):
+            self.session.revoke_access_tokens()
+            await asyncio.gather(*[tado._request('GET', 'me') for _ in range(0, 4)])
+
+        self.run_connected(revoke_and_request)
+
+        self.assertEqual(self.session.refreshes, 2)
+
+    def test_request_rejected_again_after_the_refresh_fails(self):
+        async def reject_and_request(tado):
+            self.session.access_tokens = set()
+            self.session.post = lambda url, params = None: FakeResponse(200, { 'access_token': 'revoked', 'refresh_token': 'refresh-x' })
+            await tado._request('GET', 'me')
+
+        with self.assertRaises(aiohttp.ClientResponseError) as context:
+            self.run_connected(reject_and_request)
+        self.assertEqual(context.exception.status, 401)
+
+    def test_set_schedule_for_zone_and_day_sends_the_blocks_of_the_day(self):
+        schedule = DailySchedule(blocks = { time.min: Block(temperature = 0.0) })
+        schedule.insert_block(Block(start = time(8), end = time(12, 30), temperature = 20.0))
+
+        async def send(tado):
+            await tado.set_schedule_for_zone_and_day('Hall', 1, 2, schedule)
+
+        self.run_connected(send)
+
+        method, command, payload = self.session.requests[-1]
+        self.assertEqual((method, command), ('PUT', 'homes/7/zones/1/schedule/timetables/2/blocks/WED'))
+        self.assertEqual([(b['dayType'], b['start'], b['end']) for b in payload],
+                         [('WED', '00:00', '08:00'), ('WED', '08:00', '12:30'), ('WED', '12:30', '00:00')])
+        self.assertEqual(payload[0]['setting'], { 'type': 'HEATING', 'power': 'OFF', 'temperature': None })
+        self.assertEqual(payload[1]['setting'], { 'type': 'HEATING', 'power': 'ON',
+                                                  'temperature': { 'celsius': 20.0, 'fahrenheit': 68.0 } })
+
+    def test_unknown_zone_is_looked_up_after_refreshing_the_zones(self):
+        self.write_json('tado_zones.json', { 'Hall': 1 })
+
+        async def lookup(tado):
+            self.session.zones.append({ 'id': 3, 'name': 'Office' })
+            return await asyncio.gather(tado.get_zone_id('Office'), tado.get_zone_id('Office'), tado.get_zone_name(3))
+
+        self.assertEqual(self.run_connected(lookup), [3, 3, 'Office'])
+        self.assertEqual(self.session.zone_requests, 1)
+        self.assertEqual(self.read_json('tado_zones.json'), { 'Hall': 1, 'Chapel': 2, 'Office': 3 })
+
+    def test_zone_missing_in_tado_raises_after_refreshing_the_zones(self):
+        async def lookup(tado):
+            return await tado.get_zone_id('Office')
+
+        with self.assertRaises(KeyError):
+            self.run_connected(lookup)
+        # once by connect, as no zones were saved, and once by the lookup
+        self.assertEqual(self.session.zone_requests, 2)
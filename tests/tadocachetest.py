@@ -0,0 +1,107 @@
+from adapter.pushscheduler import PushScheduler
+from adapter.sqlitestore import SQLiteStore
+from adapter.tadocache import CachingTadoAdapter
+from datetime import time
+from models.schedules import Block, DailySchedule
+from models.settings import TadoSettings
+from models.tadoschedules import HomeSchedules, ZoneSchedules
+import asyncio
+import tempfile
+import unittest
+
+
+class FakeTadoAdapter:
+
+    def __init__(self, fail_after: int = None):
+        self.sent = []
+        self.fail_after = fail_after
+
+    def set_schedule_for_zone_and_day(self, zone_name, zone_id, weekday, schedule):
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise ConnectionError('tado° not reachable')
+        self.sent.append((zone_name, weekday))
+
+    def set_timetable_for_zone(self, zone_name, zone_id):
+        pass
+
+
+def create_home_schedules(temperature: float) -> HomeSchedules:
+    home_schedules = HomeSchedules()
+    for zone_id, name in enumerate(['Hall', 'Office']):
+        schedules = []
+        for weekday in range(0, 7):
+            schedule = DailySchedule(blocks = { time.min: Block(temperature = 0.0) })
+            schedule.insert_block(Block(start = time(8), end = time(12), temperature = temperature))
+            schedules.append(schedule)
+        home_schedules.insert(ZoneSchedules(name = name, id = zone_id, daily_schedules = schedules))
+    return home_schedules
+
+
+class CachingTadoAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = SQLiteStore(self.temp_dir.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_unchanged_schedules_are_not_sent_again(self):
+        asyncio.run(CachingTadoAdapter(FakeTadoAdapter(), self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        tado = FakeTadoAdapter()
+        asyncio.run(CachingTadoAdapter(tado, self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        self.assertEqual(tado.sent, [])
+
+    def test_retry_after_partial_failure_sends_only_remaining_days(self):
+        failing_tado = FakeTadoAdapter(fail_after = 10)
+        with self.assertRaises(ConnectionError):
+            asyncio.run(CachingTadoAdapter(failing_tado, self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+        self.assertEqual(len(failing_tado.sent), 10)
+
+        tado = FakeTadoAdapter()
+        asyncio.run(CachingTadoAdapter(tado, self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        self.assertEqual(len(tado.sent), 4)
+        self.assertFalse(set(tado.sent) & set(failing_tado.sent))
+
+    def test_full_update_sends_all_days(self):
+        asyncio.run(CachingTadoAdapter(FakeTadoAdapter(), self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        tado = FakeTadoAdapter()
+        asyncio.run(CachingTadoAdapter(tado, self.store, full_update = True).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        self.assertEqual(len(tado.sent), 14)
+
+    def test_days_deferred_by_a_full_update_are_sent_by_the_next_run(self):
+        asyncio.run(CachingTadoAdapter(FakeTadoAdapter(), self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+        push_scheduler = PushScheduler(settings = TadoSettings(max_writes_per_run = 0))
+
+        tado = FakeTadoAdapter()
+        asyncio.run(CachingTadoAdapter(tado, self.store, True, push_scheduler).set_schedules_for_all_zones(create_home_schedules(20.0)))
+        # none is urgent, as tado° knows the schedules already
+        self.assertEqual(tado.sent, [])
+        self.assertEqual(len(self.store.read_deferred_zone_days()), 14)
+
+        # the deferred days are kept across a restart, although their schedules equal the stored ones
+        self.store.close()
+        self.store = SQLiteStore(self.temp_dir.name)
+        tado = FakeTadoAdapter()
+        asyncio.run(CachingTadoAdapter(tado, self.store).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        self.assertEqual(len(tado.sent), 14)
+        self.assertEqual(self.store.read_deferred_zone_days(), set())
+
+    def test_days_not_sent_due_to_a_failure_are_kept(self):
+        failing_tado = FakeTadoAdapter(fail_after = 10)
+        with self.assertRaises(ConnectionError):
+            asyncio.run(CachingTadoAdapter(failing_tado, self.store, True).set_schedules_for_all_zones(create_home_schedules(20.0)))
+
+        self.assertEqual(len(self.store.read_deferred_zone_days()), 4)
+        self.assertFalse(self.store.read_deferred_zone_days() & set(failing_tado.sent))
+
+
+if __name__ == '__main__':
+    unittest.main()
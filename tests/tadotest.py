@@ -0,0 +1,112 @@
+from adapter.tado import TadoAdapter
+from adapter.tado_async import AsyncTadoAdapter
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+
+class FakeTado:
+
+    def __init__(self, zones: list[dict]):
+        self.zones = zones
+        self.threads = []
+
+    def get_zones(self) -> list[dict]:
+        self.threads.append(threading.get_ident())
+        return self.zones
+
+
+class TadoAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, file_name: str, text: str):
+        with open(os.path.join(self.temp_dir.name, file_name), 'w', encoding = 'utf-8') as stream:
+            stream.write(text)
+
+    def test_zone_map_round_trip(self):
+        TadoAdapter(self.temp_dir.name)._write_zone_ids_to_file({ 'Hall': 1, 'Chapel': 2 })
+
+        tado = TadoAdapter(self.temp_dir.name)
+
+        self.assertEqual(tado.zone_ids, { 'Hall': 1, 'Chapel': 2 })
+        self.assertEqual(tado.zone_names, { 1: 'Hall', 2: 'Chapel' })
+
+    def test_missing_zone_map_is_empty(self):
+        self.assertEqual(TadoAdapter(os.path.join(self.temp_dir.name, 'missing')).zone_ids, {})
+
+    def test_corrupt_zone_map_is_empty(self):
+        self.write_file('tado_zones.json', '{ "Hall": 1, ')
+
+        with self.assertLogs('adapter.tado', 'ERROR'):
+            self.assertEqual(TadoAdapter(self.temp_dir.name).zone_ids, {})
+
+    def test_failed_write_keeps_the_previous_zone_map(self):
+        TadoAdapter(self.temp_dir.name)._write_zone_ids_to_file({ 'Hall': 1 })
+
+        with mock.patch('os.replace', side_effect = OSError('disk full')), self.assertLogs('adapter.tado', 'WARNING'):
+            TadoAdapter(self.temp_dir.name)._write_zone_ids_to_file({ 'Hall': 1, 'Chapel': 2 })
+
+        self.assertEqual(TadoAdapter(self.temp_dir.name).zone_ids, { 'Hall': 1 })
+        self.assertEqual(os.listdir(self.temp_dir.name), ['tado_zones.json'])
+
+    def test_refresh_token_round_trip(self):
+        AsyncTadoAdapter(self.temp_dir.name)._write_refresh_token_to_file('refresh-1')
+
+        self.assertEqual(AsyncTadoAdapter(self.temp_dir.name)._read_refresh_token_from_file(), 'refresh-1')
+        # the format PyTado reads
+        with open(os.path.join(self.temp_dir.name, 'tado_refresh_token.json'), 'r', encoding = 'utf-8') as stream:
+            self.assertEqual(json.load(stream), { 'refresh_token': 'refresh-1' })
+
+    def test_failed_write_keeps_the_previous_refresh_token(self):
+        AsyncTadoAdapter(self.temp_dir.name)._write_refresh_token_to_file('refresh-1')
+
+        with mock.patch('os.replace', side_effect = OSError('disk full')), self.assertRaises(OSError):
+            AsyncTadoAdapter(self.temp_dir.name)._write_refresh_token_to_file('refresh-2')
+
+        self.assertEqual(AsyncTadoAdapter(self.temp_dir.name)._read_refresh_token_from_file(), 'refresh-1')
+        self.assertEqual(os.listdir(self.temp_dir.name), ['tado_refresh_token.json'])
+
+    def test_missing_refresh_token_is_none(self):
+        self.assertIsNone(AsyncTadoAdapter(self.temp_dir.name)._read_refresh_token_from_file())
+
+    def test_corrupt_refresh_token_is_none(self):
+        self.write_file('tado_refresh_token.json', '{ "refresh_token": ')
+
+        with self.assertLogs('adapter.tado_async', 'ERROR'):
+            self.assertIsNone(AsyncTadoAdapter(self.temp_dir.name)._read_refresh_token_from_file())
+
+    def test_unknown_zone_is_refreshed_off_the_event_loop(self):
+        TadoAdapter(self.temp_dir.name)._write_zone_ids_to_file({ 'Hall': 1 })
+        tado = TadoAdapter(self.temp_dir.name)
+        tado.tado = FakeTado([{ 'id': 1, 'name': 'Hall' }, { 'id': 3, 'name': 'Office' }])
+
+        async def lookup():
+            return (await tado.get_zone_id('Hall'), await tado.get_zone_id('Office'), await tado.get_zone_name(3),
+                    threading.get_ident())
+
+        hall_id, office_id, office_name, loop_thread = asyncio.run(lookup())
+
+        self.assertEqual((hall_id, office_id, office_name), (1, 3, 'Office'))
+        self.assertEqual(len(tado.tado.threads), 1)
+        self.assertNotEqual(tado.tado.threads[0], loop_thread)
+        self.assertEqual(TadoAdapter(self.temp_dir.name).zone_ids, { 'Hall': 1, 'Office': 3 })
+
+    def test_zone_missing_in_tado_raises_key_error(self):
+        tado = TadoAdapter(self.temp_dir.name)
+        tado.tado = FakeTado([{ 'id': 1, 'name': 'Hall' }])
+
+        with self.assertRaises(KeyError):
+            asyncio.run(tado.get_zone_id('Office'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from datetime import datetime
+from services.core import Boundaries
+from services.jitter import get_offset
+from services.timer import get_next_wakeup
+import unittest
+
+
+NOW = datetime(2025, 11, 19, 10, 7)
+
+
+class GetNextWakeupTest(unittest.TestCase):
+
+    def test_regular_interval_without_limits(self):
+        self.assertEqual(get_next_wakeup(NOW, None, 15), datetime(2025, 11, 19, 10, 15))
+
+    def test_short_interval_while_boundary_is_imminent(self):
+        self.assertEqual(get_next_wakeup(NOW, datetime(2025, 11, 19, 10, 20), 15, 5, 60), datetime(2025, 11, 19, 10, 10))
+
+    def test_long_interval_while_nothing_changes(self):
+        self.assertEqual(get_next_wakeup(NOW, datetime(2025, 11, 19, 18, 0), 15, 5, 60), datetime(2025, 11, 19, 11, 0))
+
+    def test_wakes_up_before_the_next_boundary(self):
+        self.assertEqual(get_next_wakeup(NOW, datetime(2025, 11, 19, 10, 35), 30, 20, 60), datetime(2025, 11, 19, 10, 15))
+
+    def test_ignores_past_boundary_lead(self):
+        self.assertEqual(get_next_wakeup(NOW, datetime(2025, 11, 19, 10, 10), 15, 5, 60), datetime(2025, 11, 19, 10, 10))
+    def test_offset_shifts_the_regular_wakeup(self):
+        self.assertEqual(get_next_wakeup(NOW, None, 15, offset_seconds = 90), datetime(2025, 11, 19, 10, 16, 30))
+        self.assertEqual(get_next_wakeup(datetime(2025, 11, 19, 10, 16, 45), None, 15, offset_seconds = 90),
+                         datetime(2025, 11, 19, 10, 31, 30))
+
+    def test_offset_does_not_delay_the_wakeup_before_a_boundary(self):
+        self.assertEqual(get_next_wakeup(NOW, datetime(2025, 11, 19, 10, 35), 30, 20, 60, offset_seconds = 300),
+                         datetime(2025, 11, 19, 10, 15))
+
+
+class BoundariesTest(unittest.TestCase):
+
+    def test_boundaries_are_looked_up_by_zone(self):
+        boundaries = Boundaries()
+        boundaries.update({ datetime(2025, 11, 19, 10, 10): { 'Hall' }, datetime(2025, 11, 19, 10, 30): { 'Hall', 'Chapel' },
+                            datetime(2025, 11, 19, 12, 0): { 'Office' } })
+
+        self.assertEqual(boundaries.get_next(NOW), datetime(2025, 11, 19, 10, 10))
+        self.assertEqual(boundaries.get_next(NOW, { 'Chapel' }), datetime(2025, 11, 19, 10, 30))
+        self.assertIsNone(boundaries.get_next(NOW, { 'Garage' }))
+        self.assertEqual(boundaries.get_zones(NOW, datetime(2025, 11, 19, 10, 30)), { 'Hall', 'Chapel' })
+        self.assertEqual(boundaries.get_zones(NOW, datetime(2025, 11, 19, 10, 20)), { 'Hall' })
+
+
+class GetOffsetTest(unittest.TestCase):
+
+    def test_offset_is_deterministic_and_within_limit(self):
+        offsets = [get_offset(f'instance-{i}', 120) for i in range(100)]
+
+        self.assertEqual(offsets, [get_offset(f'instance-{i}', 120) for i in range(100)])
+        self.assertTrue(all(0 <= o < 120 for o in offsets))
+        self.assertGreater(len(set(offsets)), 90)
+
+    def test_no_offset_without_limit(self):
+        self.assertEqual(get_offset('instance', None), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from aiohttp.test_utils import TestClient, TestServer
+import asyncio
+from adapter.sqlitestore import SQLiteStore
+from datetime import datetime, timedelta
+from models.settings import CoreSettings
+import os
+from services.core import Message, Worker
+from services.fetch import FetchStage
+from services.metrics import Registry, Service
+from services.recording import ReplayTadoAdapter
+from services.webhook import Webhook
+import tempfile
+import unittest
+import yaml
+
+
+def create_ics(from_date, hour: int) -> bytes:
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for day in range(0, 7):
+        start = datetime.combine(from_date + timedelta(days = day), datetime.min.time()) + timedelta(hours = hour)
+        lines += ['BEGIN:VEVENT', f'UID:{day}@example.org', f'DTSTART:{start.strftime("%Y%m%dT%H%M%S")}',
+                  f'DTEND:{(start + timedelta(hours = 2)).strftime("%Y%m%dT%H%M%S")}', 'SUMMARY:Service', 'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines).encode('utf-8')
+
+
+def post(service: Service, path: str) -> int:
+    async def post() -> int:
+        async with TestClient(TestServer(service.create_app())) as client:
+            return (await client.post(path)).status
+    return asyncio.run(post())
+
+
+class WebhookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings = {
+            'ical_calendars': [{ 'name': name, 'source': os.path.join(self.temp_dir.name, f'{name}.ics') }
+                               for name in ('Hall', 'Chapel')],
+            'heating': { 'warm': 20.0, 'cold': 16.0, 'earlystart': '00:30' },
+            'assignments': [{ 'tadozone': 'Hall', 'calendar_names': ['Hall'] },
+                            { 'tadozone': 'Chapel', 'calendar_names': ['Chapel'] }],
+        }
+        self.write_ics('Hall', 9)
+        self.write_ics('Chapel', 9)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_ics(self, name: str, hour: int) -> None:
+        with open(os.path.join(self.temp_dir.name, f'{name}.ics'), 'wb') as stream:
+            stream.write(create_ics(datetime.now().date(), hour))
+
+    def create_webhook(self, token: str = None) -> tuple[Webhook, asyncio.Queue]:
+        config_file = os.path.join(self.temp_dir.name, 'config.yaml')
+        with open(config_file, 'w', encoding='utf-8') as stream:
+            yaml.safe_dump(self.settings, stream)
+        queue = asyncio.Queue()
+        return (Webhook({ '': (config_file, queue) }, token), queue)
+
+    def test_changed_calendar_is_enqueued_for_the_homes_using_it(self):
+        webhook, queue = self.create_webhook()
+
+        self.assertEqual(webhook.notify({ 'Hall', 'Unknown' }, set()), { '': { 'Hall' } })
+        self.assertEqual(queue.get_nowait().changed_calendars, { 'Hall' })
+        self.assertEqual(webhook.notify({ 'Unknown' }, { 'churchtools' }), {})
+        self.assertTrue(queue.empty())
+
+    def test_token_is_required(self):
+        webhook, _ = self.create_webhook('secret')
+
+        self.assertTrue(webhook.is_authorized('Bearer secret', None))
+        self.assertTrue(webhook.is_authorized(None, 'secret'))
+        self.assertFalse(webhook.is_authorized('Bearer wrong', 'secret'))
+        self.assertFalse(webhook.is_authorized(None, None))
+
+    def test_webhook_is_disabled_without_a_token(self):
+        webhook, _ = self.create_webhook()
+
+        self.assertFalse(webhook.is_authorized(None, None))
+        self.assertFalse(webhook.is_authorized('Bearer ', ''))
+        self.assertEqual(post(Service(0, registry = Registry(), webhook = webhook), '/changed?calendar=Hall'), 404)
+        self.assertEqual(post(Service(0, registry = Registry(), webhook = self.create_webhook('secret')[0]),
+                              '/changed?calendar=Hall&token=secret'), 202)
+
+    def test_changed_calendar_updates_only_its_zones(self):
+        settings = CoreSettings(**self.settings)
+        store = SQLiteStore(os.path.join(self.temp_dir.name, 'store'))
+        fetch_stage = FetchStage()
+        zone_ids = { 'Hall': 1, 'Chapel': 2 }
+
+        async def execute(message: Message) -> ReplayTadoAdapter:
+            tado = ReplayTadoAdapter(zone_ids)
+            await Worker(settings, tado, store, fetch_stage = fetch_stage).execute(message)
+            return tado
+
+        try:
+            self.assertEqual(len(asyncio.run(execute(Message(full_update = True))).schedules), 14)
+            self.write_ics('Hall', 10)
+            self.write_ics('Chapel', 10)
+
+            # the sources are not due, only the reported one is fetched
+            tado = asyncio.run(execute(Message(changed_calendars = { 'Hall' })))
+            self.assertEqual(set(zone for zone, _ in tado.schedules), { 'Hall' })
+            self.assertEqual(len(tado.schedules), 7)
+
+            tado = asyncio.run(execute(Message(changed_calendars = { 'Chapel' })))
+            self.assertEqual(set(zone for zone, _ in tado.schedules), { 'Chapel' })
+
+            # the sent schedules of the zones not updated in a run are kept
+            self.assertEqual(asyncio.run(execute(Message(config_changed = True))).schedules, {})
+
+            # a day deferred by a previous run is sent, although no calendar has updates
+            store.write_deferred_zone_days({ ('Chapel', 3) })
+            tado = asyncio.run(execute(Message(changed_calendars = { 'Hall' })))
+            self.assertEqual(list(tado.schedules), [('Chapel', 3)])
+            self.assertEqual(store.read_deferred_zone_days(), set())
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from datetime import date, datetime, time, timedelta
+from dateutil import tz
+from models.events import Event
+from models.schedules import get_weekly_schedules
+from models.weekgrid import get_weekly_schedules_for_zones
+import os
+import random
+import time as time_module
+import unittest
+
+
+def create_event(start: datetime, minutes: int) -> Event:
+    return Event(start = start.replace(tzinfo = tz.tzlocal()), end = (start + timedelta(minutes = minutes)).replace(tzinfo = tz.tzlocal()),
+                 name = 'Booking')
+
+
+def create_random_events(from_date: date, count: int, seed: int) -> list[Event]:
+    # overlapping, following each other and lasting over midnight, in 5 minute steps
+    rng = random.Random(seed)
+    start = datetime.combine(from_date - timedelta(days = 1), time.min)
+    return [create_event(start + timedelta(minutes = 5 * rng.randrange(0, 9 * 288)), 5 * rng.randrange(1, 100))
+            for _ in range(0, count)]
+
+
+class WeekGridTest(unittest.TestCase):
+
+    def assertSameSchedules(self, from_date: date, zones: list) -> None:
+        self.assertEqual(get_weekly_schedules_for_zones(from_date, zones),
+                         [get_weekly_schedules(from_date, *zone) for zone in zones])
+
+    def test_schedules_equal_the_ones_of_from_events(self):
+        from_date = date(2025, 11, 17)
+
+        self.assertSameSchedules(from_date, [
+            (create_random_events(from_date, 60, 1), 20.0, 16.0, time(0, 30)),
+            (create_random_events(from_date, 20, 2), 21.0, None, None),
+            ([], 20.0, 16.0, time(1)),
+            (create_random_events(from_date, 10, 3), 16.0, 16.0, None)])
+
+    def test_event_over_midnight_is_split(self):
+        event = create_event(datetime(2025, 11, 17, 23, 15), 65)
+
+        self.assertSameSchedules(date(2025, 11, 17), [([event], 20.0, 16.0, None), ([event], 20.0, 16.0, time(0, 45))])
+
+    def test_days_with_events_off_the_slots_are_calculated_by_from_events(self):
+        events = [create_event(datetime(2025, 11, 18, 9, 3), 57), create_event(datetime(2025, 11, 19, 9), 60)]
+
+        self.assertSameSchedules(date(2025, 11, 17), [(events, 20.0, 16.0, time(0, 7)), (events, 20.0, 16.0, None)])
+
+    def test_days_of_daylight_saving_time_changes(self):
+        timezone = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Berlin'
+        time_module.tzset()
+        try:
+            for from_date in (date(2025, 3, 27), date(2025, 10, 23)):
+                self.assertSameSchedules(from_date, [(create_random_events(from_date, 80, 4), 20.0, 16.0, time(0, 30))])
+        finally:
+            if timezone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = timezone
+            time_module.tzset()
+
+
+if __name__ == '__main__':
+    unittest.main()